@@ -32,6 +32,7 @@ class Client(jank.Application):
         self.player = None
 
         self.client = jank.networking.Client()
+        self.client.interned_protocols = True
         self.client.push_handlers(self)
 
         self.client.register_protocol(self.username_taken)
@@ -14,6 +14,7 @@ class Server(jank.Application):
         self.usernames = {}
 
         self.server = jank.networking.Server()
+        self.server.interned_protocols = True
         self.server.push_handlers(self)
 
         self.server.register_protocol(self.choose_username)
@@ -62,6 +63,8 @@ class Server(jank.Application):
     def on_fixed_update(self, dt):
         for _ in range(10):
             self.physics_space.step(1/1200)
+
+    def on_network_update(self, dt):
         positions = {
             username: {
                 "position": tuple(player.position),
@@ -23,7 +23,8 @@ class Application:
         config: Config = Config(),
         windowless: bool = False,
         debug_mode: bool = False,
-        show_fps: bool = False
+        show_fps: bool = False,
+        network_stats: t.Optional["jank.networking.stats.NetworkStats"] = None
     ):
         self._handlers = []
 
@@ -37,6 +38,9 @@ class Application:
         self.windowless = windowless
         self.debug_mode = debug_mode
         self.show_fps = show_fps
+        self.network_stats = network_stats
+        # Runs fixed updates in lockstep with other players when set.
+        self.lockstep: t.Optional["jank.networking.lockstep.Lockstep"] = None
 
         self.physics_space = pymunk.Space()
 
@@ -52,6 +56,10 @@ class Application:
         self.fps_display = jank.pyglet.window.FPSDisplay(window=self.window)
         if self.config.fps_label is not None:
             self.fps_display.label = self.config.fps_label
+        if self.network_stats is not None:
+            self.network_stats_display = jank.networking.stats.StatsDisplay(
+                self.network_stats, self.window
+            )
 
         self.key_handler = key.KeyStateHandler()
         self.mouse_handler = mouse.MouseStateHandler()
@@ -105,6 +113,9 @@ class Application:
             if config.fps_label is not None:
                 self.fps_display.label = config.fps_label
 
+        if hasattr(self, "network_stats_display"):
+            self.network_stats_display.window = window
+
         if config.fullscreen:
             window.set_fullscreen(config.fullscreen)
 
@@ -185,6 +196,8 @@ class Application:
         self.ui_batch.draw()
         if self.show_fps:
             self.fps_display.draw()
+        if self.network_stats is not None:
+            self.network_stats_display.draw()
 
     def create_layers(self, world_layers: t.List[str], ui_layers: t.List[str]):
         self.world_layers = {}
@@ -207,7 +220,14 @@ class Application:
         """ Called as frequently as possible. Update input/graphics here. """
 
     def on_fixed_update(self, dt: float):
-        """ Called 120 times a second at a fixed rate. Update physics here. """
+        """ Called `config.fixed_update_rate` (default 120) times a second.
+        Update physics here.
+        """
+
+    def on_network_update(self, dt: float):
+        """ Called `config.network_update_rate` (default 20) times a second.
+        Send network updates here.
+        """
 
     def queue_hard(self, func: t.Callable[..., t.Any], fixed_update: bool, *args, **kwargs):
         """ Adds a function to the hard queue. """
@@ -240,6 +260,22 @@ class Application:
                 handler.on_update(dt)
 
     def _fixed_update(self, dt: float):
+        if self.lockstep is None:
+            self._fixed_step(dt)
+            return
+
+        # Lockstep ticks all last the same time, and only run once every
+        # player's inputs for them have arrived.
+        dt = 1/self.config.fixed_update_rate
+        for _ in range(1 + self.lockstep.catch_up):
+            if not self.lockstep.begin_tick():
+                break
+            self._fixed_step(dt)
+            self.lockstep.end_tick(self.physics_space)
+            if not self.lockstep.behind:
+                break
+
+    def _fixed_step(self, dt: float):
         if not self._function_queue_soft_fixed.empty():
             func = self._function_queue_soft_fixed.get_nowait()
             func[0](*func[1], **func[2])
@@ -253,7 +289,14 @@ class Application:
             if hasattr(handler, "on_fixed_update") and handler is not self:
                 handler.on_fixed_update(dt)
 
+    def _network_update(self, dt: float):
+        self.on_network_update(dt)
+        for handler in self._handlers:
+            if hasattr(handler, "on_network_update") and handler is not self:
+                handler.on_network_update(dt)
+
     def run(self):
-        jank.clock.schedule_interval(self._fixed_update, 1/120)
+        jank.clock.schedule_interval(self._fixed_update, 1/self.config.fixed_update_rate)
+        jank.clock.schedule_interval(self._network_update, 1/self.config.network_update_rate)
         jank.clock.schedule(self._update)
         jank.pyglet.app.run()
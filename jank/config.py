@@ -18,5 +18,8 @@ class Config:
     bilinear_filtering: bool = False
     antialiasing: t.Optional[int] = None
     fps_label: t.Optional[jank.pyglet.text.Label] = None
+    # Times a second on_fixed_update (physics) and on_network_update run.
+    fixed_update_rate: float = 120
+    network_update_rate: float = 20
     world_layers: t.List[str] = field(default_factory=list)
     ui_layers: t.List[str] = field(default_factory=list)
@@ -47,7 +47,9 @@ class Entity:
         """ Called as frequently as possible. Update input/graphics here. """
 
     def on_fixed_update(self, dt: float):
-        """ Called 120 times a second at a fixed rate. Update physics here. """
+        """ Called `config.fixed_update_rate` (default 120) times a second.
+        Update physics here.
+        """
 
     def position_func(
         self,
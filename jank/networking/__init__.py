@@ -1,9 +1,51 @@
-from . import encoders
+from . import (
+    buffers, compressors, encoders, fragments, framings, interest, interpolation,
+    lockstep, netsim, prediction, protocols, reliability, replication, sharding, stats
+)
+from .async_client import AsyncClient
+from .async_server import AsyncServer
 from .client import Client
+from .interest import InterestManager
+from .interpolation import Interpolator
+from .lockstep import Lockstep, LockstepRelay
+from .message import Message
+from .netsim import NetworkConditions
+from .prediction import InputTracker, Predictor
+from .replication import ReplicationReceiver, Replicator
 from .server import Server
+from .sharding import ShardRouter
+from .stats import NetworkStats
 
 __all__ = [
+    "buffers",
+    "compressors",
     "encoders",
+    "fragments",
+    "framings",
+    "interest",
+    "interpolation",
+    "lockstep",
+    "netsim",
+    "prediction",
+    "protocols",
+    "reliability",
+    "replication",
+    "sharding",
+    "stats",
+    "AsyncClient",
+    "AsyncServer",
     "Client",
+    "InputTracker",
+    "InterestManager",
+    "Interpolator",
+    "Lockstep",
+    "LockstepRelay",
+    "Message",
+    "NetworkConditions",
+    "NetworkStats",
+    "Predictor",
+    "ReplicationReceiver",
+    "Replicator",
     "Server",
+    "ShardRouter",
 ]
@@ -0,0 +1,172 @@
+import asyncio
+import socket
+import typing as t
+from queue import Queue
+
+from . import fragments
+from .buffers import ReceiveBuffer
+from .client import Client
+from .reliability import ReliableEndpoint
+
+
+class _TCPProtocol(asyncio.Protocol):
+    def __init__(self, client: "AsyncClient"):
+        self.client = client
+
+    def data_received(self, data: bytes):
+        try:
+            self.client._data_received(data)
+        except ConnectionResetError as e:
+            self.connection_lost(e)
+
+    def connection_lost(self, exc: t.Optional[Exception]):
+        if exc is not None:
+            print(f"""
+Connection to server was reset:
+    {exc}
+
+""")
+        if self.client.connected:
+            self.client.disconnect(end_session=False)
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client: "AsyncClient"):
+        self.client = client
+
+    def datagram_received(self, data: bytes, address: t.Tuple[str, int]):
+        self.client._handle_datagram(data, address)
+
+    def error_received(self, exc: Exception):
+        print(f"""
+Failed to send packet to client:
+    {exc}
+    Make sure that UDP is enabled on the server.
+
+""")
+
+
+class AsyncClient(Client):
+    """ A Client driven by an asyncio event loop instead of threads.
+
+    Inside a running loop, use `await start(...)` and `await stop()`.
+    Otherwise `connect` creates a private loop which must be stepped with
+    `poll`, e.g. `jank.clock.schedule(client.poll)`.
+    """
+    loop: t.Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(
+        self,
+        address: str,
+        port: int,
+        enable_udp: bool = False,
+        room: t.Optional[str] = None
+    ):
+        self._address = address
+        self._port = port
+        self._recv_buffer = ReceiveBuffer(
+            self.framing, compressor=self.compressor, max_message_size=self.max_message_size
+        )
+        self._message_queue = Queue(maxsize=self.message_queue_size)
+        self._reliable_endpoint = ReliableEndpoint(self.resend_timeout)
+        self._server_protocols = None
+        self._reassembler = fragments.Reassembler(self.fragment_timeout)
+        self.stats.reset()
+
+        self.loop = asyncio.get_running_loop()
+        self._transport_tcp, _ = await self.loop.create_connection(
+            lambda: _TCPProtocol(self),
+            self._address, self._port,
+            family=socket.AF_INET
+        )
+        self._server_address = self._transport_tcp.get_extra_info("peername")
+        self._server_udp_address = self._server_address
+        if room is not None:
+            self.send("_join_room", {"room": room})
+        if self.interned_protocols:
+            self._send_protocol_table()
+        if self.sessions:
+            self.send("_resume", {"token": self._session_token})
+
+        if enable_udp:
+            self._transport_udp, _ = await self.loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self),
+                local_addr=("0.0.0.0", 0),
+                family=socket.AF_INET
+            )
+            _, port = self._transport_udp.get_extra_info("sockname")
+            self.send("_assign_udp_port", {"port": port})
+            self.send("_assign_udp_port", {"port": port}, network_protocol=self.UDP)
+
+        self.connected = True
+        self.udp_enabled = enable_udp
+
+        if enable_udp:
+            self.loop.call_later(self.resend_interval, self._reliability_tick)
+        if self.statistics:
+            self.loop.call_later(self.ping_interval, self._ping_tick)
+
+        self.dispatch_event("on_connection", self._transport_tcp)
+
+    async def stop(self):
+        self.disconnect()
+        await asyncio.sleep(0)
+
+    def connect(
+        self,
+        address: str,
+        port: int,
+        enable_udp: bool = False,
+        room: t.Optional[str] = None
+    ):
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.start(address, port, enable_udp, room))
+
+    def disconnect(self, end_session: bool = True):
+        if end_session:
+            self._end_session()
+        self.connected = False
+
+        self._transport_tcp.close()
+        if self.udp_enabled:
+            self._transport_udp.close()
+        self.udp_enabled = False
+
+        self.dispatch_event("on_disconnection", self._transport_tcp)
+
+    def poll(self, dt: float = 0):
+        """ Process all pending network events on a private loop. """
+        if self.loop.is_running():
+            return
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def _reliability_tick(self):
+        if self.connected and self.udp_enabled:
+            self._resend_reliable()
+            self.loop.call_later(self.resend_interval, self._reliability_tick)
+
+    def _ping_tick(self):
+        if self.connected:
+            self.ping()
+            self.loop.call_later(self.ping_interval, self._ping_tick)
+
+    def _transmit(
+        self,
+        write: t.Callable[..., t.Any],
+        args: tuple,
+        size: int,
+        stream: t.Optional[t.Hashable] = None
+    ):
+        if self.conditions is None:
+            write(*args)
+        else:
+            # Transports must only be written to from the loop's thread.
+            self.conditions.submit(self.loop.call_soon_threadsafe, (write, *args), size, stream)
+
+    def _write_tcp(self, data: bytes):
+        self._transport_tcp.write(data)
+
+    def _write_udp(self, data: bytes):
+        self._transport_udp.sendto(data, self._server_udp_address)
@@ -0,0 +1,175 @@
+import asyncio
+import socket
+import typing as t
+
+from .server import Server
+
+
+class _TCPProtocol(asyncio.Protocol):
+    def __init__(self, server: "AsyncServer"):
+        self.server = server
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.address = transport.get_extra_info("peername")
+        self.server._add_client(self.transport, self.address)
+
+    def data_received(self, data: bytes):
+        try:
+            self.server._data_received(self.transport, data)
+        except ConnectionResetError as e:
+            self.connection_lost(e)
+            self.transport.abort()
+
+    def connection_lost(self, exc: t.Optional[Exception]):
+        if exc is not None:
+            print(f"""
+Connection from {self.address[0]}:{self.address[1]} was reset:
+    {exc}
+
+""")
+        if self.address in self.server.clients.keys():
+            self.server._remove_client(self.transport, self.address)
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: "AsyncServer"):
+        self.server = server
+
+    def datagram_received(self, data: bytes, address: t.Tuple[str, int]):
+        if self.server.connected:
+            self.server._handle_datagram(data, address)
+
+    def error_received(self, exc: Exception):
+        print(f"""
+Failed to send packet to client:
+    {exc}
+    Make sure that UDP is enabled on the server.
+
+""")
+
+
+class AsyncServer(Server):
+    """ A Server driven by an asyncio event loop instead of threads.
+
+    Inside a running loop, use `await start(...)` and `await stop()`.
+    Otherwise `connect` creates a private loop which must be stepped with
+    `poll`, e.g. `jank.clock.schedule(server.poll)`.
+    Client "sockets" passed to protocols and events are asyncio transports.
+    """
+    loop: t.Optional[asyncio.AbstractEventLoop] = None
+    _backpressured: t.Set[asyncio.Transport] = set()
+
+    async def start(self, address: str, port: int, enable_udp: bool = False):
+        self._address = address
+        self._port = port
+
+        self._reset_state()
+        self.stats.reset()
+        self.connected = True
+        self.udp_enabled = enable_udp
+
+        self.loop = asyncio.get_running_loop()
+        self._server_tcp = await self.loop.create_server(
+            lambda: _TCPProtocol(self),
+            self._address, self._port,
+            family=socket.AF_INET,
+            reuse_address=True
+        )
+        print(f"Listening on {self._address}:{self._port}.")
+
+        if self.udp_enabled:
+            self._transport_udp, _ = await self.loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self),
+                local_addr=self._server_tcp.sockets[0].getsockname(),
+                family=socket.AF_INET
+            )
+            self.loop.call_later(self.resend_interval, self._reliability_tick)
+        if self.statistics:
+            self.loop.call_later(self.ping_interval, self._ping_tick)
+
+    async def stop(self):
+        self.disconnect()
+        await self._server_tcp.wait_closed()
+
+    def connect(self, address: str, port: int, enable_udp: bool = False):
+        if self.loop is None or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.start(address, port, enable_udp))
+
+    def disconnect(self):
+        self.connected = False
+
+        self._server_tcp.close()
+        if self.udp_enabled:
+            self._transport_udp.close()
+        self.udp_enabled = False
+
+        for transport in list(self.clients.values()):
+            transport.close()
+
+        self._reset_state()
+        self._end_sessions()
+
+    def _reset_state(self):
+        super()._reset_state()
+        self._backpressured = set()
+
+    def poll(self, dt: float = 0):
+        """ Process all pending network events on a private loop. """
+        if self.loop.is_running():
+            return
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+    def _reliability_tick(self):
+        if self.connected and self.udp_enabled:
+            self._resend_reliable()
+            self.loop.call_later(self.resend_interval, self._reliability_tick)
+
+    def _ping_tick(self):
+        if self.connected:
+            self.ping()
+            self.loop.call_later(self.ping_interval, self._ping_tick)
+
+    def _transmit(
+        self,
+        write: t.Callable[..., t.Any],
+        args: tuple,
+        size: int,
+        stream: t.Optional[t.Hashable] = None
+    ):
+        if self.conditions is None:
+            write(*args)
+        else:
+            # Transports must only be written to from the loop's thread.
+            self.conditions.submit(self.loop.call_soon_threadsafe, (write, *args), size, stream)
+
+    def _queue_tcp(self, transport: asyncio.Transport, protocol: str, data: bytes):
+        # Transports already buffer writes, so apply the limit to their
+        # buffer. Queued data can't be coalesced, COALESCE drops instead.
+        queued = transport.get_write_buffer_size()
+        if queued + len(data) > self.send_queue_limit:
+            if transport not in self._backpressured:
+                self._backpressured.add(transport)
+                self.dispatch_event("on_backpressure", transport, queued)
+            if self.overflow_policy == self.DISCONNECT:
+                self._shutdown_client(transport)
+            return
+
+        self._backpressured.discard(transport)
+        transport.write(data)
+
+    def _shutdown_client(self, transport: asyncio.Transport):
+        transport.abort()
+
+    def _schedule_expiry(self, token: str) -> asyncio.TimerHandle:
+        # Expire on the loop so on_disconnection handlers can write to
+        # transports.
+        return self.loop.call_later(self.session_grace, self._expire_session, token)
+
+    def _write_tcp(self, transport: asyncio.Transport, data: bytes):
+        transport.write(data)
+
+    def _write_udp(self, data: bytes, address: t.Tuple[str, int]):
+        self._transport_udp.sendto(data, address)
@@ -0,0 +1,179 @@
+import collections
+import select
+import socket
+import struct
+import threading
+import typing as t
+
+from . import compressors, framings
+
+
+class ReceiveBuffer:
+    """ Preallocated TCP receive buffer.
+
+    Bytes are read straight into the buffer with `recv_into`, and every
+    complete frame is yielded by `messages` as a memoryview into it, so a
+    single read can produce many messages without intermediate copies.
+    Yielded views are only valid until the next read. Compressed frames
+    are decompressed with `compressor` and yielded as bytes.
+    A frame claiming more than `max_message_size` bytes, with a malformed
+    header, or decompressing to an invalid or oversized message raises
+    ConnectionResetError so the peer is dropped.
+    """
+    # Free space made before each read, the buffer otherwise only grows
+    # with the data actually received.
+    read_size: int = 4096
+
+    def __init__(
+        self,
+        framing: framings.Framing,
+        size: int = 65536,
+        compressor: t.Optional[compressors.Compressor] = None,
+        max_message_size: int = 1 << 24
+    ):
+        self.framing = framing
+        self.compressor = compressor
+        self.max_message_size = max_message_size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def recv_into(self, socket: socket.socket) -> int:
+        self._reserve(self.read_size)
+        received = socket.recv_into(self._view[self._end:])
+        if received == 0:
+            raise ConnectionResetError("Connection closed by peer.")
+        self._end += received
+        return received
+
+    def feed(self, data: bytes):
+        self._reserve(len(data))
+        self._view[self._end:self._end+len(data)] = data
+        self._end += len(data)
+
+    def messages(self) -> t.Iterator[t.Union[bytes, memoryview]]:
+        header_size = self.framing.header_size
+        while self._end - self._start >= header_size:
+            try:
+                length, flags = self.framing.unpack_header(self._view, self._start)
+            except (ValueError, struct.error):
+                raise ConnectionResetError("Received a malformed message header.")
+            if length < 0 or length > self.max_message_size:
+                raise ConnectionResetError(
+                    f"Message of {length} bytes exceeds the limit of {self.max_message_size}."
+                )
+
+            start = self._start + header_size
+            end = start + length
+            if end > self._end:
+                break
+
+            self._start = end
+            if not flags & self.framing.COMPRESSED:
+                yield self._view[start:end]
+            elif self.compressor is None:
+                print("Received a compressed message but no compressor is set, discarding.")
+            else:
+                try:
+                    message = self.compressor.decompress(
+                        self._view[start:end], self.max_message_size
+                    )
+                except ValueError as e:
+                    raise ConnectionResetError(str(e))
+                yield message
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _reserve(self, size: int):
+        """ Ensure at least `size` free bytes follow the buffered data. """
+        if len(self._buffer) - self._end >= size:
+            return
+
+        pending = self._end - self._start
+        if pending + size <= len(self._buffer):
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            buffer = bytearray(max(len(self._buffer) * 2, pending + size))
+            buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = pending
+
+
+def send_nowait(sock: socket.socket, data: t.Union[bytes, memoryview]) -> int:
+    """ Send what fits in the socket's buffer without blocking, raising
+    BlockingIOError if nothing does. Works on blocking sockets, so another
+    thread can keep blocking on reads.
+    """
+    if hasattr(socket, "MSG_DONTWAIT"):
+        return sock.send(data, socket.MSG_DONTWAIT)
+
+    _, writable, _ = select.select([], [sock], [], 0)
+    if not writable:
+        raise BlockingIOError("Socket is not writable.")
+    return sock.send(data)
+
+
+class SendQueue:
+    """ Outgoing TCP frames for one socket, written without blocking.
+
+    A partially written frame is always finished first, and whole frames
+    still waiting can be dropped by protocol with `coalesce`.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.socket = sock
+        self.size = 0
+        self.over_limit = False
+        self._frames: t.Deque[t.List[t.Any]] = collections.deque()
+        self._head_started = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, protocol: str, frame: bytes):
+        with self._lock:
+            self._frames.append([protocol, memoryview(frame)])
+            self.size += len(frame)
+
+    def coalesce(self, protocol: str) -> int:
+        """ Drop waiting frames of `protocol`, returning the bytes freed. """
+        with self._lock:
+            start = 1 if self._head_started else 0
+            kept = collections.deque(list(self._frames)[:start])
+            freed = 0
+            for frame in list(self._frames)[start:]:
+                if frame[0] == protocol:
+                    freed += len(frame[1])
+                else:
+                    kept.append(frame)
+            self._frames = kept
+            self.size -= freed
+            return freed
+
+    def write(self) -> int:
+        """ Write as much as the socket accepts, returning the bytes sent. """
+        with self._lock:
+            sent_total = 0
+            while self._frames:
+                frame = self._frames[0]
+                try:
+                    sent = send_nowait(self.socket, frame[1])
+                except BlockingIOError:
+                    break
+                sent_total += sent
+                self.size -= sent
+                if sent < len(frame[1]):
+                    frame[1] = frame[1][sent:]
+                    self._head_started = True
+                    break
+                self._frames.popleft()
+                self._head_started = False
+            return sent_total
@@ -1,30 +1,109 @@
+import itertools
 import socket
 import threading
+import time
 import typing as t
+from queue import Empty, Full, Queue
 
 import jank
-from . import encoders
+from . import compressors, encoders, fragments, framings
+from .buffers import ReceiveBuffer
+from .netsim import NetworkConditions
+from .protocols import ProtocolTable
+from .reliability import ReliableEndpoint
+from .stats import NetworkStats
 
 
 class Client(jank.pyglet.event.EventDispatcher):
     TCP: int = 1
     UDP: int = 2
+    # Acknowledged, resent and ordered per channel over the UDP socket.
+    RELIABLE: int = 3
+    IMMEDIATE: int = 0
+    UPDATE: int = 1
+    FIXED_UPDATE: int = 2
+    NETWORK_UPDATE: int = 3
 
-    _header_size: int = 32
     _address: t.Optional[str] = None
     _port: t.Optional[int] = None
+    _server_address: t.Optional[t.Tuple[str, int]] = None
+    _server_udp_address: t.Optional[t.Tuple[str, int]] = None
+    _session_token: t.Optional[str] = None
+    _server_protocols: t.Optional[ProtocolTable] = None
     _protocols: t.Dict[str, t.Callable[..., t.Any]] = {}
 
     connected: bool = False
     udp_enabled: bool = False
     udp_buffer: int = 2048
+    # UDP messages over `fragment_size` bytes are split into fragments,
+    # small enough to fit in a typical 1500 byte MTU, and reassembled by
+    # the receiver. A message is lost if any of its fragments don't arrive
+    # within `fragment_timeout` seconds. None sends each message as one
+    # datagram, which must then fit in the receiver's `udp_buffer`.
+    fragment_size: t.Optional[int] = 1200
+    fragment_timeout: float = 1.0
     encoder: encoders.Encoder = encoders.JsonEncoder
+    framing: framings.Framing = framings.AsciiFraming
+    # Compresses TCP messages over the compressor's size threshold.
+    # The server must use the same compressor.
+    compressor: t.Optional[compressors.Compressor] = None
+    # TCP messages claiming to be larger than this many bytes are refused
+    # and their sender disconnected.
+    max_message_size: int = 1 << 24
+    # Where protocol handlers run. IMMEDIATE runs them on the socket
+    # threads, UPDATE, FIXED_UPDATE and NETWORK_UPDATE queue decoded
+    # messages to be run by `process_messages` from the matching event, so
+    # push this onto the application. The queue holds `message_queue_size`
+    # messages, further messages are dropped without blocking the socket
+    # threads and counted in `stats`.
+    dispatch_mode: int = IMMEDIATE
+    message_queue_size: int = 4096
+    message_budget: int = 256
+    resend_interval: float = 0.05
+    resend_timeout: float = 0.1
+    # Count traffic into `stats`, and ping the server every
+    # `ping_interval` seconds to measure RTT and UDP loss.
+    statistics: bool = False
+    ping_interval: float = 1.0
+    # Simulated latency, loss etc. applied to outgoing writes, for testing.
+    conditions: t.Optional[NetworkConditions] = None
+    # Resume the server-side session when reconnecting after the connection
+    # dropped, see Server.sessions. on_resume is dispatched once the server
+    # has reattached this client to its previous state.
+    sessions: bool = False
+    # Send protocols by integer ID once the server's table arrives, and
+    # send the server ours, see Server.interned_protocols.
+    interned_protocols: bool = False
+
+    def __init__(self):
+        self._protocols = {}
+        self._protocol_ids = ProtocolTable()
+        self._recv_buffer = ReceiveBuffer(
+            self.framing, compressor=self.compressor, max_message_size=self.max_message_size
+        )
+        self._message_queue: Queue = Queue(maxsize=self.message_queue_size)
+        self._reliable_endpoint = ReliableEndpoint(self.resend_timeout)
+        self._fragment_ids = itertools.count()
+        self._reassembler = fragments.Reassembler(self.fragment_timeout)
+        self.stats = NetworkStats()
+
+        self.register_protocol(self._encoder_handshake)
+        self.register_protocol(self._batch)
+        self.register_protocol(self._reliable)
+        self.register_protocol(self._ping)
+        self.register_protocol(self._pong)
+        self.register_protocol(self._udp_address)
+        self.register_protocol(self._session)
+        self.register_protocol(self._protocol_table)
 
     def register_protocol(self, func: t.Callable[..., t.Any], name: t.Optional[str] = None):
         if name is None:
             name = func.__name__
 
         self._protocols[name] = func
+        self._protocol_ids.register(name, func)
+        if self.connected and self.interned_protocols:
+            self._send_protocol_table()
 
         return func
 
@@ -34,40 +113,144 @@ class Client(jank.pyglet.event.EventDispatcher):
     def on_disconnection(self, socket):
         """ Called on disconnection. """
 
-    def send(self, protocol: str, data: t.Optional[dict] = None, network_protocol: int = TCP):
-        if network_protocol != self.TCP and network_protocol != self.UDP:
-            raise TypeError("Invalid network_protocol type. Must be TCP or UDP.")
+    def on_resume(self):
+        """ Called when the server resumed our previous session. """
+
+    def on_update(self, dt: float):
+        """ Runs queued messages when pushed onto the application. """
+        if self.dispatch_mode == self.UPDATE:
+            self.process_messages()
+
+    def on_fixed_update(self, dt: float):
+        """ Runs queued messages when pushed onto the application. """
+        if self.dispatch_mode == self.FIXED_UPDATE:
+            self.process_messages()
+
+    def on_network_update(self, dt: float):
+        """ Runs queued messages when pushed onto the application. """
+        if self.dispatch_mode == self.NETWORK_UPDATE:
+            self.process_messages()
+
+    def process_messages(self, budget: t.Optional[int] = None) -> int:
+        """ Run up to `budget` queued messages, returning how many ran. """
+        if budget is None:
+            budget = self.message_budget
+
+        processed = 0
+        while processed < budget:
+            try:
+                data = self._message_queue.get_nowait()
+            except Empty:
+                break
+            self._call_protocol(data)
+            processed += 1
+        return processed
+
+    def send(
+        self,
+        protocol: str,
+        data: t.Optional[dict] = None,
+        network_protocol: int = TCP,
+        channel: int = 0
+    ):
+        if network_protocol not in (self.TCP, self.UDP, self.RELIABLE):
+            raise TypeError("Invalid network_protocol type. Must be TCP, UDP or RELIABLE.")
 
         if data is None:
             data = {}
-        message = self.encoder.encode({
-            "protocol": protocol,
-            "data": data
-        })
+
+        if network_protocol == self.RELIABLE:
+            packet = self._reliable_endpoint.send(
+                {"protocol": protocol, "data": data},
+                channel
+            )
+            self.send("_reliable", packet, network_protocol=self.UDP)
+            return
+
+        message = None
+        if self._server_protocols is not None and not self.encoder.packs(protocol):
+            message = self._server_protocols.intern(protocol, data)
+        if message is None:
+            message = {"protocol": protocol, "data": data}
+
+        start = time.perf_counter()
+        message = self.encoder.encode(message)
+        if self.statistics:
+            self.stats.encoded(time.perf_counter() - start, protocol)
 
         if network_protocol == self.TCP:
-            header = bytes(f"{len(message):<{self._header_size}}", "utf-8")
-            self._socket_tcp.sendall(header + message)
+            message = compressors.frame(message, self.framing, self.compressor)
+            self._transmit(self._write_tcp, (message,), len(message), self)
         else:
-            address = (self._address, self._port)
-            self._socket_udp.sendto(message, address)
+            datagrams = [message]
+            if self.fragment_size is not None and len(message) > self.fragment_size:
+                datagrams = fragments.split(message, self.fragment_size, next(self._fragment_ids))
+            for datagram in datagrams:
+                self._transmit(self._write_udp, (datagram,), len(datagram))
+
+        if self.statistics:
+            self.stats.sent(protocol, len(message), self._server_address)
+
+    def _transmit(
+        self,
+        write: t.Callable[..., t.Any],
+        args: tuple,
+        size: int,
+        stream: t.Optional[t.Hashable] = None
+    ):
+        if self.conditions is None:
+            write(*args)
+        else:
+            self.conditions.submit(write, args, size, stream)
+
+    def _write_tcp(self, data: bytes):
+        self._socket_tcp.sendall(data)
+
+    def _write_udp(self, data: bytes):
+        self._socket_udp.sendto(data, self._server_udp_address)
 
     def recv_bytes_tcp(self, buffer: int) -> bytes:
         message = b""
         while len(message) < buffer:
-            message += self._socket_tcp.recv(
+            chunk = self._socket_tcp.recv(
                 buffer - len(message)
             )
+            if not chunk:
+                raise ConnectionResetError("Connection closed by peer.")
+            message += chunk
         return message
 
-    def connect(self, address: str, port: int, enable_udp: bool = False):
+    def connect(
+        self,
+        address: str,
+        port: int,
+        enable_udp: bool = False,
+        room: t.Optional[str] = None
+    ):
+        """ Connect to a server, joining `room` when it is a ShardRouter. """
         self._address = address
         self._port = port
+        self._message_queue = Queue(maxsize=self.message_queue_size)
+        self._reliable_endpoint = ReliableEndpoint(self.resend_timeout)
+        self._server_protocols = None
+        self._reassembler = fragments.Reassembler(self.fragment_timeout)
+        self.stats.reset()
 
         self._socket_tcp = socket.socket(
             socket.AF_INET, socket.SOCK_STREAM
         )
         self._socket_tcp.connect((self._address, self._port))
+        self._recv_buffer = ReceiveBuffer(
+            self.framing, compressor=self.compressor, max_message_size=self.max_message_size
+        )
+        self._server_address = self._socket_tcp.getpeername()
+        self._server_udp_address = self._server_address
+        if room is not None:
+            self.send("_join_room", {"room": room})
+        if self.interned_protocols:
+            self._send_protocol_table()
+        if self.sessions:
+            self.send("_resume", {"token": self._session_token})
 
         socket_thread_tcp = threading.Thread(
             target=self._socket_thread,
@@ -95,15 +278,36 @@ class Client(jank.pyglet.event.EventDispatcher):
         self.connected = True
         self.udp_enabled = enable_udp
 
+        if enable_udp:
+            reliability_thread = threading.Thread(
+                target=self._reliability_thread,
+                daemon=True
+            )
+            reliability_thread.start()
+
+        if self.statistics:
+            ping_thread = threading.Thread(
+                target=self._ping_thread,
+                daemon=True
+            )
+            ping_thread.start()
+
         self.dispatch_event("on_connection", self._socket_tcp)
 
-    def disconnect(self):
+    def disconnect(self, end_session: bool = True):
+        """ Disconnect, ending the session unless `end_session` is False. """
+        if end_session:
+            self._end_session()
         self.connected = False
-        self.udp_enabled = False
 
+        try:
+            self._socket_tcp.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self._socket_tcp.close()
         if self.udp_enabled:
             self._socket_udp.close()
+        self.udp_enabled = False
 
         self.dispatch_event("on_disconnection", self._socket_tcp)
 
@@ -114,24 +318,17 @@ class Client(jank.pyglet.event.EventDispatcher):
         if network_protocol == self.TCP:
             try:
                 while True:
-                    header_bytes = self.recv_bytes_tcp(self._header_size)
-                    header = header_bytes.decode("utf-8")
-                    length = int(header.strip())
-
-                    message = self.recv_bytes_tcp(length)
-
-                    data = self.encoder.decode(message)
-                    if data["protocol"] in self._protocols.keys():
-                        self._protocols[data["protocol"]](**data["data"])
-                    else:
-                        print(f"Recieved invalid/unregistered protocol type: {data['protocol']}")
+                    self._recv_buffer.recv_into(self._socket_tcp)
+                    for message in self._recv_buffer.messages():
+                        self._handle_message(message)
             except ConnectionResetError as e:
                 print(f"""
 Connection to server was reset:
     {e}
 
 """)
-                self.disconnect()
+                if self.connected:
+                    self.disconnect(end_session=False)
             except ConnectionAbortedError as e:
                 print(f"""
 Connection to the server was aborted:
@@ -151,14 +348,148 @@ Failed to send packet to client:
 """)
                     continue
 
-                data = self.encoder.decode(message)
-                if c_address != self._socket_tcp.getpeername():
-                    print(f"Received message from unconnected user: {c_address}")
-                elif data["protocol"] in self._protocols.keys():
-                    self._protocols[data["protocol"]](**data["data"])
-                else:
-                    print(f"Recieved invalid/unregistered protocol type: {data['protocol']}")
+                self._handle_datagram(message, c_address)
+
+    def _data_received(self, data: bytes):
+        self._recv_buffer.feed(data)
+        for message in self._recv_buffer.messages():
+            self._handle_message(message)
+
+    def _session(self, token: str, resumed: bool):
+        self._session_token = token
+        if resumed:
+            self.dispatch_event("on_resume")
+
+    def _end_session(self):
+        if self.sessions and self._session_token is not None:
+            self._session_token = None
+            try:
+                self.send("_end_session")
+            except OSError:
+                pass
+
+    def _udp_address(self, port: int):
+        self._server_udp_address = (self._server_address[0], port)
+
+    def _send_protocol_table(self):
+        self.send("_protocol_table", {"protocols": self._protocol_ids.entries()})
+
+    def _protocol_table(self, protocols: t.List[list]):
+        if self.interned_protocols:
+            self._server_protocols = ProtocolTable(protocols)
+
+    def _encoder_handshake(self, **data):
+        accepted = self.encoder.apply_handshake(data)
+        if accepted is not None:
+            self.send("_encoder_accept", {"protocols": accepted})
+
+    def _batch(self, messages: t.List[dict]):
+        for data in messages:
+            self._call_protocol(data)
+
+    def _reliable(
+        self,
+        sequence: int,
+        ack: int,
+        ack_bits: int,
+        messages: t.List[t.Tuple[int, int, dict]]
+    ):
+        endpoint = self._reliable_endpoint
+        delivered = endpoint.receive(sequence, ack, ack_bits, messages)
+        if messages:
+            self.send("_reliable", endpoint.ack(), network_protocol=self.UDP)
+        for data in delivered:
+            self._call_protocol(data)
+
+    def _resend_reliable(self):
+        for packet in self._reliable_endpoint.resend():
+            try:
+                self.send("_reliable", packet, network_protocol=self.UDP)
+            except OSError:
+                break
+
+    def _reliability_thread(self):
+        while self.connected and self.udp_enabled:
+            time.sleep(self.resend_interval)
+            self._resend_reliable()
+
+    def ping(self):
+        """ Ping the server, over UDP if enabled. The reply updates the
+        RTT and loss in `stats`.
+        """
+        data = self.stats.ping(self._server_address, self.udp_enabled)
+        data["udp"] = self.udp_enabled
+        self.send("_ping", data, self.UDP if self.udp_enabled else self.TCP)
+
+    def _ping(self, ping_id: int, udp: bool = False):
+        self.send("_pong", {"ping_id": ping_id}, self.UDP if udp else self.TCP)
+
+    def _pong(self, ping_id: int):
+        self.stats.pong(self._server_address, ping_id)
+
+    def _ping_thread(self):
+        while self.connected:
+            time.sleep(self.ping_interval)
+            try:
+                if self.connected:
+                    self.ping()
+            except OSError:
+                break
+
+    def _handle_message(self, message: t.Union[bytes, memoryview]):
+        self._dispatch(self._decode(message, self.framing.header_size))
+
+    def _handle_datagram(self, message: bytes, c_address: t.Tuple[str, int]):
+        if c_address != self._server_udp_address:
+            print(f"Received message from unconnected user: {c_address}")
+            return
+
+        if fragments.is_fragment(message):
+            message = self._reassembler.feed(c_address, message)
+            if message is None:
+                return
+        self._dispatch(self._decode(message))
+
+    def _decode(self, message: t.Union[bytes, memoryview], overhead: int = 0) -> t.Optional[dict]:
+        if not self.statistics:
+            return self.encoder.decode(message)
+
+        start = time.perf_counter()
+        data = self.encoder.decode(message)
+        elapsed = time.perf_counter() - start
+        if data is None:
+            self.stats.decoded(elapsed)
+            return None
+        protocol = self._protocol_ids.name(data["protocol"])
+        self.stats.decoded(elapsed, protocol)
+        self.stats.received(protocol, len(message) + overhead, self._server_address)
+        return data
+
+    def _dispatch(self, data: t.Optional[dict]):
+        if data is None:
+            return
+        if self.dispatch_mode == self.IMMEDIATE:
+            self._call_protocol(data)
+            return
+
+        try:
+            self._message_queue.put_nowait(data)
+        except Full:
+            self.stats.dropped(self._protocol_ids.name(data["protocol"]), self._server_address)
+
+    def _call_protocol(self, data: dict):
+        protocol = data["protocol"]
+        if isinstance(protocol, int):
+            handlers = self._protocol_ids.handlers
+            if 0 <= protocol < len(handlers):
+                handlers[protocol](*data["data"])
+                return
+        elif protocol in self._protocols.keys():
+            self._protocols[protocol](**data["data"])
+            return
+        print(f"Recieved invalid/unregistered protocol type: {protocol}")
 
 
 Client.register_event_type("on_connection")
 Client.register_event_type("on_disconnection")
+Client.register_event_type("on_resume")
@@ -0,0 +1,108 @@
+import lzma
+import typing as t
+import zlib
+
+from . import framings
+
+Buffer = t.Union[bytes, bytearray, memoryview]
+
+
+class Compressor:
+    """ Compresses TCP payloads of at least `threshold` bytes.
+    Both ends of a connection must use the same compressor.
+
+    `decompress` raises ValueError if the data is invalid or truncated,
+    or would decompress to more than `max_length` bytes.
+    """
+
+    def __init__(self, threshold: int = 1024):
+        self.threshold = threshold
+
+    def compress(self, data: Buffer) -> bytes:
+        return bytes(data)
+
+    def decompress(self, data: Buffer, max_length: t.Optional[int] = None) -> bytes:
+        return _check(bytes(data), max_length, True, b"")
+
+
+class ZlibCompressor(Compressor):
+    """ zlib (deflate) compression.
+
+    A preset `dictionary` of strings common in your messages, such as
+    protocol and field names, helps even fairly small messages compress.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 1024,
+        level: int = 6,
+        dictionary: t.Optional[bytes] = None
+    ):
+        super().__init__(threshold)
+        self.level = level
+        self.dictionary = dictionary
+
+    def compress(self, data: Buffer) -> bytes:
+        if self.dictionary is None:
+            return zlib.compress(data, self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: Buffer, max_length: t.Optional[int] = None) -> bytes:
+        if self.dictionary is None:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+        try:
+            # One byte over the limit tells an oversized message apart
+            # from one exactly at it. 0 is unlimited.
+            output = decompressor.decompress(data, 0 if max_length is None else max_length + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid zlib data: {e}")
+        return _check(output, max_length, decompressor.eof, decompressor.unused_data)
+
+
+class LzmaCompressor(Compressor):
+    """ LZMA compression, smaller but slower than zlib.
+    Best kept for large, infrequent messages like level data.
+    """
+
+    def __init__(self, threshold: int = 4096, preset: int = 6):
+        super().__init__(threshold)
+        self.preset = preset
+
+    def compress(self, data: Buffer) -> bytes:
+        return lzma.compress(data, lzma.FORMAT_XZ, preset=self.preset)
+
+    def decompress(self, data: Buffer, max_length: t.Optional[int] = None) -> bytes:
+        decompressor = lzma.LZMADecompressor()
+        try:
+            output = decompressor.decompress(data, -1 if max_length is None else max_length + 1)
+        except lzma.LZMAError as e:
+            raise ValueError(f"Invalid LZMA data: {e}")
+        return _check(output, max_length, decompressor.eof, decompressor.unused_data)
+
+
+def _check(output: bytes, max_length: t.Optional[int], eof: bool, unused: bytes) -> bytes:
+    if max_length is not None and len(output) > max_length:
+        raise ValueError(f"Decompressed message exceeds the limit of {max_length} bytes.")
+    if not eof:
+        raise ValueError("Compressed message is truncated.")
+    if unused:
+        raise ValueError("Compressed message is followed by trailing data.")
+    return output
+
+
+def frame(
+    payload: bytes,
+    framing: framings.Framing,
+    compressor: t.Optional[Compressor] = None
+) -> bytes:
+    """ `payload` with its TCP header, compressed when large enough and
+    compression makes it smaller.
+    """
+    if compressor is not None and len(payload) >= compressor.threshold:
+        compressed = compressor.compress(payload)
+        if len(compressed) < len(payload):
+            return framing.pack(len(compressed), framing.COMPRESSED) + compressed
+    return framing.pack(len(payload)) + payload
@@ -1,5 +1,7 @@
 import json
 import pickle
+import struct
+import typing as t
 
 
 class Encoder:
@@ -8,9 +10,35 @@ class Encoder:
         return b""
 
     @staticmethod
-    def decode(data: bytes) -> dict:
+    def decode(data: bytes) -> t.Optional[dict]:
+        """ The decoded message, or None to drop it. """
         return {}
 
+    @staticmethod
+    def handshake() -> t.Optional[dict]:
+        """ Data the server sends to each new client's encoder, if any. """
+        return None
+
+    @staticmethod
+    def apply_handshake(data: dict) -> t.Optional[t.List[str]]:
+        """ Called on the client with the server's handshake data. Returns
+        the packed protocols the client accepted, which are sent back so
+        the server only packs those for it.
+        """
+        return None
+
+    @staticmethod
+    def packs(protocol: str) -> bool:
+        """ Whether the encoder packs `protocol` itself, so it should be
+        sent by name rather than interned. Encoders that pack must also
+        implement `encode_unpacked`, for clients that didn't accept it.
+        """
+        return False
+
+    @staticmethod
+    def encode_unpacked(data: dict) -> bytes:
+        return b""
+
 
 class PickleEncoder(Encoder):
     """ Warning, this is extremely insecure.
@@ -32,4 +60,163 @@ class JsonEncoder(Encoder):
 
     @staticmethod
     def decode(data: bytes) -> dict:
-        return json.loads(data.decode("utf-8"))
+        return json.loads(str(data, "utf-8"))
+
+
+class _Schema:
+    def __init__(self, fields: t.List[t.Tuple[str, str]], keyed: bool):
+        self.fields = fields
+        self.keyed = keyed
+        self.record = struct.Struct("!" + "".join(fmt for _, fmt in fields))
+        # Number of packed values per field, e.g. 2 for "2f".
+        self.counts = [
+            len(struct.unpack("!" + fmt, bytes(struct.calcsize("!" + fmt))))
+            for _, fmt in fields
+        ]
+
+    def pack_record(self, data: dict) -> bytes:
+        values = []
+        for (name, _), count in zip(self.fields, self.counts):
+            if count == 1:
+                values.append(data[name])
+            else:
+                values.extend(data[name])
+        return self.record.pack(*values)
+
+    def unpack_record(self, data: bytes, offset: int = 0) -> dict:
+        values = self.record.unpack_from(data, offset)
+        record = {}
+        i = 0
+        for (name, _), count in zip(self.fields, self.counts):
+            if count == 1:
+                record[name] = values[i]
+            else:
+                record[name] = values[i:i+count]
+            i += count
+        return record
+
+
+class StructEncoder(Encoder):
+    """ Packs protocols with a registered schema using struct.
+
+    Each message starts with a 1 byte protocol ID, where 0 means the rest
+    is encoded with the fallback encoder. Field formats are struct format
+    strings, for example:
+
+        encoder.register_schema("player_controls", [("up", "?"), ("down", "?")])
+        encoder.register_schema(
+            "player_positions",
+            [("position", "2f"), ("velocity", "2f")],
+            keyed=True
+        )
+
+    Keyed schemas pack a dict of string keys to records. IDs are assigned
+    by the server and sent to clients on connection; until then clients
+    use the fallback encoder. Use a separate instance per Server/Client.
+    """
+
+    _header: struct.Struct = struct.Struct("!B")
+    _count: struct.Struct = struct.Struct("!H")
+
+    def __init__(self, fallback: Encoder = JsonEncoder):
+        self.fallback = fallback
+        self.negotiated = False
+        self._schemas: t.Dict[str, _Schema] = {}
+        self._ids: t.Dict[str, int] = {}
+        self._names: t.Dict[int, str] = {}
+
+    def register_schema(
+        self,
+        protocol: str,
+        fields: t.List[t.Tuple[str, str]],
+        keyed: bool = False
+    ):
+        if protocol not in self._ids.keys():
+            # ID 255 starts UDP fragments.
+            if len(self._ids) >= 254:
+                raise ValueError("StructEncoder supports at most 254 schemas.")
+            protocol_id = len(self._ids) + 1
+            self._ids[protocol] = protocol_id
+            self._names[protocol_id] = protocol
+        self._schemas[protocol] = _Schema(fields, keyed)
+
+    def handshake(self) -> dict:
+        self.negotiated = True
+        return {
+            "ids": {
+                name: [protocol_id, self._schemas[name].record.format, self._schemas[name].keyed]
+                for name, protocol_id in self._ids.items()
+            }
+        }
+
+    def apply_handshake(self, data: dict) -> t.List[str]:
+        self._ids = {}
+        self._names = {}
+        for name, (protocol_id, record_format, keyed) in data["ids"].items():
+            schema = self._schemas.get(name)
+            if schema is None:
+                continue
+            if schema.record.format != record_format or schema.keyed != keyed:
+                print(f"Schema for protocol {name} does not match the server's, using fallback.")
+                continue
+            self._ids[name] = protocol_id
+            self._names[protocol_id] = name
+        self.negotiated = True
+        return list(self._ids.keys())
+
+    def packs(self, protocol: str) -> bool:
+        return self.negotiated and protocol in self._ids.keys()
+
+    def encode_unpacked(self, data: dict) -> bytes:
+        return self._header.pack(0) + self.fallback.encode(data)
+
+    def encode(self, data: dict) -> bytes:
+        protocol = data["protocol"]
+        if not self.negotiated or protocol not in self._ids.keys():
+            return self.encode_unpacked(data)
+
+        schema = self._schemas[protocol]
+        message = [self._header.pack(self._ids[protocol])]
+        if schema.keyed:
+            message.append(self._count.pack(len(data["data"])))
+            for key, record in data["data"].items():
+                key = key.encode("utf-8")
+                message.append(self._header.pack(len(key)))
+                message.append(key)
+                message.append(schema.pack_record(record))
+        else:
+            message.append(schema.pack_record(data["data"]))
+        return b"".join(message)
+
+    def decode(self, data: bytes) -> t.Optional[dict]:
+        data = memoryview(data)
+        protocol_id = data[0]
+        if protocol_id == 0:
+            return self.fallback.decode(data[1:])
+
+        protocol = self._names.get(protocol_id)
+        if protocol is None:
+            print(f"Received a message with unknown schema ID {protocol_id}, discarding.")
+            return None
+        try:
+            return self._unpack(protocol, data)
+        except (struct.error, UnicodeDecodeError, IndexError):
+            print(f"Received a malformed {protocol} message, discarding.")
+            return None
+
+    def _unpack(self, protocol: str, data: memoryview) -> dict:
+        schema = self._schemas[protocol]
+        if not schema.keyed:
+            return {"protocol": protocol, "data": schema.unpack_record(data, 1)}
+
+        records = {}
+        count, = self._count.unpack_from(data, 1)
+        offset = 1 + self._count.size
+        for _ in range(count):
+            length = data[offset]
+            offset += 1
+            key = str(data[offset:offset+length], "utf-8")
+            offset += length
+            records[key] = schema.unpack_record(data, offset)
+            offset += schema.record.size
+        return {"protocol": protocol, "data": records}
@@ -0,0 +1,98 @@
+import struct
+import threading
+import time
+import typing as t
+
+# Starts every fragment. No encoder starts a message with it: JSON and
+# pickle never do, and StructEncoder IDs stop short of 255.
+MARKER = b"\xff\xfe"
+_header = struct.Struct("!2sIHH")
+HEADER_SIZE = _header.size
+
+
+def is_fragment(datagram: t.Union[bytes, memoryview]) -> bool:
+    return bytes(datagram[:len(MARKER)]) == MARKER
+
+
+def split(payload: bytes, size: int, message_id: int) -> t.List[bytes]:
+    """ Split `payload` into fragments of at most `size` bytes, header
+    included, which `Reassembler.feed` joins back together.
+    """
+    chunk = size - _header.size
+    if chunk <= 0:
+        raise ValueError(f"Fragment size must be larger than the {_header.size} byte header.")
+    count = -(-len(payload) // chunk)
+    if count > 0xFFFF:
+        raise ValueError("Message too large to fragment.")
+
+    message_id &= 0xFFFFFFFF
+    return [
+        _header.pack(MARKER, message_id, index, count) + payload[index*chunk:(index+1)*chunk]
+        for index in range(count)
+    ]
+
+
+class _Partial:
+    def __init__(self, count: int, started: float):
+        self.chunks: t.List[t.Optional[bytes]] = [None] * count
+        self.received = 0
+        self.started = started
+
+
+class Reassembler:
+    """ Joins fragments from each peer back into whole messages.
+
+    Messages still missing fragments `timeout` seconds after their first
+    one arrived are dropped, as are messages claiming more than
+    `max_count` fragments.
+    """
+
+    def __init__(self, timeout: float = 1.0, max_count: int = 1024):
+        self.timeout = timeout
+        self.max_count = max_count
+        self._partials: t.Dict[t.Tuple[t.Hashable, int], _Partial] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """ Number of incomplete messages. """
+        return len(self._partials)
+
+    def feed(self, peer: t.Hashable, datagram: t.Union[bytes, memoryview]) -> t.Optional[bytes]:
+        """ Add a fragment from `peer`, returning the message if it is now
+        complete.
+        """
+        try:
+            _, message_id, index, count = _header.unpack_from(datagram)
+        except struct.error:
+            return None
+        if count > self.max_count or index >= count:
+            return None
+
+        key = (peer, message_id)
+        with self._lock:
+            partial = self._partials.get(key)
+            if partial is None or len(partial.chunks) != count:
+                now = time.monotonic()
+                self._expire(now)
+                partial = self._partials[key] = _Partial(count, now)
+
+            if partial.chunks[index] is None:
+                partial.chunks[index] = bytes(datagram[_header.size:])
+                partial.received += 1
+            if partial.received < count:
+                return None
+            del self._partials[key]
+
+        return b"".join(partial.chunks)
+
+    def forget(self, peer: t.Hashable):
+        """ Drop a disconnected peer's incomplete messages. """
+        with self._lock:
+            for key in [key for key in self._partials.keys() if key[0] == peer]:
+                del self._partials[key]
+
+    def _expire(self, now: float):
+        for key, partial in list(self._partials.items()):
+            if now - partial.started >= self.timeout:
+                del self._partials[key]
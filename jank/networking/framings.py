@@ -0,0 +1,73 @@
+import struct
+import typing as t
+
+Buffer = t.Union[bytes, bytearray, memoryview]
+
+
+class Framing:
+    """ Length header prepended to every TCP message.
+    Both ends of a connection must use the same framing.
+    """
+    header_size: int = 0
+    # Header flag set when the payload is compressed.
+    COMPRESSED: int = 1
+
+    @staticmethod
+    def pack(length: int, flags: int = 0) -> bytes:
+        return b""
+
+    @staticmethod
+    def unpack(buffer: Buffer, offset: int = 0) -> int:
+        return 0
+
+    @classmethod
+    def unpack_header(cls, buffer: Buffer, offset: int = 0) -> t.Tuple[int, int]:
+        """ The length and flags of the frame at `offset`. """
+        return cls.unpack(buffer, offset), 0
+
+
+class AsciiFraming(Framing):
+    """ The original 32 byte, space padded UTF-8 header.
+    Flags are appended after a comma when set, e.g. "120,1".
+    """
+    header_size: int = 32
+
+    @staticmethod
+    def pack(length: int, flags: int = 0) -> bytes:
+        header = f"{length},{flags}" if flags else str(length)
+        return bytes(f"{header:<32}", "utf-8")
+
+    @staticmethod
+    def unpack(buffer: Buffer, offset: int = 0) -> int:
+        return AsciiFraming.unpack_header(buffer, offset)[0]
+
+    @staticmethod
+    def unpack_header(buffer: Buffer, offset: int = 0) -> t.Tuple[int, int]:
+        length, _, flags = bytes(buffer[offset:offset+32]).partition(b",")
+        return int(length), int(flags) if flags else 0
+
+
+class BinaryFraming(Framing):
+    """ A 4 byte big-endian unsigned length, for messages up to 2GiB.
+    The top bit is the compressed flag.
+    """
+    header_size: int = 4
+    _struct: struct.Struct = struct.Struct("!I")
+    _compressed_bit: int = 1 << 31
+
+    @staticmethod
+    def pack(length: int, flags: int = 0) -> bytes:
+        if flags & Framing.COMPRESSED:
+            length |= BinaryFraming._compressed_bit
+        return BinaryFraming._struct.pack(length)
+
+    @staticmethod
+    def unpack(buffer: Buffer, offset: int = 0) -> int:
+        return BinaryFraming.unpack_header(buffer, offset)[0]
+
+    @staticmethod
+    def unpack_header(buffer: Buffer, offset: int = 0) -> t.Tuple[int, int]:
+        value = BinaryFraming._struct.unpack_from(buffer, offset)[0]
+        if value & BinaryFraming._compressed_bit:
+            return value & ~BinaryFraming._compressed_bit, Framing.COMPRESSED
+        return value, 0
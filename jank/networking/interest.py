@@ -0,0 +1,160 @@
+import math
+import socket
+import threading
+import typing as t
+
+import jank
+
+from .server import Server
+
+Position = t.Union[jank.Vec2d, t.Tuple[float, float]]
+
+
+class InterestManager:
+    """ Limits which clients receive updates about which parts of the world.
+
+    Each client is given a focus, either a position or an entity to
+    follow, and sees a square of `radius` around it. Foci are bucketed in
+    a uniform grid so `interested` only checks nearby clients. When a
+    physics space is given, `visible` finds entities with a bounding box
+    query instead of checking every entity's position.
+    Clients without a focus are interested in everything.
+    """
+
+    def __init__(
+        self,
+        server: Server,
+        radius: float = 500,
+        cell_size: t.Optional[float] = None,
+        space: t.Optional[jank.physics.Space] = None
+    ):
+        self.server = server
+        self.radius = radius
+        self.cell_size = cell_size if cell_size is not None else radius
+        self.space = space
+
+        self._foci: t.Dict[socket.socket, t.Tuple[t.Any, float]] = {}
+        self._views: t.Dict[socket.socket, jank.BoundingBox] = {}
+        self._grid: t.Dict[t.Tuple[int, int], t.List[socket.socket]] = {}
+        self._lock = threading.Lock()
+
+        self.server.push_handlers(self)
+
+    def set_focus(
+        self,
+        socket: socket.socket,
+        focus: t.Union[Position, "jank.Entity"],
+        radius: t.Optional[float] = None
+    ):
+        """ Focus a client on a position, or on an entity to follow. """
+        with self._lock:
+            self._foci[socket] = (focus, self.radius if radius is None else radius)
+
+    def remove_focus(self, socket: socket.socket):
+        with self._lock:
+            self._foci.pop(socket, None)
+            if socket in self._views.keys():
+                # Replaced rather than changed in place, `interested` may
+                # be reading the old ones.
+                self._views = {
+                    c_socket: view for c_socket, view in self._views.items()
+                    if c_socket is not socket
+                }
+                self._grid = {
+                    cell: [c_socket for c_socket in sockets if c_socket is not socket]
+                    for cell, sockets in self._grid.items()
+                }
+
+    def on_disconnection(self, socket: socket.socket):
+        self.remove_focus(socket)
+
+    def on_resume(self, socket: socket.socket, old_socket: socket.socket):
+        with self._lock:
+            if old_socket in self._foci.keys():
+                self._foci[socket] = self._foci.pop(old_socket)
+
+    def update(self):
+        """ Rebuild views and the grid from the current foci. """
+        views = {}
+        grid: t.Dict[t.Tuple[int, int], t.List[socket.socket]] = {}
+        with self._lock:
+            foci = list(self._foci.items())
+
+        for c_socket, (focus, radius) in foci:
+            x, y = focus.position if hasattr(focus, "position") else focus
+            view = jank.BoundingBox(x - radius, y - radius, x + radius, y + radius)
+            views[c_socket] = view
+
+            left, bottom = self._cell((view.left, view.bottom))
+            right, top = self._cell((view.right, view.top))
+            for cx in range(left, right + 1):
+                for cy in range(bottom, top + 1):
+                    grid.setdefault((cx, cy), []).append(c_socket)
+
+        with self._lock:
+            self._views = views
+            self._grid = grid
+
+    def view(self, socket: socket.socket) -> t.Optional[jank.BoundingBox]:
+        return self._views.get(socket)
+
+    def interested(self, position: Position) -> t.List[socket.socket]:
+        """ Every connected client whose view contains `position`. """
+        x, y = position
+        with self._lock:
+            views, grid = self._views, self._grid
+        candidates = grid.get(self._cell(position), [])
+        sockets = [
+            c_socket for c_socket in candidates
+            if views[c_socket].contains_vect(jank.Vec2d(x, y))
+        ]
+        sockets += [
+            c_socket for c_socket in self.server.clients.copy().values()
+            if c_socket not in views.keys()
+        ]
+        return sockets
+
+    def visible(
+        self,
+        socket: socket.socket,
+        entities: t.Dict[str, "jank.Entity"]
+    ) -> t.Dict[str, "jank.Entity"]:
+        """ The subset of `entities` inside a client's view. """
+        view = self._views.get(socket)
+        if view is None:
+            return entities
+
+        if self.space is None:
+            return {
+                entity_id: entity for entity_id, entity in entities.items()
+                if view.contains_vect(entity.position)
+            }
+
+        bodies = {
+            shape.body for shape in self.space.bb_query(view, jank.physics.ShapeFilter())
+        }
+        return {
+            entity_id: entity for entity_id, entity in entities.items()
+            if entity.body in bodies
+        }
+
+    def broadcast(
+        self,
+        position: Position,
+        protocol: str,
+        data: t.Optional[dict] = None,
+        exclude: t.Optional[t.List[socket.socket]] = None,
+        network_protocol: int = Server.TCP
+    ):
+        """ Broadcast to the clients interested in `position`. """
+        sockets = self.interested(position)
+        if sockets:
+            self.server.send_message(
+                self.server.prepare(protocol, data),
+                sockets, exclude=exclude,
+                network_protocol=network_protocol
+            )
+
+    def _cell(self, position: Position) -> t.Tuple[int, int]:
+        x, y = position
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
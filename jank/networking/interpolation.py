@@ -0,0 +1,117 @@
+import bisect
+import threading
+import time
+import typing as t
+
+import jank
+
+
+def lerp(a: t.Any, b: t.Any, alpha: float) -> t.Any:
+    if isinstance(a, (int, float)):
+        return a + (b - a) * alpha
+    return tuple(x + (y - x) * alpha for x, y in zip(a, b))
+
+
+class InterpolationBuffer:
+    """ Timestamped snapshots of one entity's state.
+
+    `sample` blends the two snapshots either side of a time, holding the
+    first or last snapshot outside of the buffered range.
+    """
+
+    def __init__(self, size: int = 32):
+        self.size = size
+        self._times: t.List[float] = []
+        self._states: t.List[dict] = []
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    def push(self, timestamp: float, state: dict):
+        index = bisect.bisect(self._times, timestamp)
+        self._times.insert(index, timestamp)
+        self._states.insert(index, state)
+        if len(self._times) > self.size:
+            del self._times[0]
+            del self._states[0]
+
+    def sample(self, timestamp: float) -> t.Optional[dict]:
+        if not self._times:
+            return None
+
+        index = bisect.bisect(self._times, timestamp)
+        if index == 0:
+            return self._states[0]
+        if index == len(self._times):
+            return self._states[-1]
+
+        # Snapshots before the pair being blended are no longer needed.
+        del self._times[:index-1]
+        del self._states[:index-1]
+
+        t0, t1 = self._times[0], self._times[1]
+        a, b = self._states[0], self._states[1]
+        alpha = (timestamp - t0) / (t1 - t0) if t1 > t0 else 1
+        return {
+            field: lerp(a[field], value, alpha) if field in a.keys() else value
+            for field, value in b.items()
+        }
+
+
+class Interpolator:
+    """ Smooths remote entities by rendering them `delay` seconds behind.
+
+    Push each entity's state as it arrives, and call `update` every frame,
+    or push the interpolator onto the application to do it in on_update.
+    With a delay of two or three snapshot intervals the server can send
+    state at 20-30Hz while entities still move smoothly.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.1,
+        clock: t.Callable[[], float] = time.monotonic
+    ):
+        self.delay = delay
+        self.clock = clock
+
+        self.entities: t.Dict[str, "jank.Entity"] = {}
+        self._buffers: t.Dict[str, InterpolationBuffer] = {}
+        self._lock = threading.Lock()
+
+    def add(self, entity_id: str, entity: "jank.Entity"):
+        with self._lock:
+            self.entities[entity_id] = entity
+            self._buffers[entity_id] = InterpolationBuffer()
+
+    def remove(self, entity_id: str):
+        with self._lock:
+            self.entities.pop(entity_id, None)
+            self._buffers.pop(entity_id, None)
+
+    def push(self, entity_id: str, state: dict, timestamp: t.Optional[float] = None):
+        """ Buffer `state` (field -> value), by default stamped with the
+        time it was received.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        with self._lock:
+            if entity_id in self._buffers.keys():
+                self._buffers[entity_id].push(timestamp, state)
+
+    def update(self, dt: float = 0):
+        render_time = self.clock() - self.delay
+        with self._lock:
+            samples = [
+                (self.entities[entity_id], buffer.sample(render_time))
+                for entity_id, buffer in self._buffers.items()
+            ]
+
+        for entity, state in samples:
+            if state is None:
+                continue
+            for field, value in state.items():
+                setattr(entity, field, value)
+
+    def on_update(self, dt: float):
+        self.update(dt)
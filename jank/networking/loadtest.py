@@ -0,0 +1,228 @@
+""" Load test a Server with simulated clients.
+
+Spawns headless Clients against a local Server, each sending `rate`
+messages a second which the server echoes back, then reports throughput,
+round trip latency percentiles and the server process's CPU usage.
+
+    python -m jank.networking.loadtest --clients 100 --processes 4
+
+With `processes=0` the clients run on threads in the server's process, so
+the CPU figure includes them. Spread them across processes to measure the
+server on its own.
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+import typing as t
+
+from .client import Client
+from .netsim import NetworkConditions
+from .server import Server
+
+
+def percentile(values: t.Sequence[float], percent: float) -> float:
+    """ Nearest-rank percentile of sorted `values`. """
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_clients(
+    address: str,
+    port: int,
+    count: int,
+    duration: float,
+    rate: float,
+    udp_ratio: float,
+    payload_size: int,
+    results: t.Optional[t.Any] = None
+) -> dict:
+    """ Connect `count` clients and send messages for `duration` seconds.
+    The result is also put on `results` when given, for worker processes.
+    """
+    latencies: t.List[float] = []
+    lock = threading.Lock()
+
+    def echo(sent: float):
+        latency = time.perf_counter() - sent
+        with lock:
+            latencies.append(latency)
+
+    clients = []
+    for _ in range(count):
+        client = Client()
+        client.register_protocol(echo, "loadtest_echo")
+        client.connect(address, port, udp_ratio > 0)
+        clients.append(client)
+
+    padding = "x" * payload_size
+    sent = 0
+    interval = 1 / rate
+    end = time.perf_counter() + duration
+    next_tick = time.perf_counter()
+    while next_tick < end:
+        for client in clients:
+            udp = random.random() < udp_ratio
+            client.send(
+                "loadtest",
+                {"sent": time.perf_counter(), "udp": udp, "padding": padding},
+                network_protocol=Client.UDP if udp else Client.TCP
+            )
+            sent += 1
+        next_tick += interval
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+    # Let the last echoes arrive.
+    time.sleep(min(1.0, duration / 2))
+    for client in clients:
+        client.disconnect()
+
+    with lock:
+        result = {"sent": sent, "latencies": list(latencies)}
+    if results is not None:
+        results.put(result)
+    return result
+
+
+def run(
+    clients: int = 10,
+    duration: float = 5.0,
+    rate: float = 20,
+    udp_ratio: float = 0.5,
+    payload_size: int = 64,
+    processes: int = 0,
+    address: str = "127.0.0.1",
+    port: int = 5700,
+    server: t.Optional[Server] = None
+) -> dict:
+    """ Run a load test and return its report.
+
+    Clients are split between `processes` worker processes, or run
+    in-process when 0. Pass a configured `server` to test other options,
+    e.g. `selector_mode`.
+    """
+    if server is None:
+        server = Server()
+    server.statistics = True
+
+    def echo(socket, sent: float, udp: bool, padding: str):
+        server.send(
+            socket, "loadtest_echo", {"sent": sent},
+            network_protocol=server.UDP if udp else server.TCP
+        )
+    server.register_protocol(echo, "loadtest")
+    server.connect(address, port, udp_ratio > 0)
+
+    counts = [clients // max(processes, 1)] * max(processes, 1)
+    for i in range(clients % len(counts)):
+        counts[i] += 1
+    args = (address, port)
+    options = (duration, rate, udp_ratio, payload_size)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    results = []
+    if processes:
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=run_clients, args=(*args, count, *options, queue))
+            for count in counts if count
+        ]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            results.append(queue.get())
+        for worker in workers:
+            worker.join()
+    else:
+        threads = [
+            threading.Thread(
+                target=lambda count=count: results.append(run_clients(*args, count, *options)),
+                daemon=True
+            )
+            for count in counts if count
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    stats = server.stats.snapshot()
+    server.disconnect()
+
+    sent = sum(result["sent"] for result in results)
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    totals = stats["totals"]
+    return {
+        "clients": clients,
+        "duration": elapsed,
+        "sent": sent,
+        "received": len(latencies),
+        "lost": sent - len(latencies),
+        "messages_per_second": (totals["messages_in"] + totals["messages_out"]) / elapsed,
+        "bytes_in_per_second": totals["bytes_in"] / elapsed,
+        "bytes_out_per_second": totals["bytes_out"] / elapsed,
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0
+        },
+        "server_cpu": cpu,
+        "server_cpu_percent": cpu / elapsed * 100
+    }
+
+
+def main(args: t.Optional[t.List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load test a jank networking Server.")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--rate", type=float, default=20, help="Messages per second per client.")
+    parser.add_argument(
+        "--udp-ratio", type=float, default=0.5, help="Fraction of messages sent over UDP."
+    )
+    parser.add_argument("--payload-size", type=int, default=64)
+    parser.add_argument(
+        "--processes", type=int, default=0, help="Client worker processes, 0 for in-process."
+    )
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5700)
+    parser.add_argument("--selector-mode", action="store_true")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Simulated server send latency in seconds."
+    )
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0, help="Simulated server UDP loss, 0-1.")
+    options = parser.parse_args(args)
+
+    server = Server()
+    server.selector_mode = options.selector_mode
+    if options.latency or options.jitter or options.loss:
+        server.conditions = NetworkConditions(options.latency, options.jitter, options.loss)
+    report = run(
+        options.clients, options.duration, options.rate, options.udp_ratio,
+        options.payload_size, options.processes, options.address, options.port,
+        server
+    )
+
+    latency = report["latency"]
+    print(f"""
+Clients: {report['clients']}
+Messages: {report['sent']} sent, {report['received']} echoed, {report['lost']} lost
+Throughput: {report['messages_per_second']:.0f} msgs/s, \
+{report['bytes_in_per_second'] / 1024:.1f} KiB/s in, \
+{report['bytes_out_per_second'] / 1024:.1f} KiB/s out
+Latency: p50 {latency['p50'] * 1000:.2f}ms, p90 {latency['p90'] * 1000:.2f}ms, \
+p99 {latency['p99'] * 1000:.2f}ms, max {latency['max'] * 1000:.2f}ms
+Server CPU: {report['server_cpu']:.2f}s ({report['server_cpu_percent']:.0f}%)
+""")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+import hashlib
+import socket
+import struct
+import threading
+import typing as t
+
+import jank
+
+from .client import Client
+from .server import Server
+
+_body_state = struct.Struct("!6d")
+
+
+def state_hash(space: jank.physics.Space) -> str:
+    """ Digest of every body's position, angle and velocities. Equal on
+    every client while in sync.
+    """
+    # Space.bodies comes from a set, so its order differs between
+    # processes. Sorting the packed records makes the digest independent
+    # of it.
+    records = sorted(
+        _body_state.pack(
+            body.position.x, body.position.y, body.angle,
+            body.velocity.x, body.velocity.y, body.angular_velocity
+        )
+        for body in space.bodies
+    )
+    digest = hashlib.blake2b(digest_size=8)
+    for record in records:
+        digest.update(record)
+    return digest.hexdigest()
+
+
+class LockstepRelay:
+    """ Server side of deterministic lockstep, only inputs are sent.
+
+    `start` makes every connected client a player. Each player sends its
+    input for every tick, `input_delay` ticks ahead of the tick it is
+    running, and once every player's input for a tick has arrived the
+    tick's inputs are sent to all of them. Players also send a
+    `state_hash` every `hash_interval` ticks, and a mismatch calls
+    `desync(tick, {player: digest})` and tells the players.
+    Players who disconnect are left out of later ticks. Every `start`
+    begins a new game, and messages left over from an earlier one are
+    ignored.
+    """
+
+    def __init__(
+        self,
+        server: Server,
+        input_delay: int = 6,
+        hash_interval: int = 60,
+        desync: t.Optional[t.Callable[[int, t.Dict[int, str]], t.Any]] = None,
+        network_protocol: int = Server.TCP
+    ):
+        # Nothing resends a lost tick or input, which would stall every
+        # player, so plain UDP can't be used.
+        if network_protocol not in (Server.TCP, Server.RELIABLE):
+            raise TypeError("Invalid network_protocol type. Must be TCP or RELIABLE.")
+
+        self.server = server
+        self.input_delay = input_delay
+        self.hash_interval = hash_interval
+        self.desync = desync
+        self.network_protocol = network_protocol
+
+        self.running = False
+        self.game = 0
+        self.players: t.Dict[socket.socket, int] = {}
+        self.desyncs: t.List[int] = []
+        self._next_tick = 0
+        self._inputs: t.Dict[int, t.Dict[int, dict]] = {}
+        self._hashes: t.Dict[int, t.Dict[int, str]] = {}
+        self._lock = threading.Lock()
+
+        self.server.register_protocol(self._lockstep_input)
+        self.server.register_protocol(self._lockstep_hash)
+        self.server.push_handlers(self)
+
+    @property
+    def tick(self) -> int:
+        """ The next tick waiting for inputs. """
+        return self._next_tick
+
+    def start(self, sockets: t.Optional[t.Iterable[socket.socket]] = None):
+        """ Start a game with `sockets` (all clients if None) as players. """
+        if sockets is None:
+            sockets = self.server.clients.copy().values()
+
+        with self._lock:
+            self.game += 1
+            self.players = {c_socket: player for player, c_socket in enumerate(sockets)}
+            self.desyncs = []
+            # Nobody has input for the ticks run while the first inputs
+            # travel, players run those with no input.
+            self._next_tick = self.input_delay
+            self._inputs = {}
+            self._hashes = {}
+            self.running = True
+            for c_socket, player in self.players.items():
+                self.server.send(c_socket, "_lockstep_start", {
+                    "game": self.game,
+                    "player": player,
+                    "input_delay": self.input_delay,
+                    "hash_interval": self.hash_interval
+                })
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+            players, self.players = list(self.players.keys()), {}
+        self.server.send_message(self.server.prepare("_lockstep_stop"), players)
+
+    def on_disconnection(self, socket: socket.socket):
+        with self._lock:
+            player = self.players.pop(socket, None)
+            if player is None:
+                return
+            for inputs in self._inputs.values():
+                inputs.pop(player, None)
+            for digests in self._hashes.values():
+                digests.pop(player, None)
+            self._send_ready()
+
+    def on_resume(self, socket: socket.socket, old_socket: socket.socket):
+        with self._lock:
+            if old_socket in self.players.keys():
+                self.players[socket] = self.players.pop(old_socket)
+
+    def _lockstep_input(self, socket: socket.socket, game: int, tick: int, controls: dict):
+        with self._lock:
+            player = self.players.get(socket)
+            if not self.running or game != self.game or player is None or tick < self._next_tick:
+                return
+            self._inputs.setdefault(tick, {})[player] = controls
+            self._send_ready()
+
+    def _send_ready(self):
+        # Called with the lock held so ticks go out in order.
+        while self.players and len(self._inputs.get(self._next_tick, ())) >= len(self.players):
+            inputs = self._inputs.pop(self._next_tick)
+            self.server.send_message(
+                self.server.prepare("_lockstep_tick", {
+                    "game": self.game,
+                    "tick": self._next_tick,
+                    "inputs": sorted(inputs.items())
+                }),
+                list(self.players.keys()),
+                network_protocol=self.network_protocol
+            )
+            self._next_tick += 1
+
+    def _lockstep_hash(self, socket: socket.socket, game: int, tick: int, digest: str):
+        desynced = None
+        with self._lock:
+            player = self.players.get(socket)
+            if game != self.game or player is None:
+                return
+            digests = self._hashes.setdefault(tick, {})
+            digests[player] = digest
+            if len(set(digests.values())) > 1 and tick not in self.desyncs:
+                self.desyncs.append(tick)
+                desynced = dict(digests)
+            if len(digests) >= len(self.players):
+                del self._hashes[tick]
+            players = list(self.players.keys())
+
+        if desynced is not None:
+            print(f"Lockstep desync at tick {tick}: {desynced}")
+            if self.desync is not None:
+                self.desync(tick, desynced)
+            self.server.send_message(
+                self.server.prepare("_lockstep_desync", {"tick": tick}), players
+            )
+
+
+class Lockstep:
+    """ Client side of deterministic lockstep.
+
+    Assign to `Application.lockstep` and fixed updates only run once the
+    relay has sent every player's input for the tick, with a fixed `dt`.
+    Before each tick `sample()` is called for this player's input, sent
+    for `input_delay` ticks later, and the tick's inputs are available as
+    `inputs` (player -> controls) and passed to `apply` if given. The
+    simulation must be deterministic: step `physics_space` by the fixed
+    `dt` in on_fixed_update and apply inputs in player order.
+    A client that fell behind runs up to `catch_up` extra ticks per
+    fixed update until it is within half the input delay again.
+    """
+    catch_up: int = 2
+
+    def __init__(
+        self,
+        client: Client,
+        sample: t.Callable[[], dict],
+        apply: t.Optional[t.Callable[[t.Dict[int, dict]], t.Any]] = None,
+        desync: t.Optional[t.Callable[[int], t.Any]] = None,
+        network_protocol: int = Client.TCP
+    ):
+        if network_protocol not in (Client.TCP, Client.RELIABLE):
+            raise TypeError("Invalid network_protocol type. Must be TCP or RELIABLE.")
+
+        self.client = client
+        self.sample = sample
+        self.apply = apply
+        self.desync = desync
+        self.network_protocol = network_protocol
+
+        self.running = False
+        self.game: t.Optional[int] = None
+        self.player: t.Optional[int] = None
+        self.tick = 0
+        self.input_delay = 0
+        self.hash_interval = 0
+        self.inputs: t.Dict[int, dict] = {}
+        self.stalls = 0
+        self._ticks: t.Dict[int, t.Dict[int, dict]] = {}
+        self._lock = threading.Lock()
+
+        self.client.register_protocol(self._lockstep_start)
+        self.client.register_protocol(self._lockstep_stop)
+        self.client.register_protocol(self._lockstep_tick)
+        self.client.register_protocol(self._lockstep_desync)
+        self.client.push_handlers(self)
+
+    @property
+    def buffered(self) -> int:
+        """ Ticks ready to run. """
+        with self._lock:
+            count = 0
+            while self.tick + count in self._ticks.keys():
+                count += 1
+            return count
+
+    @property
+    def behind(self) -> bool:
+        return self.buffered > self.input_delay // 2
+
+    def begin_tick(self) -> bool:
+        """ Start the next tick if its inputs are here, returning whether
+        it should run. Called by the Application.
+        """
+        with self._lock:
+            if not self.running:
+                return False
+            inputs = self._ticks.pop(self.tick, None)
+            if inputs is None:
+                self.stalls += 1
+                return False
+            game, tick = self.game, self.tick
+
+        self.client.send(
+            "_lockstep_input",
+            {"game": game, "tick": tick + self.input_delay, "controls": self.sample()},
+            network_protocol=self.network_protocol
+        )
+        self.inputs = inputs
+        if self.apply is not None:
+            self.apply(inputs)
+        return True
+
+    def end_tick(self, space: jank.physics.Space):
+        """ Finish the tick, sending a hash of `space` every
+        `hash_interval` ticks. Called by the Application.
+        """
+        if self.hash_interval and self.tick % self.hash_interval == 0:
+            self.client.send(
+                "_lockstep_hash",
+                {"game": self.game, "tick": self.tick, "digest": state_hash(space)},
+                network_protocol=self.network_protocol
+            )
+        with self._lock:
+            self.tick += 1
+
+    def on_disconnection(self, socket):
+        self.running = False
+
+    def _lockstep_start(self, game: int, player: int, input_delay: int, hash_interval: int):
+        with self._lock:
+            self.game = game
+            self.player = player
+            self.input_delay = input_delay
+            self.hash_interval = hash_interval
+            self.tick = 0
+            self.inputs = {}
+            self.stalls = 0
+            self._ticks = {tick: {} for tick in range(input_delay)}
+            self.running = True
+
+    def _lockstep_stop(self):
+        with self._lock:
+            self.running = False
+            self._ticks = {}
+
+    def _lockstep_tick(self, game: int, tick: int, inputs: t.List[t.Tuple[int, dict]]):
+        with self._lock:
+            if game != self.game:
+                return
+            self._ticks[tick] = {player: controls for player, controls in inputs}
+
+    def _lockstep_desync(self, tick: int):
+        print(f"Lockstep desync at tick {tick}.")
+        if self.desync is not None:
+            self.desync(tick)
@@ -0,0 +1,51 @@
+import typing as t
+
+from . import compressors, fragments, framings
+
+
+class Message:
+    """ A message encoded once, reusable for any number of sends.
+    Create with `Server.prepare` and send with `Server.send_message`.
+    """
+
+    def __init__(
+        self,
+        protocol: str,
+        payload: bytes,
+        framing: framings.Framing,
+        data: t.Optional[dict] = None,
+        compressor: t.Optional[compressors.Compressor] = None
+    ):
+        self.protocol = protocol
+        self.payload = payload
+        self.data = data
+        self.framing = framing
+        self.compressor = compressor
+        self._frame: t.Optional[bytes] = None
+        self._datagrams: t.Optional[t.List[bytes]] = None
+        # Re-encoded by protocol ID, per client protocol table.
+        self.interned: t.Dict[t.Any, "Message"] = {}
+        # Encoded without packing, for clients that didn't accept the schema.
+        self.unpacked: t.Optional["Message"] = None
+
+    def __len__(self) -> int:
+        return len(self.payload)
+
+    @property
+    def frame(self) -> bytes:
+        """ The payload with its TCP header, built (and compressed if
+        large enough) on first use.
+        """
+        if self._frame is None:
+            self._frame = compressors.frame(self.payload, self.framing, self.compressor)
+        return self._frame
+
+    def datagrams(self, size: t.Optional[int], ids: t.Iterator[int]) -> t.List[bytes]:
+        """ The payload as UDP datagrams of at most `size` bytes, split
+        into fragments on first use if larger.
+        """
+        if size is None or len(self.payload) <= size:
+            return [self.payload]
+        if self._datagrams is None:
+            self._datagrams = fragments.split(self.payload, size, next(ids))
+        return self._datagrams
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+import typing as t
+
+
+class NetworkConditions:
+    """ Simulates a bad network on outgoing writes.
+
+    Assign to a Server's or Client's `conditions` to delay every write by
+    `latency` plus up to `jitter` seconds, and cap throughput at
+    `bandwidth` bytes a second. Datagrams are also dropped with
+    probability `loss`, and held back an extra `reorder_delay` with
+    probability `reorder` so later ones overtake them. Streams (TCP) are
+    never dropped or reordered, only delayed.
+    Writes are made from a background thread once they are due.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        reorder: float = 0.0,
+        reorder_delay: float = 0.02,
+        bandwidth: t.Optional[float] = None,
+        seed: t.Optional[int] = None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.bandwidth = bandwidth
+
+        self.dropped = 0
+        self.delivered = 0
+
+        self._random = random.Random(seed)
+        self._queue: t.List[t.Tuple[float, int, t.Callable[..., t.Any], tuple]] = []
+        self._counter = itertools.count()
+        self._streams: t.Dict[t.Hashable, float] = {}
+        self._link_free = 0.0
+        self._condition = threading.Condition()
+        self._thread: t.Optional[threading.Thread] = None
+
+    @property
+    def pending(self) -> int:
+        """ Number of writes waiting to be made. """
+        return len(self._queue)
+
+    def submit(
+        self,
+        write: t.Callable[..., t.Any],
+        args: tuple,
+        size: int,
+        stream: t.Optional[t.Hashable] = None
+    ):
+        """ Schedule `write(*args)` for `size` bytes. Writes sharing a
+        `stream` key stay in order and are never dropped, otherwise they
+        are treated as datagrams.
+        """
+        now = time.monotonic()
+        with self._condition:
+            if stream is None and self._random.random() < self.loss:
+                self.dropped += 1
+                return
+
+            departure = now
+            if self.bandwidth:
+                departure = max(now, self._link_free) + size / self.bandwidth
+                self._link_free = departure
+
+            due = departure + self.latency + self._random.uniform(0, self.jitter)
+            if stream is None:
+                if self._random.random() < self.reorder:
+                    due += self.reorder_delay
+            else:
+                due = max(due, self._streams.get(stream, 0.0))
+                self._streams[stream] = due
+
+            heapq.heappush(self._queue, (due, next(self._counter), write, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver_thread, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def forget(self, stream: t.Hashable):
+        """ Stop tracking the ordering of a closed stream. """
+        with self._condition:
+            self._streams.pop(stream, None)
+
+    def _deliver_thread(self):
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._condition.wait(timeout)
+                _, _, write, args = heapq.heappop(self._queue)
+
+            try:
+                write(*args)
+            except (OSError, RuntimeError):
+                # The socket or loop was closed while the write was in flight.
+                continue
+            self.delivered += 1
@@ -0,0 +1,103 @@
+import collections
+import socket
+import threading
+import typing as t
+
+import jank
+
+from .server import Server
+
+
+def integrate(entity: "jank.Entity", dt: float):
+    """ Default replay step, moves an entity by its velocity. """
+    entity.position = entity.position + entity.velocity * dt
+
+
+class Predictor:
+    """ Client-side prediction with server reconciliation for one Entity.
+
+    Every fixed update, `record` numbers the local input, applies it to
+    the entity straight away and returns the message to send to the
+    server. When authoritative state arrives along with the last input
+    sequence the server processed, `reconcile` resets the entity to it and
+    replays the inputs the server has not seen yet, using `apply` followed
+    by `simulate` for each one.
+    """
+
+    def __init__(
+        self,
+        entity: "jank.Entity",
+        apply: t.Callable[["jank.Entity", dict, float], t.Any],
+        simulate: t.Callable[["jank.Entity", float], t.Any] = integrate,
+        history_size: int = 256
+    ):
+        self.entity = entity
+        self.apply = apply
+        self.simulate = simulate
+
+        self.sequence = 0
+        self.acknowledged = -1
+        self._inputs: t.Deque[t.Tuple[int, dict, float]] = collections.deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """ Number of inputs not yet acknowledged by the server. """
+        return len(self._inputs)
+
+    def record(self, controls: dict, dt: float) -> dict:
+        with self._lock:
+            sequence = self.sequence
+            self.sequence += 1
+            self._inputs.append((sequence, controls, dt))
+
+        self.apply(self.entity, controls, dt)
+        return {"sequence": sequence, "controls": controls}
+
+    def reconcile(self, state: dict, sequence: int):
+        """ Apply server `state` (field -> value) that includes every input
+        up to and including `sequence`.
+        """
+        with self._lock:
+            if sequence < self.acknowledged:
+                return
+            self.acknowledged = sequence
+            while self._inputs and self._inputs[0][0] <= sequence:
+                self._inputs.popleft()
+            inputs = list(self._inputs)
+
+        for field, value in state.items():
+            setattr(self.entity, field, value)
+
+        for _, controls, dt in inputs:
+            self.apply(self.entity, controls, dt)
+            self.simulate(self.entity, dt)
+
+
+class InputTracker:
+    """ Server-side counterpart to Predictor.
+
+    Drops stale or duplicate inputs and remembers the last sequence
+    processed for each client, to send back alongside its state.
+    """
+
+    def __init__(self, server: Server):
+        self._sequences: t.Dict[socket.socket, int] = {}
+        server.push_handlers(self)
+
+    def receive(self, socket: socket.socket, sequence: int) -> bool:
+        """ Whether an input is new and should be processed. """
+        if sequence <= self._sequences.get(socket, -1):
+            return False
+        self._sequences[socket] = sequence
+        return True
+
+    def last_sequence(self, socket: socket.socket) -> int:
+        return self._sequences.get(socket, -1)
+
+    def on_disconnection(self, socket: socket.socket):
+        self._sequences.pop(socket, None)
+
+    def on_resume(self, socket: socket.socket, old_socket: socket.socket):
+        if old_socket in self._sequences.keys():
+            self._sequences[socket] = self._sequences.pop(old_socket)
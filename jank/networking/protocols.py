@@ -0,0 +1,99 @@
+import inspect
+import typing as t
+
+
+class ProtocolTable:
+    """ Compact integer IDs for protocols, assigned in registration order.
+
+    Each endpoint keeps a table of its own handlers, and with
+    `interned_protocols` enabled sends the peer its `entries`: every
+    protocol's name and handler parameter names. The peer then sends
+    `{"protocol": id, "data": [values]}` with the values in parameter
+    order, which is dispatched by indexing `handlers` and calling the
+    handler positionally, with no name lookup or keyword unpacking.
+    Handlers taking `*args`, `**kwargs` or keyword-only parameters, and
+    data not matching the parameters exactly, are sent by name instead.
+    """
+
+    def __init__(self, entries: t.Iterable[t.Sequence[t.Any]] = ()):
+        self.ids: t.Dict[str, int] = {}
+        self.names: t.List[str] = []
+        self.parameters: t.List[t.Optional[t.Tuple[str, ...]]] = []
+        self.handlers: t.List[t.Optional[t.Callable[..., t.Any]]] = []
+
+        for name, parameters in entries:
+            self._add(name, None, None if parameters is None else tuple(parameters))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def register(self, name: str, func: t.Callable[..., t.Any], skip: int = 0) -> int:
+        """ Add or replace the handler for `name`, ignoring its first `skip`
+        parameters (e.g. a server handler's socket). Returns its ID, which
+        is kept when a handler is replaced.
+        """
+        parameters = self.signature(func, skip)
+        protocol_id = self.ids.get(name)
+        if protocol_id is None:
+            return self._add(name, func, parameters)
+
+        self.handlers[protocol_id] = func
+        self.parameters[protocol_id] = parameters
+        return protocol_id
+
+    def entries(self) -> t.List[list]:
+        """ The table as sent to the peer, indexed by ID. """
+        return [
+            [name, None if parameters is None else list(parameters)]
+            for name, parameters in zip(self.names, self.parameters)
+        ]
+
+    def key(self) -> tuple:
+        return tuple(zip(self.names, self.parameters))
+
+    def intern(self, protocol: str, data: dict) -> t.Optional[dict]:
+        """ The message for `protocol` by ID, or None if it can't be. """
+        protocol_id = self.ids.get(protocol)
+        if protocol_id is None:
+            return None
+        parameters = self.parameters[protocol_id]
+        if parameters is None or len(data) != len(parameters):
+            return None
+        try:
+            return {"protocol": protocol_id, "data": [data[name] for name in parameters]}
+        except KeyError:
+            return None
+
+    def name(self, protocol: t.Union[str, int]) -> str:
+        """ The name of a protocol given by name or ID. """
+        if isinstance(protocol, int) and 0 <= protocol < len(self.names):
+            return self.names[protocol]
+        return str(protocol)
+
+    @staticmethod
+    def signature(func: t.Callable[..., t.Any], skip: int = 0) -> t.Optional[t.Tuple[str, ...]]:
+        """ Names of `func`'s parameters, or None if it can't be called
+        positionally with exactly those.
+        """
+        try:
+            parameters = list(inspect.signature(func).parameters.values())[skip:]
+        except (TypeError, ValueError):
+            return None
+
+        positional = (inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)
+        if any(parameter.kind not in positional for parameter in parameters):
+            return None
+        return tuple(parameter.name for parameter in parameters)
+
+    def _add(
+        self,
+        name: str,
+        func: t.Optional[t.Callable[..., t.Any]],
+        parameters: t.Optional[t.Tuple[str, ...]]
+    ) -> int:
+        protocol_id = len(self.names)
+        self.ids[name] = protocol_id
+        self.names.append(name)
+        self.parameters.append(parameters)
+        self.handlers.append(func)
+        return protocol_id
@@ -0,0 +1,146 @@
+import threading
+import time
+import typing as t
+
+# (channel, order) identifies a reliable message.
+Key = t.Tuple[int, int]
+
+
+class ReliableEndpoint:
+    """ Reliable, per-channel ordered delivery state for one UDP peer.
+
+    Every packet carries a sequence number plus the latest sequence
+    received from the peer and a 32 bit field acknowledging the ones
+    before it. Unacknowledged messages are resent in new packets after
+    `resend_timeout`, and each channel delivers its messages in order
+    without waiting on the others.
+    """
+    ack_bits_size: int = 32
+    messages_per_packet: int = 16
+
+    def __init__(self, resend_timeout: float = 0.1):
+        self.resend_timeout = resend_timeout
+        self.resent = 0
+
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._orders: t.Dict[int, int] = {}
+        self._pending: t.Dict[Key, t.Tuple[dict, float]] = {}
+        self._in_flight: t.Dict[int, t.List[Key]] = {}
+
+        self._remote_sequence = -1
+        self._ack_bits = 0
+        self._expected: t.Dict[int, int] = {}
+        self._held: t.Dict[int, t.Dict[int, dict]] = {}
+
+    @property
+    def pending(self) -> int:
+        """ Number of messages waiting to be acknowledged. """
+        return len(self._pending)
+
+    def send(self, message: dict, channel: int = 0) -> dict:
+        """ Queue a message and return the packet carrying it. """
+        with self._lock:
+            order = self._orders.get(channel, 0)
+            self._orders[channel] = order + 1
+
+            key = (channel, order)
+            self._pending[key] = (message, time.monotonic())
+            return self._packet([key])
+
+    def ack(self) -> dict:
+        """ A packet acknowledging received packets, carrying no messages. """
+        with self._lock:
+            return {
+                "sequence": -1,
+                "ack": self._remote_sequence,
+                "ack_bits": self._ack_bits,
+                "messages": []
+            }
+
+    def resend(self) -> t.List[dict]:
+        """ Packets for every message not acknowledged in time. """
+        now = time.monotonic()
+        with self._lock:
+            keys = [
+                key for key, (_, sent) in self._pending.items()
+                if now - sent >= self.resend_timeout
+            ]
+            for key in keys:
+                self._pending[key] = (self._pending[key][0], now)
+            self.resent += len(keys)
+
+            return [
+                self._packet(keys[i:i+self.messages_per_packet])
+                for i in range(0, len(keys), self.messages_per_packet)
+            ]
+
+    def receive(
+        self,
+        sequence: int,
+        ack: int,
+        ack_bits: int,
+        messages: t.List[t.Tuple[int, int, dict]]
+    ) -> t.List[dict]:
+        """ Process a packet, returning the messages now ready in order. """
+        with self._lock:
+            self._acknowledge(ack, ack_bits)
+            if sequence >= 0:
+                self._record(sequence)
+
+            delivered = []
+            for channel, order, message in messages:
+                expected = self._expected.get(channel, 0)
+                if order < expected:
+                    continue
+
+                held = self._held.setdefault(channel, {})
+                held[order] = message
+                while expected in held.keys():
+                    delivered.append(held.pop(expected))
+                    expected += 1
+                self._expected[channel] = expected
+            return delivered
+
+    def _packet(self, keys: t.List[Key]) -> dict:
+        sequence = self._sequence
+        self._sequence += 1
+        self._in_flight[sequence] = keys
+
+        return {
+            "sequence": sequence,
+            "ack": self._remote_sequence,
+            "ack_bits": self._ack_bits,
+            "messages": [
+                [channel, order, self._pending[(channel, order)][0]]
+                for channel, order in keys
+            ]
+        }
+
+    def _record(self, sequence: int):
+        mask = (1 << self.ack_bits_size) - 1
+        if sequence > self._remote_sequence:
+            shift = sequence - self._remote_sequence
+            self._ack_bits = ((self._ack_bits << shift) | (1 << (shift - 1))) & mask
+            self._remote_sequence = sequence
+        elif sequence < self._remote_sequence:
+            distance = self._remote_sequence - sequence
+            if distance <= self.ack_bits_size:
+                self._ack_bits |= 1 << (distance - 1)
+
+    def _acknowledge(self, ack: int, ack_bits: int):
+        if ack < 0:
+            return
+
+        acked = [ack] + [
+            ack - i - 1 for i in range(self.ack_bits_size)
+            if ack_bits >> i & 1
+        ]
+        for sequence in acked:
+            for key in self._in_flight.pop(sequence, []):
+                self._pending.pop(key, None)
+
+        # Older packets can no longer be acknowledged, resends replace them.
+        oldest = ack - self.ack_bits_size
+        for sequence in [sequence for sequence in self._in_flight.keys() if sequence < oldest]:
+            del self._in_flight[sequence]
@@ -0,0 +1,248 @@
+import socket
+import threading
+import typing as t
+
+import jank
+
+from .client import Client
+from .interest import InterestManager
+from .interpolation import Interpolator
+from .server import Server
+
+# Entity id -> field name -> quantised values.
+State = t.Dict[str, t.Dict[str, t.Tuple[int, ...]]]
+
+
+def quantise(value: t.Any, precision: float) -> t.Tuple[int, ...]:
+    if isinstance(value, (int, float)):
+        return (round(value / precision),)
+    return tuple(round(v / precision) for v in value)
+
+
+def dequantise(value: t.Sequence[int], precision: float) -> t.Any:
+    if len(value) == 1:
+        return value[0] * precision
+    return tuple(v * precision for v in value)
+
+
+class Replicator:
+    """ Replicates Entity state from a Server to its clients.
+
+    Call `update` once per tick. Each client is sent only the fields that
+    changed since the last snapshot it acknowledged, with floats
+    quantised to `precision`, so idle entities cost nothing.
+    With an InterestManager, clients only receive entities in their view.
+    A client resuming its session keeps its baseline, so only what changed
+    while it was away is sent.
+    """
+    fields: t.List[str] = ["position", "velocity", "angle"]
+    history_size: int = 64
+
+    def __init__(
+        self,
+        server: Server,
+        precision: float = 0.01,
+        network_protocol: int = Server.UDP,
+        interest: t.Optional[InterestManager] = None
+    ):
+        self.server = server
+        self.precision = precision
+        self.network_protocol = network_protocol
+        self.interest = interest
+
+        self.tick = 0
+        self.entities: t.Dict[str, "jank.Entity"] = {}
+        self._sent: t.Dict[socket.socket, t.Dict[int, State]] = {}
+        self._acked: t.Dict[socket.socket, t.Tuple[int, State]] = {}
+        self._lock = threading.Lock()
+
+        self.server.register_protocol(self._replicate_ack, "_replicate_ack")
+        self.server.push_handlers(self)
+
+    def add(self, entity_id: str, entity: "jank.Entity"):
+        self.entities[entity_id] = entity
+
+    def remove(self, entity_id: str):
+        if entity_id in self.entities.keys():
+            del self.entities[entity_id]
+
+    def snapshot(self) -> State:
+        return {
+            entity_id: {
+                field: quantise(getattr(entity, field), self.precision)
+                for field in self.fields
+            }
+            for entity_id, entity in self.entities.items()
+        }
+
+    def update(self, sockets: t.Optional[t.Iterable[socket.socket]] = None):
+        """ Send each client in `sockets` (all if None) its delta. """
+        self.tick += 1
+        state = self.snapshot()
+
+        if sockets is None:
+            sockets = self.server.clients.copy().values()
+
+        if self.interest is not None:
+            self.interest.update()
+
+        # Clients with the same baseline and view share one message.
+        groups: t.Dict[t.Hashable, t.Tuple[int, State, State, t.List[socket.socket]]] = {}
+        with self._lock:
+            for c_socket in sockets:
+                baseline_tick, baseline = self._acked.get(c_socket, (-1, {}))
+                client_state = state
+                key: t.Hashable = baseline_tick
+                if self.interest is not None:
+                    visible = self.interest.visible(c_socket, self.entities)
+                    client_state = {entity_id: state[entity_id] for entity_id in visible}
+                    key = (baseline_tick, frozenset(client_state.keys()))
+                group = groups.setdefault(key, (baseline_tick, baseline, client_state, []))
+                group[3].append(c_socket)
+
+                sent = self._sent.setdefault(c_socket, {})
+                sent[self.tick] = client_state
+                oldest = self.tick - self.history_size
+                for tick in [tick for tick in sent.keys() if tick <= oldest]:
+                    del sent[tick]
+
+        for baseline_tick, baseline, client_state, group in groups.values():
+            message = self.server.prepare("_replicate", {
+                "tick": self.tick,
+                "baseline": baseline_tick,
+                "entities": self.delta(baseline, client_state),
+                "removed": [
+                    entity_id for entity_id in baseline.keys()
+                    if entity_id not in client_state.keys()
+                ]
+            })
+            self.server.send_message(message, group, network_protocol=self.network_protocol)
+
+    @staticmethod
+    def delta(baseline: State, state: State) -> State:
+        delta = {}
+        for entity_id, fields in state.items():
+            previous = baseline.get(entity_id, {})
+            changed = {
+                field: value for field, value in fields.items()
+                if previous.get(field) != value
+            }
+            if changed:
+                delta[entity_id] = changed
+        return delta
+
+    def on_disconnection(self, socket: socket.socket):
+        with self._lock:
+            self._sent.pop(socket, None)
+            self._acked.pop(socket, None)
+
+    def on_resume(self, socket: socket.socket, old_socket: socket.socket):
+        with self._lock:
+            if old_socket in self._sent.keys():
+                self._sent[socket] = self._sent.pop(old_socket)
+            if old_socket in self._acked.keys():
+                self._acked[socket] = self._acked.pop(old_socket)
+
+    def _replicate_ack(self, socket: socket.socket, tick: int):
+        with self._lock:
+            sent = self._sent.get(socket, {})
+            if tick not in sent.keys():
+                return
+            if tick > self._acked.get(socket, (-1, {}))[0]:
+                self._acked[socket] = (tick, sent[tick])
+            for old_tick in [old_tick for old_tick in sent.keys() if old_tick < tick]:
+                del sent[old_tick]
+
+
+class ReplicationReceiver:
+    """ Applies a Replicator's snapshots to local entities on a Client.
+
+    `spawn` creates the entity for an unknown id, and `despawn` (defaults
+    to `Entity.delete`) removes one that the server no longer sends.
+    Snapshots are applied wherever the client dispatches messages, so use
+    a queued `dispatch_mode` to apply them on the main thread.
+    With an Interpolator, snapshots are buffered and rendered by it instead.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        spawn: t.Callable[[str], "jank.Entity"],
+        despawn: t.Optional[t.Callable[[str, "jank.Entity"], t.Any]] = None,
+        precision: float = 0.01,
+        network_protocol: int = Client.UDP,
+        interpolator: t.Optional[Interpolator] = None
+    ):
+        self.client = client
+        self.spawn = spawn
+        self.despawn = despawn
+        self.precision = precision
+        self.network_protocol = network_protocol
+        self.interpolator = interpolator
+
+        self.tick = -1
+        self.entities: t.Dict[str, "jank.Entity"] = {}
+        self._states: t.Dict[int, State] = {-1: {}}
+
+        self.client.register_protocol(self._replicate, "_replicate")
+
+    def _replicate(
+        self,
+        tick: int,
+        baseline: int,
+        entities: State,
+        removed: t.List[str]
+    ):
+        if tick <= self.tick or baseline not in self._states.keys():
+            # Stale, or based on a snapshot we no longer have.
+            return
+
+        state = {
+            entity_id: dict(fields)
+            for entity_id, fields in self._states[baseline].items()
+            if entity_id not in removed
+        }
+        for entity_id, fields in entities.items():
+            state.setdefault(entity_id, {}).update(fields)
+
+        self.tick = tick
+        # The empty -1 baseline is kept for a server that starts over,
+        # e.g. after reconnecting without a session.
+        self._states = {
+            old_tick: old_state for old_tick, old_state in self._states.items()
+            if old_tick >= baseline or old_tick == -1
+        }
+        self._states[tick] = state
+
+        for entity_id in removed:
+            self._remove(entity_id)
+        for entity_id, fields in entities.items():
+            entity = self.entities.get(entity_id)
+            if entity is None:
+                entity = self.entities[entity_id] = self.spawn(entity_id)
+                if self.interpolator is not None:
+                    self.interpolator.add(entity_id, entity)
+            if self.interpolator is not None:
+                self.interpolator.push(entity_id, {
+                    field: dequantise(value, self.precision)
+                    for field, value in state[entity_id].items()
+                })
+                continue
+            for field, value in fields.items():
+                setattr(entity, field, dequantise(value, self.precision))
+
+        self.client.send(
+            "_replicate_ack", {"tick": tick},
+            network_protocol=self.network_protocol
+        )
+
+    def _remove(self, entity_id: str):
+        entity = self.entities.pop(entity_id, None)
+        if entity is None:
+            return
+        if self.interpolator is not None:
+            self.interpolator.remove(entity_id)
+        if self.despawn is not None:
+            self.despawn(entity_id, entity)
+        else:
+            entity.delete()
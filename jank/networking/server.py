@@ -1,35 +1,163 @@
+import itertools
+import secrets
+import selectors
 import socket
 import threading
+import time
+import traceback
 import typing as t
+from queue import Empty, Full, Queue
 
 import jank
-from . import encoders
+from . import compressors, encoders, fragments, framings
+from .buffers import ReceiveBuffer, SendQueue
+from .message import Message
+from .netsim import NetworkConditions
+from .protocols import ProtocolTable
+from .reliability import ReliableEndpoint
+from .stats import NetworkStats
 
 
 class Server(jank.pyglet.event.EventDispatcher):
     TCP: int = 1
     UDP: int = 2
+    # Acknowledged, resent and ordered per channel over the UDP socket.
+    RELIABLE: int = 3
+    IMMEDIATE: int = 0
+    UPDATE: int = 1
+    FIXED_UPDATE: int = 2
+    NETWORK_UPDATE: int = 3
+    DROP: int = 0
+    COALESCE: int = 1
+    DISCONNECT: int = 2
 
-    _header_size: int = 32
     _address: t.Optional[str] = None
     _port: t.Optional[int] = None
     _protocols: t.Dict[str, t.Callable[..., t.Any]] = {}
     _udp_addresses: t.Dict[socket.socket, t.Tuple[str, int]] = {}
+    _udp_sockets: t.Dict[t.Tuple[str, int], socket.socket] = {}
+    _client_addresses: t.Dict[socket.socket, t.Tuple[str, int]] = {}
 
     clients: t.Dict[t.Tuple[str, int], socket.socket] = {}
     connected: bool = False
     udp_enabled: bool = False
     udp_buffer: int = 2048
+    # UDP messages over `fragment_size` bytes are split into fragments,
+    # small enough to fit in a typical 1500 byte MTU, and reassembled by
+    # the receiver. A message is lost if any of its fragments don't arrive
+    # within `fragment_timeout` seconds. None sends each message as one
+    # datagram, which must then fit in the receiver's `udp_buffer`.
+    fragment_size: t.Optional[int] = 1200
+    fragment_timeout: float = 1.0
     encoder: encoders.Encoder = encoders.JsonEncoder
+    framing: framings.Framing = framings.AsciiFraming
+    # Compresses TCP messages over the compressor's size threshold.
+    # Clients must use the same compressor.
+    compressor: t.Optional[compressors.Compressor] = None
+    # TCP messages claiming to be larger than this many bytes are refused
+    # and their sender disconnected.
+    max_message_size: int = 1 << 24
+    # Multiplex every socket on a single selector thread instead of
+    # spawning a thread per client. Must be set before `connect`.
+    selector_mode: bool = False
+    selector_timeout: float = 0.1
+    # Queue broadcasts until `flush`, which sends each client a single
+    # batch per network protocol. Push the server onto the application
+    # to flush at the end of every fixed update, or every network update
+    # with a `flush_mode` of NETWORK_UPDATE.
+    batching: bool = False
+    flush_mode: int = FIXED_UPDATE
+    # Where protocol handlers run. IMMEDIATE runs them on the socket
+    # threads, UPDATE, FIXED_UPDATE and NETWORK_UPDATE queue decoded
+    # messages to be run by `process_messages` from the matching event, so
+    # push this onto the application. The queue holds `message_queue_size`
+    # messages, and never blocks the socket threads: when it is full
+    # `queue_overflow` applies, DROP discards the message and DISCONNECT
+    # closes the client that sent it. Either way it's counted in `stats`.
+    dispatch_mode: int = IMMEDIATE
+    message_queue_size: int = 4096
+    queue_overflow: int = DROP
+    message_budget: int = 256
+    resend_interval: float = 0.05
+    resend_timeout: float = 0.1
+    # Count traffic into `stats`, and ping clients every `ping_interval`
+    # seconds to measure RTT and UDP loss. Must be set before `connect`.
+    statistics: bool = False
+    ping_interval: float = 1.0
+    # Simulated latency, loss etc. applied to outgoing writes, for testing.
+    conditions: t.Optional[NetworkConditions] = None
+    # Per-client send rates for `ready_clients`. Clients are sent updates at
+    # most `max_send_rate` times a second, slowing down as their RTT (needs
+    # `statistics`) rises above `target_rtt` or their reliable backlog
+    # grows past `target_backlog`, but never below `min_send_rate`.
+    max_send_rate: float = 30
+    min_send_rate: float = 5
+    target_rtt: float = 0.1
+    target_backlog: int = 32
+    # Queue TCP writes per client and send them without blocking, so one
+    # slow client can't stall a broadcast. When a message would take a
+    # client's queue past `send_queue_limit` bytes, on_backpressure is
+    # dispatched and `overflow_policy` applies: DROP discards the message,
+    # COALESCE first discards queued messages of the same protocol, and
+    # DISCONNECT closes the client. Must be set before `connect`.
+    send_queue: bool = False
+    send_queue_limit: int = 1 << 20
+    overflow_policy: int = COALESCE
+    # Give each client a session token. A client whose connection drops can
+    # reconnect with it within `session_grace` seconds and carry on where
+    # it left off: on_resume(socket, old_socket) is dispatched instead of
+    # on_connection, and on_disconnection is delayed until the grace period
+    # runs out. Clients must enable sessions too.
+    sessions: bool = False
+    session_grace: float = 10.0
+    # Exchange protocol tables with clients so messages name their protocol
+    # by a small integer ID and carry their data as a list, dispatched
+    # through an indexed handler table, see ProtocolTable. Clients must
+    # enable it too, anything that can't be interned is sent by name.
+    interned_protocols: bool = False
 
     def __init__(self):
+        self._protocols = {}
+        self._udp_addresses = {}
+        self._udp_sockets = {}
+        self._client_addresses = {}
+        self._recv_buffers: t.Dict[socket.socket, ReceiveBuffer] = {}
+        self._reliable_endpoints: t.Dict[socket.socket, ReliableEndpoint] = {}
+        self._batch_queue: t.List[t.Tuple[str, dict, t.Optional[t.List[socket.socket]], int]] = []
+        self._batch_lock = threading.Lock()
+        self._message_queue: Queue = Queue(maxsize=self.message_queue_size)
+        self._next_send: t.Dict[socket.socket, float] = {}
+        self._send_queues: t.Dict[socket.socket, SendQueue] = {}
+        self._writer_wake = threading.Event()
+        self._session_tokens: t.Dict[socket.socket, t.Optional[str]] = {}
+        self._suspended: t.Dict[str, t.Tuple[socket.socket, threading.Timer]] = {}
+        self._session_lock = threading.Lock()
+        self._protocol_ids = ProtocolTable()
+        self._client_protocols: t.Dict[socket.socket, ProtocolTable] = {}
+        self._protocol_tables: t.Dict[tuple, ProtocolTable] = {}
+        self._packed: t.Dict[socket.socket, t.Set[str]] = {}
+        self._fragment_ids = itertools.count()
+        self._reassembler = fragments.Reassembler(self.fragment_timeout)
+        self.clients = {}
+        self.stats = NetworkStats()
+
         self.register_protocol(self._assign_udp_port)
+        self.register_protocol(self._reliable)
+        self.register_protocol(self._ping)
+        self.register_protocol(self._pong)
+        self.register_protocol(self._resume)
+        self.register_protocol(self._end_session)
+        self.register_protocol(self._protocol_table)
+        self.register_protocol(self._encoder_accept)
 
     def register_protocol(self, func: t.Callable[..., t.Any], name: t.Optional[str] = None):
         if name is None:
             name = func.__name__
 
         self._protocols[name] = func
+        self._protocol_ids.register(name, func, skip=1)
+        if self.connected and self.interned_protocols:
+            self.send_message(self._prepare_protocol_table())
 
         return func
 
@@ -39,38 +167,103 @@ class Server(jank.pyglet.event.EventDispatcher):
     def on_disconnection(self, socket: socket.socket):
         """ Called on socket disconnection. """
 
-    def threaded_client_tcp(self, c_socket: socket.socket, c_address: t.Tuple[str, int]):
-        print(f"Accepted new connection from {c_address[0]}:{c_address[1]}.")
-        self.clients[c_address] = c_socket
+    def on_backpressure(self, socket: socket.socket, queued: int):
+        """ Called when a client's send queue exceeds its limit. """
 
-        self.dispatch_event("on_connection", c_socket)
+    def on_resume(self, socket: socket.socket, old_socket: socket.socket):
+        """ Called when a client reconnects to its session, move any state
+        kept for `old_socket` over to `socket`.
+        """
 
-        try:
-            while True:
-                header_bytes = self.recv_bytes_tcp(c_socket, self._header_size)
-                header = header_bytes.decode("utf-8")
-                length = int(header.strip())
+    def on_update(self, dt: float):
+        """ Runs queued messages when pushed onto the application. """
+        if self.dispatch_mode == self.UPDATE:
+            self.process_messages()
 
-                message = self.recv_bytes_tcp(c_socket, length)
+    def on_fixed_update(self, dt: float):
+        """ Runs queued messages and flushes batched broadcasts when pushed
+        onto the application.
+        """
+        if self.dispatch_mode == self.FIXED_UPDATE:
+            self.process_messages()
+        if self.batching and self.flush_mode == self.FIXED_UPDATE:
+            self.flush()
 
-                data = self.encoder.decode(message)
-                if data["protocol"] in self._protocols.keys():
-                    self._protocols[data["protocol"]](
-                        c_socket, **data["data"]
-                    )
-                else:
-                    print(f"Recieved invalid/unregistered protocol type: {data['protocol']}")
+    def on_network_update(self, dt: float):
+        """ Runs queued messages and flushes batched broadcasts at the
+        application's network rate when pushed onto it.
+        """
+        if self.dispatch_mode == self.NETWORK_UPDATE:
+            self.process_messages()
+        if self.batching and self.flush_mode == self.NETWORK_UPDATE:
+            self.flush()
+
+    def send_rate(self, socket: socket.socket) -> float:
+        """ Updates a second a client can currently keep up with. """
+        rate = self.max_send_rate
+
+        rtt = self.stats.rtt(self._client_addresses.get(socket))
+        if rtt is not None and rtt > self.target_rtt:
+            rate *= self.target_rtt / rtt
+
+        endpoint = self._reliable_endpoints.get(socket)
+        if endpoint is not None and endpoint.pending > self.target_backlog:
+            rate *= self.target_backlog / endpoint.pending
+
+        return max(self.min_send_rate, rate)
+
+    def ready_clients(self) -> t.List[socket.socket]:
+        """ Clients due an update at their send rate. Call once per
+        network update and send only to these, e.g. with
+        `Replicator.update(server.ready_clients())`.
+        """
+        now = time.monotonic()
+        ready = []
+        for c_socket in self.clients.copy().values():
+            due = self._next_send.get(c_socket, now)
+            if now >= due:
+                ready.append(c_socket)
+                self._next_send[c_socket] = max(due + 1 / self.send_rate(c_socket), now)
+        return ready
+
+    def process_messages(self, budget: t.Optional[int] = None) -> int:
+        """ Run up to `budget` queued messages, returning how many ran. """
+        if budget is None:
+            budget = self.message_budget
+
+        processed = 0
+        while processed < budget:
+            try:
+                c_socket, data = self._message_queue.get_nowait()
+            except Empty:
+                break
+            self._call_protocol(c_socket, data)
+            processed += 1
+        return processed
+
+    def threaded_client_tcp(
+        self,
+        c_socket: socket.socket,
+        c_address: t.Tuple[str, int],
+        data: t.Optional[bytes] = None
+    ):
+        self._add_client(c_socket, c_address)
+        buffer = self._recv_buffers[c_socket]
+        if data is not None:
+            self._adopted(c_socket, data)
+
+        try:
+            while True:
+                buffer.recv_into(c_socket)
+                for message in buffer.messages():
+                    self._handle_message(c_socket, message)
         except ConnectionResetError as e:
             print(f"""
 Connection from {c_address[0]}:{c_address[1]} was reset:
     {e}
 
 """)
-            del self.clients[c_address]
-            if c_socket in self._udp_addresses.keys():
-                del self._udp_addresses[c_socket]
-            c_socket.close()
-            self.dispatch_event("on_disconnection", c_socket)
+            self._remove_client(c_socket, c_address)
         except OSError as e:
             if e.errno == 10038:
                 print(f"""
@@ -86,67 +279,368 @@ Client socket closed, aborting:
         protocol: str,
         data: t.Optional[dict] = None,
         exclude: t.Optional[t.List[socket.socket]] = None,
-        network_protocol: int = TCP
+        network_protocol: int = TCP,
+        coalesce: bool = False,
+        channel: int = 0
     ):
-        if network_protocol != self.TCP and network_protocol != self.UDP:
-            raise TypeError("Invalid network_protocol type. Must be TCP or UDP.")
+        """ Send a message to every client not in `exclude`.
+        When batching, `coalesce` replaces any queued message of the same
+        protocol and `exclude` set instead of sending both, and reliable
+        messages are sent on channel 0.
+        """
+        if network_protocol not in (self.TCP, self.UDP, self.RELIABLE):
+            raise TypeError("Invalid network_protocol type. Must be TCP, UDP or RELIABLE.")
 
-        for c_socket in self.clients.copy().values():
-            if exclude is None or c_socket not in exclude:
-                try:
-                    self.send(
-                        c_socket,
-                        protocol, data,
-                        network_protocol=network_protocol
-                    )
-                except ConnectionResetError:
-                    continue
+        if data is None:
+            data = {}
+
+        if self.batching:
+            with self._batch_lock:
+                if coalesce:
+                    # Messages excluding other clients still have to reach
+                    # someone the new one doesn't.
+                    excluded = set(exclude or ())
+                    self._batch_queue = [
+                        item for item in self._batch_queue
+                        if item[0] != protocol or item[3] != network_protocol
+                        or set(item[2] or ()) != excluded
+                    ]
+                self._batch_queue.append((protocol, data, exclude, network_protocol))
+            return
+
+        self.send_message(
+            self.prepare(protocol, data),
+            exclude=exclude,
+            network_protocol=network_protocol,
+            channel=channel
+        )
 
     def send(
         self,
         socket: socket.socket,
         protocol: str,
         data: t.Optional[dict] = None,
-        network_protocol: int = TCP
+        network_protocol: int = TCP,
+        channel: int = 0
     ):
-        if network_protocol != self.TCP and network_protocol != self.UDP:
-            raise TypeError("Invalid network_protocol type. Must be TCP or UDP.")
+        if network_protocol not in (self.TCP, self.UDP, self.RELIABLE):
+            raise TypeError("Invalid network_protocol type. Must be TCP, UDP or RELIABLE.")
 
+        self._send_message(socket, self.prepare(protocol, data), network_protocol, channel)
+
+    def prepare(self, protocol: str, data: t.Optional[dict] = None) -> Message:
+        """ Encode a message once so it can be sent to many clients. """
         if data is None:
             data = {}
-        message = self.encoder.encode({
+        start = time.perf_counter()
+        payload = self.encoder.encode({
             "protocol": protocol,
             "data": data
         })
+        if self.statistics:
+            self.stats.encoded(time.perf_counter() - start, protocol)
+        return Message(protocol, payload, self.framing, data, self.compressor)
+
+    def send_message(
+        self,
+        message: Message,
+        sockets: t.Optional[t.Iterable[socket.socket]] = None,
+        exclude: t.Optional[t.List[socket.socket]] = None,
+        network_protocol: int = TCP,
+        channel: int = 0
+    ):
+        """ Send a prepared message to `sockets`, or every client if None. """
+        if network_protocol not in (self.TCP, self.UDP, self.RELIABLE):
+            raise TypeError("Invalid network_protocol type. Must be TCP, UDP or RELIABLE.")
+
+        if sockets is None:
+            sockets = self.clients.copy().values()
+
+        for c_socket in sockets:
+            if exclude is None or c_socket not in exclude:
+                try:
+                    self._send_message(c_socket, message, network_protocol, channel)
+                except ConnectionResetError:
+                    continue
+
+    def flush(self):
+        """ Send every broadcast queued while batching. """
+        with self._batch_lock:
+            queue, self._batch_queue = self._batch_queue, []
+
+        for network_protocol in (self.TCP, self.UDP, self.RELIABLE):
+            messages = [item for item in queue if item[3] == network_protocol]
+            if not messages:
+                continue
 
+            # Clients receiving the same messages share one encoded batch.
+            groups: t.Dict[t.Tuple[int, ...], t.List[socket.socket]] = {}
+            for c_socket in self.clients.copy().values():
+                indices = tuple(
+                    i for i, (_, _, exclude, _) in enumerate(messages)
+                    if exclude is None or c_socket not in exclude
+                )
+                if indices:
+                    groups.setdefault(indices, []).append(c_socket)
+
+            for indices, sockets in groups.items():
+                self._send_batch(
+                    [messages[i][:2] for i in indices],
+                    sockets, network_protocol
+                )
+
+    def _send_batch(
+        self,
+        messages: t.List[t.Tuple[str, dict]],
+        sockets: t.List[socket.socket],
+        network_protocol: int
+    ):
+        if len(messages) == 1:
+            message = self.prepare(*messages[0])
+        else:
+            message = self.prepare("_batch", {
+                "messages": [
+                    {"protocol": protocol, "data": data}
+                    for protocol, data in messages
+                ]
+            })
+            limit = self.fragment_size or self.udp_buffer
+            if network_protocol != self.TCP and len(message) > limit:
+                for item in messages:
+                    self._send_batch([item], sockets, network_protocol)
+                return
+
+        self.send_message(message, sockets, network_protocol=network_protocol)
+
+    def _send_message(
+        self,
+        socket: socket.socket,
+        message: Message,
+        network_protocol: int,
+        channel: int = 0
+    ):
         if network_protocol == self.TCP:
-            header = bytes(f"{len(message):<{self._header_size}}", "utf-8")
-            socket.sendall(header + message)
+            message = self._encode_for(socket, message)
+            if self.send_queue:
+                write, args = self._queue_tcp, (socket, message.protocol, message.frame)
+            else:
+                write, args = self._write_tcp, (socket, message.frame)
+            self._transmit(write, args, len(message.frame), socket)
+            if self.statistics:
+                self.stats.sent(
+                    message.protocol, len(message.frame), self._client_addresses.get(socket)
+                )
         else:
             if socket not in self._udp_addresses.keys():
                 print("Cannot send packet to user as UDP port has not yet been assigned.")
                 return
+            protocol = message.protocol
+            if network_protocol == self.RELIABLE:
+                endpoint = self._reliable_endpoints.get(socket)
+                if endpoint is None:
+                    return
+                packet = endpoint.send(
+                    {"protocol": message.protocol, "data": message.data},
+                    channel
+                )
+                message = self.prepare("_reliable", packet)
+            message = self._encode_for(socket, message)
             address = self._udp_addresses[socket]
-            self._socket_udp.sendto(message, address)
+            for datagram in message.datagrams(self.fragment_size, self._fragment_ids):
+                self._transmit(self._write_udp, (datagram, address), len(datagram))
+            if self.statistics:
+                self.stats.sent(protocol, len(message.payload), self._client_addresses.get(socket))
+
+    def _encode_for(self, socket: socket.socket, message: Message) -> Message:
+        if not self.encoder.packs(message.protocol):
+            return self._intern(socket, message)
+        if message.data is None or message.protocol in self._packed.get(socket, ()):
+            return message
+
+        # The client doesn't have this schema, or hasn't said yet.
+        if message.unpacked is None:
+            message.unpacked = Message(
+                message.protocol,
+                self.encoder.encode_unpacked({"protocol": message.protocol, "data": message.data}),
+                self.framing, message.data, self.compressor
+            )
+        return message.unpacked
+
+    def _intern(self, socket: socket.socket, message: Message) -> Message:
+        table = self._client_protocols.get(socket)
+        if table is None or message.data is None:
+            return message
+
+        interned = message.interned.get(table)
+        if interned is None:
+            data = table.intern(message.protocol, message.data)
+            if data is None:
+                interned = message
+            else:
+                interned = Message(
+                    message.protocol, self.encoder.encode(data),
+                    self.framing, message.data, self.compressor
+                )
+            message.interned[table] = interned
+        return interned
+
+    def _transmit(
+        self,
+        write: t.Callable[..., t.Any],
+        args: tuple,
+        size: int,
+        stream: t.Optional[t.Hashable] = None
+    ):
+        if self.conditions is None:
+            write(*args)
+        else:
+            self.conditions.submit(write, args, size, stream)
+
+    def _write_tcp(self, socket: socket.socket, data: bytes):
+        socket.sendall(data)
+
+    def _queue_tcp(self, socket: socket.socket, protocol: str, data: bytes):
+        queue = self._send_queues.get(socket)
+        if queue is None:
+            return
+
+        if queue.size + len(data) > self.send_queue_limit:
+            if not queue.over_limit:
+                queue.over_limit = True
+                self.dispatch_event("on_backpressure", socket, queue.size)
+            if self.overflow_policy == self.DISCONNECT:
+                self._shutdown_client(socket)
+                return
+            if self.overflow_policy == self.COALESCE:
+                queue.coalesce(protocol)
+            if queue.size + len(data) > self.send_queue_limit:
+                return
+
+        queue.append(protocol, data)
+        try:
+            queue.write()
+        except OSError:
+            # The reading side notices the closed connection.
+            return
+        if queue.size:
+            self._writer_wake.set()
+        elif queue.over_limit:
+            queue.over_limit = False
+
+    def _shutdown_client(self, c_socket: socket.socket):
+        try:
+            c_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _writer_thread(self):
+        selector = selectors.DefaultSelector()
+        registered: t.Set[socket.socket] = set()
+        try:
+            while self.connected:
+                pending = {
+                    c_socket for c_socket, queue in list(self._send_queues.items())
+                    if queue.size
+                }
+                for c_socket in registered - pending:
+                    try:
+                        selector.unregister(c_socket)
+                    except (KeyError, ValueError, OSError):
+                        pass
+                for c_socket in pending - registered:
+                    try:
+                        selector.register(c_socket, selectors.EVENT_WRITE)
+                    except (KeyError, ValueError, OSError):
+                        pending.discard(c_socket)
+                registered = pending
+
+                if not registered:
+                    self._writer_wake.wait(self.selector_timeout)
+                    self._writer_wake.clear()
+                    continue
+
+                try:
+                    events = selector.select(self.selector_timeout / 10)
+                except OSError:
+                    continue
+                for key, _ in events:
+                    queue = self._send_queues.get(key.fileobj)
+                    if queue is None:
+                        continue
+                    try:
+                        queue.write()
+                    except OSError:
+                        queue.size = 0
+                        continue
+                    if queue.size < self.send_queue_limit // 2:
+                        queue.over_limit = False
+        finally:
+            selector.close()
+
+    def _write_udp(self, data: bytes, address: t.Tuple[str, int]):
+        self._socket_udp.sendto(data, address)
 
     def recv_bytes_tcp(self, socket: socket.socket, buffer: int) -> bytes:
         message = b""
         while len(message) < buffer:
-            message += socket.recv(buffer - len(message))
+            chunk = socket.recv(buffer - len(message))
+            if not chunk:
+                raise ConnectionResetError("Connection closed by peer.")
+            message += chunk
         return message
 
     def connect(self, address: str, port: int, enable_udp: bool = False):
         self._address = address
         self._port = port
 
-        self.clients = {}
+        self._reset_state()
+        self.stats.reset()
         self.connected = True
         self.udp_enabled = enable_udp
 
         self._socket_tcp = socket.socket(
             socket.AF_INET, socket.SOCK_STREAM
         )
+        self._socket_tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._socket_tcp.bind((self._address, self._port))
+        # Listen before any thread starts so clients can connect immediately.
+        self._socket_tcp.listen()
+        print(f"Listening on {self._address}:{self._port}.")
+
+        if self.udp_enabled:
+            self._socket_udp = socket.socket(
+                socket.AF_INET, socket.SOCK_DGRAM
+            )
+            self._socket_udp.bind(self._socket_tcp.getsockname())
+
+            reliability_thread = threading.Thread(
+                target=self._reliability_thread,
+                daemon=True
+            )
+            reliability_thread.start()
+
+        if self.statistics:
+            ping_thread = threading.Thread(
+                target=self._ping_thread,
+                daemon=True
+            )
+            ping_thread.start()
+
+        if self.send_queue:
+            writer_thread = threading.Thread(
+                target=self._writer_thread,
+                daemon=True
+            )
+            writer_thread.start()
+
+        if self.selector_mode:
+            self._selector = selectors.DefaultSelector()
+            selector_thread = threading.Thread(
+                target=self._selector_thread,
+                daemon=True
+            )
+            selector_thread.start()
+            return
 
         socket_thread_tcp = threading.Thread(
             target=self._socket_thread,
@@ -155,11 +649,6 @@ Client socket closed, aborting:
         socket_thread_tcp.start()
 
         if self.udp_enabled:
-            self._socket_udp = socket.socket(
-                socket.AF_INET, socket.SOCK_DGRAM
-            )
-            self._socket_udp.bind(self._socket_tcp.getsockname())
-
             socket_thread_udp = threading.Thread(
                 target=self._socket_thread,
                 daemon=True,
@@ -169,26 +658,43 @@ Client socket closed, aborting:
 
     def disconnect(self):
         self.connected = False
-        self.udp_enabled = False
 
         self._socket_tcp.close()
         if self.udp_enabled:
             self._socket_udp.close()
+        self.udp_enabled = False
 
-        for client_socket in self.clients.values():
+        for client_socket in list(self.clients.values()):
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             client_socket.close()
 
+        self._reset_state()
+        self._end_sessions()
+
+    def _reset_state(self):
+        """ Forget every client, on connect and disconnect. """
         self.clients = {}
         self._udp_addresses = {}
+        self._udp_sockets = {}
+        self._client_addresses = {}
+        self._recv_buffers = {}
+        self._reliable_endpoints = {}
+        self._next_send = {}
+        self._send_queues = {}
+        self._client_protocols = {}
+        self._protocol_tables = {}
+        self._packed = {}
+        self._reassembler = fragments.Reassembler(self.fragment_timeout)
+        self._message_queue = Queue(maxsize=self.message_queue_size)
 
     def _socket_thread(self, network_protocol: int = TCP):
         if network_protocol != self.TCP and network_protocol != self.UDP:
             raise TypeError("Invalid network_protocol type. Must be TCP or UDP.")  # noqa: E501
 
         if network_protocol == self.TCP:
-            self._socket_tcp.listen()
-            print(f"Listening on {self._address}:{self._port}.")
-
             try:
                 while True:
                     c_socket, c_address = self._socket_tcp.accept()
@@ -220,33 +726,411 @@ Failed to send packet to client:
 
 """)
                     continue
+                except OSError:
+                    # `disconnect` closed the socket.
+                    if not self.connected:
+                        break
+                    raise
 
                 if not self.connected:
                     print("No longer connected. Ending UDP thread.")
                     break
 
-                data = self.encoder.decode(message)
-                if c_address not in self._udp_addresses.values():
-                    print(f"Recieved message from unconnected user: {c_address}")
-                elif data["protocol"] in self._protocols.keys():
-                    socket_list = list(self._udp_addresses.keys())
-                    address_list = list(self._udp_addresses.values())
-                    socket = socket_list[address_list.index(c_address)]
-                    self._protocols[data["protocol"]](
-                        socket, **data["data"]
-                    )
-                else:
-                    print(f"Recieved invalid/unregistered protocol type: {data['protocol']}")
+                self._receive_datagram(message, c_address)
 
-    def _assign_udp_port(self, socket: socket.socket, port: int):
-        address_list = list(self.clients.keys())
-        socket_list = list(self.clients.values())
-        address = (
-            address_list[socket_list.index(socket)][0],
-            port
+    def adopt(self, c_socket: socket.socket, c_address: t.Tuple[str, int], data: bytes = b""):
+        """ Take over a client connected elsewhere, e.g. handed off by a
+        ShardRouter. `data` is anything already read from the socket.
+        """
+        if self.selector_mode:
+            self._add_client(c_socket, c_address)
+            self._selector.register(c_socket, selectors.EVENT_READ, data=c_address)
+            self._adopted(c_socket, data)
+            return
+
+        c_thread = threading.Thread(
+            target=self.threaded_client_tcp,
+            args=(c_socket, c_address, data),
+            daemon=True
         )
+        c_thread.start()
+
+    def _adopted(self, c_socket: socket.socket, data: bytes):
+        if self.udp_enabled:
+            # The client connected to another port, tell it where to send UDP.
+            _, port = self._socket_udp.getsockname()
+            self.send(c_socket, "_udp_address", {"port": port})
+        if data:
+            self._data_received(c_socket, data)
+
+    def _selector_thread(self):
+        selector = self._selector
+        selector.register(self._socket_tcp, selectors.EVENT_READ)
+        if self.udp_enabled:
+            selector.register(self._socket_udp, selectors.EVENT_READ)
+
+        try:
+            while self.connected:
+                try:
+                    events = selector.select(self.selector_timeout)
+                except OSError:
+                    # A socket was closed underneath the selector.
+                    if not self.connected:
+                        break
+                    raise
+
+                for key, _ in events:
+                    if key.fileobj is self._socket_tcp:
+                        self._selector_accept(selector)
+                    elif self.udp_enabled and key.fileobj is self._socket_udp:
+                        try:
+                            message, c_address = self._socket_udp.recvfrom(self.udp_buffer)
+                        except ConnectionResetError:
+                            continue
+                        self._receive_datagram(message, c_address)
+                    else:
+                        self._selector_read(selector, key.fileobj, key.data)
+        finally:
+            selector.close()
+
+    def _selector_accept(self, selector: selectors.BaseSelector):
+        try:
+            c_socket, c_address = self._socket_tcp.accept()
+        except OSError:
+            return
+
+        selector.register(c_socket, selectors.EVENT_READ, data=c_address)
+        try:
+            self._add_client(c_socket, c_address)
+        except Exception:
+            self._selector_drop(selector, c_socket, c_address)
+
+    def _selector_read(
+        self,
+        selector: selectors.BaseSelector,
+        c_socket: socket.socket,
+        c_address: t.Tuple[str, int]
+    ):
+        buffer = self._recv_buffers[c_socket]
+        try:
+            buffer.recv_into(c_socket)
+        except OSError as e:
+            print(f"""
+Connection from {c_address[0]}:{c_address[1]} was reset:
+    {e}
+
+""")
+            selector.unregister(c_socket)
+            self._remove_client(c_socket, c_address)
+            return
+
+        # A bad message or handler must not take down the thread serving
+        # every other client.
+        try:
+            for message in buffer.messages():
+                self._handle_message(c_socket, message)
+        except Exception:
+            self._selector_drop(selector, c_socket, c_address)
+
+    def _selector_drop(
+        self,
+        selector: selectors.BaseSelector,
+        c_socket: socket.socket,
+        c_address: t.Tuple[str, int]
+    ):
+        print(f"Error handling client {c_address[0]}:{c_address[1]}, disconnecting:")
+        traceback.print_exc()
+        try:
+            selector.unregister(c_socket)
+        except (KeyError, ValueError):
+            pass
+        self._remove_client(c_socket, c_address)
+
+    def _receive_datagram(self, message: bytes, c_address: t.Tuple[str, int]):
+        try:
+            self._handle_datagram(message, c_address)
+        except Exception:
+            print(f"Error handling datagram from {c_address[0]}:{c_address[1]}, disconnecting:")
+            traceback.print_exc()
+            c_socket = self._udp_sockets.get(c_address)
+            if c_socket is not None:
+                # Its reading side notices and removes it.
+                self._shutdown_client(c_socket)
+
+    def _data_received(self, c_socket: socket.socket, data: bytes):
+        buffer = self._recv_buffers[c_socket]
+        buffer.feed(data)
+        for message in buffer.messages():
+            self._handle_message(c_socket, message)
+
+    def _add_client(self, c_socket: socket.socket, c_address: t.Tuple[str, int]):
+        print(f"Accepted new connection from {c_address[0]}:{c_address[1]}.")
+        self.clients[c_address] = c_socket
+        self._client_addresses[c_socket] = c_address
+        self._recv_buffers[c_socket] = ReceiveBuffer(
+            self.framing, compressor=self.compressor, max_message_size=self.max_message_size
+        )
+        if self.send_queue:
+            self._send_queues[c_socket] = SendQueue(c_socket)
+
+        handshake = self.encoder.handshake()
+        if handshake is not None:
+            self.send(c_socket, "_encoder_handshake", handshake)
+        if self.interned_protocols:
+            self.send_message(self._prepare_protocol_table(), [c_socket])
+
+        if not self.sessions:
+            self.dispatch_event("on_connection", c_socket)
+
+    def _remove_client(self, c_socket: socket.socket, c_address: t.Tuple[str, int]):
+        if c_address in self.clients.keys():
+            del self.clients[c_address]
+        self.stats.remove(c_address)
+        self._next_send.pop(c_socket, None)
+        self._send_queues.pop(c_socket, None)
+        self._client_protocols.pop(c_socket, None)
+        self._packed.pop(c_socket, None)
+        if self.conditions is not None:
+            self.conditions.forget(c_socket)
+        self._client_addresses.pop(c_socket, None)
+        udp_address = self._udp_addresses.pop(c_socket, None)
+        if udp_address is not None:
+            self._udp_sockets.pop(udp_address, None)
+            self._reassembler.forget(udp_address)
+        self._reliable_endpoints.pop(c_socket, None)
+        if c_socket in self._recv_buffers.keys():
+            del self._recv_buffers[c_socket]
+        c_socket.close()
+
+        if self.sessions:
+            with self._session_lock:
+                if c_socket not in self._session_tokens.keys():
+                    # Never started a session, so was never announced.
+                    return
+                token = self._session_tokens.pop(c_socket)
+                if token is not None:
+                    self._suspended[token] = (c_socket, self._schedule_expiry(token))
+                    return
+        self.dispatch_event("on_disconnection", c_socket)
+
+    def _resume(self, socket: socket.socket, token: t.Optional[str] = None):
+        old_socket = None
+        live = False
+        with self._session_lock:
+            suspended = self._suspended.pop(token, None) if token is not None else None
+            if suspended is not None:
+                old_socket, timer = suspended
+                timer.cancel()
+            elif token is not None:
+                # The client can notice a dropped connection before we do,
+                # in which case its old socket still holds the session.
+                for c_socket, c_token in self._session_tokens.items():
+                    if c_token == token and c_socket is not socket:
+                        old_socket, live = c_socket, True
+                        del self._session_tokens[c_socket]
+                        break
+            if old_socket is None:
+                token = secrets.token_hex(16)
+            self._session_tokens[socket] = token
+
+        if live:
+            # Without a session token the old socket is removed quietly.
+            self._shutdown_client(old_socket)
+        self.send(socket, "_session", {"token": token, "resumed": old_socket is not None})
+        if old_socket is None:
+            self.dispatch_event("on_connection", socket)
+        else:
+            self.dispatch_event("on_resume", socket, old_socket)
+
+    def _end_session(self, socket: socket.socket):
+        with self._session_lock:
+            if socket in self._session_tokens.keys():
+                self._session_tokens[socket] = None
+
+    def _schedule_expiry(self, token: str) -> threading.Timer:
+        """ Start the grace period of a suspended session. The returned
+        timer is cancelled if the client resumes.
+        """
+        timer = threading.Timer(self.session_grace, self._expire_session, (token,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _expire_session(self, token: str):
+        with self._session_lock:
+            suspended = self._suspended.pop(token, None)
+        if suspended is not None:
+            self.dispatch_event("on_disconnection", suspended[0])
+
+    def _end_sessions(self):
+        with self._session_lock:
+            suspended, self._suspended = self._suspended, {}
+            sockets, self._session_tokens = list(self._session_tokens.keys()), {}
+        for _, timer in suspended.values():
+            timer.cancel()
+        for c_socket in sockets + [c_socket for c_socket, _ in suspended.values()]:
+            self.dispatch_event("on_disconnection", c_socket)
+
+    def _handle_message(self, c_socket: socket.socket, message: t.Union[bytes, memoryview]):
+        self._dispatch(c_socket, self._decode(c_socket, message, self.framing.header_size))
+
+    def _handle_datagram(self, message: bytes, c_address: t.Tuple[str, int]):
+        c_socket = self._udp_sockets.get(c_address)
+        if c_socket is None:
+            print(f"Recieved message from unconnected user: {c_address}")
+            return
+
+        if fragments.is_fragment(message):
+            message = self._reassembler.feed(c_address, message)
+            if message is None:
+                return
+        self._dispatch(c_socket, self._decode(c_socket, message))
+
+    def _decode(
+        self,
+        c_socket: socket.socket,
+        message: t.Union[bytes, memoryview],
+        overhead: int = 0
+    ) -> t.Optional[dict]:
+        if not self.statistics:
+            return self.encoder.decode(message)
+
+        start = time.perf_counter()
+        data = self.encoder.decode(message)
+        elapsed = time.perf_counter() - start
+        if data is None:
+            self.stats.decoded(elapsed)
+            return None
+        protocol = self._protocol_ids.name(data["protocol"])
+        self.stats.decoded(elapsed, protocol)
+        self.stats.received(
+            protocol, len(message) + overhead, self._client_addresses.get(c_socket)
+        )
+        return data
+
+    def _dispatch(self, c_socket: socket.socket, data: t.Optional[dict]):
+        if data is None:
+            return
+        if self.dispatch_mode == self.IMMEDIATE:
+            self._call_protocol(c_socket, data)
+            return
+
+        try:
+            self._message_queue.put_nowait((c_socket, data))
+        except Full:
+            self.stats.dropped(
+                self._protocol_ids.name(data["protocol"]), self._client_addresses.get(c_socket)
+            )
+            if self.queue_overflow == self.DISCONNECT:
+                print(f"Message queue full, disconnecting {self._client_addresses.get(c_socket)}")
+                self._shutdown_client(c_socket)
+
+    def _call_protocol(self, c_socket: socket.socket, data: dict):
+        protocol = data["protocol"]
+        if isinstance(protocol, int):
+            handlers = self._protocol_ids.handlers
+            if 0 <= protocol < len(handlers):
+                handlers[protocol](c_socket, *data["data"])
+                return
+        elif protocol in self._protocols.keys():
+            self._protocols[protocol](c_socket, **data["data"])
+            return
+        print(f"Recieved invalid/unregistered protocol type: {protocol}")
+
+    def _encoder_accept(self, socket: socket.socket, protocols: t.List[str]):
+        self._packed[socket] = set(protocols)
+
+    def _prepare_protocol_table(self) -> Message:
+        return self.prepare("_protocol_table", {"protocols": self._protocol_ids.entries()})
+
+    def _protocol_table(self, socket: socket.socket, protocols: t.List[list]):
+        if not self.interned_protocols:
+            return
+        table = ProtocolTable(protocols)
+        # Clients running the same code share a table, so a broadcast is
+        # only re-encoded once for all of them.
+        table = self._protocol_tables.setdefault(table.key(), table)
+        self._client_protocols[socket] = table
+
+    def _assign_udp_port(self, socket: socket.socket, port: int):
+        if socket not in self._client_addresses.keys():
+            return
+        address = (self._client_addresses[socket][0], port)
+
+        previous = self._udp_addresses.get(socket)
+        if previous is not None:
+            self._udp_sockets.pop(previous, None)
         self._udp_addresses[socket] = address
+        self._udp_sockets[address] = socket
+        if socket not in self._reliable_endpoints.keys():
+            self._reliable_endpoints[socket] = ReliableEndpoint(self.resend_timeout)
+
+    def _reliable(
+        self,
+        socket: socket.socket,
+        sequence: int,
+        ack: int,
+        ack_bits: int,
+        messages: t.List[t.Tuple[int, int, dict]]
+    ):
+        endpoint = self._reliable_endpoints.get(socket)
+        if endpoint is None:
+            return
+
+        delivered = endpoint.receive(sequence, ack, ack_bits, messages)
+        if messages:
+            self.send(socket, "_reliable", endpoint.ack(), network_protocol=self.UDP)
+        for data in delivered:
+            self._call_protocol(socket, data)
+
+    def _resend_reliable(self):
+        for c_socket, endpoint in list(self._reliable_endpoints.items()):
+            for packet in endpoint.resend():
+                try:
+                    self.send(c_socket, "_reliable", packet, network_protocol=self.UDP)
+                except OSError:
+                    break
+
+    def _reliability_thread(self):
+        while self.connected and self.udp_enabled:
+            time.sleep(self.resend_interval)
+            self._resend_reliable()
+
+    def ping(self, sockets: t.Optional[t.Iterable[socket.socket]] = None):
+        """ Ping `sockets` (all clients if None), over UDP where assigned.
+        Replies update the RTT and loss in `stats`.
+        """
+        if sockets is None:
+            sockets = self.clients.copy().values()
+
+        for c_socket in sockets:
+            address = self._client_addresses.get(c_socket)
+            if address is None:
+                continue
+            udp = c_socket in self._udp_addresses.keys()
+            data = self.stats.ping(address, udp)
+            data["udp"] = udp
+            try:
+                self.send(c_socket, "_ping", data, self.UDP if udp else self.TCP)
+            except OSError:
+                continue
+
+    def _ping(self, socket: socket.socket, ping_id: int, udp: bool = False):
+        self.send(socket, "_pong", {"ping_id": ping_id}, self.UDP if udp else self.TCP)
+
+    def _pong(self, socket: socket.socket, ping_id: int):
+        address = self._client_addresses.get(socket)
+        if address is not None:
+            self.stats.pong(address, ping_id)
+
+    def _ping_thread(self):
+        while self.connected:
+            time.sleep(self.ping_interval)
+            if self.connected:
+                self.ping()
 
 
 Server.register_event_type("on_connection")
 Server.register_event_type("on_disconnection")
+Server.register_event_type("on_backpressure")
+Server.register_event_type("on_resume")
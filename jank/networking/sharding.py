@@ -0,0 +1,197 @@
+import multiprocessing
+import socket
+import threading
+import typing as t
+from multiprocessing import reduction
+from multiprocessing.connection import Connection
+
+import jank
+from . import compressors, encoders, framings
+from .buffers import ReceiveBuffer
+
+
+def _send_socket(conn: Connection, c_socket: socket.socket, pid: int, message: tuple):
+    if hasattr(c_socket, "share"):
+        # Windows can't pass socket handles as file descriptors.
+        conn.send(("share", c_socket.share(pid)) + message)
+    else:
+        conn.send(("fd", None) + message)
+        reduction.send_handle(conn, c_socket.fileno(), pid)
+
+
+def _receive_socket(conn: Connection) -> t.Optional[t.Tuple[socket.socket, tuple]]:
+    received = conn.recv()
+    if received is None:
+        return None
+    kind, shared, *message = received
+    if kind == "share":
+        return socket.fromshare(shared), tuple(message)
+    return socket.socket(fileno=reduction.recv_handle(conn)), tuple(message)
+
+
+def run_shard(
+    factory: t.Callable[[str], "jank.Application"],
+    room: str,
+    conn: Connection,
+    address: str,
+    enable_udp: bool
+):
+    """ Worker process entry point, runs one room's Application and adopts
+    the clients handed to it.
+    """
+    application = factory(room)
+    server = application.server
+    server.register_protocol(lambda socket, room: None, "_join_room")
+    # Clients never connect to this port directly, it is only bound for UDP.
+    server.connect(address, 0, enable_udp)
+
+    def receive_clients():
+        while True:
+            try:
+                received = _receive_socket(conn)
+            except (EOFError, OSError):
+                break
+            if received is None:
+                break
+            c_socket, (c_address, data) = received
+            server.adopt(c_socket, c_address, data)
+        server.disconnect()
+        jank.pyglet.app.exit()
+
+    thread = threading.Thread(target=receive_clients, daemon=True)
+    thread.start()
+    application.run()
+
+
+class _Shard:
+    def __init__(self, process: multiprocessing.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def hand_off(self, c_socket: socket.socket, c_address: t.Tuple[str, int], data: bytes):
+        with self.lock:
+            _send_socket(self.conn, c_socket, self.process.pid, (c_address, data))
+
+
+class ShardRouter:
+    """ Front door for rooms running in their own processes.
+
+    Accepts connections and reads until the client's `_join_room`
+    message (`Client.connect(..., room=name)`), then hands the socket,
+    along with anything already read from it, to the worker process
+    running that room. Each room's process is started on first join by
+    calling `factory(room)`, which must return a windowless Application
+    with its Server as `application.server`, and runs until `disconnect`.
+    The factory must be picklable, e.g. a module level function.
+    `encoder`, `framing` and `compressor` must match the rooms' servers.
+    """
+    encoder: encoders.Encoder = encoders.JsonEncoder
+    framing: framings.Framing = framings.AsciiFraming
+    compressor: t.Optional[compressors.Compressor] = None
+    # TCP messages claiming to be larger than this many bytes are refused
+    # and their sender disconnected.
+    max_message_size: int = 1 << 24
+    connected: bool = False
+
+    def __init__(self, factory: t.Callable[[str], "jank.Application"]):
+        self.factory = factory
+        self.rooms: t.Dict[str, _Shard] = {}
+        self._lock = threading.Lock()
+
+    def connect(self, address: str, port: int, enable_udp: bool = False):
+        self._address = address
+        self._port = port
+        self.udp_enabled = enable_udp
+        self.connected = True
+
+        self._socket_tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket_tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket_tcp.bind((address, port))
+        self._socket_tcp.listen()
+        print(f"Routing rooms on {address}:{port}.")
+
+        accept_thread = threading.Thread(target=self._accept_thread, daemon=True)
+        accept_thread.start()
+
+    def disconnect(self):
+        self.connected = False
+        self._socket_tcp.close()
+
+        with self._lock:
+            rooms, self.rooms = self.rooms, {}
+        for shard in rooms.values():
+            # Forked workers share our end of the pipe, so closing it alone
+            # wouldn't signal them.
+            with shard.lock:
+                try:
+                    shard.conn.send(None)
+                except OSError:
+                    pass
+                shard.conn.close()
+        for shard in rooms.values():
+            shard.process.join(1)
+            if shard.process.is_alive():
+                shard.process.terminate()
+
+    def _accept_thread(self):
+        while self.connected:
+            try:
+                c_socket, c_address = self._socket_tcp.accept()
+            except OSError:
+                break
+            route_thread = threading.Thread(
+                target=self._route,
+                args=(c_socket, c_address),
+                daemon=True
+            )
+            route_thread.start()
+
+    def _route(self, c_socket: socket.socket, c_address: t.Tuple[str, int]):
+        buffer = ReceiveBuffer(
+            self.framing, compressor=self.compressor, max_message_size=self.max_message_size
+        )
+        received = bytearray()
+        room = None
+        try:
+            while room is None:
+                chunk = c_socket.recv(4096)
+                if not chunk:
+                    raise ConnectionResetError("Connection closed by peer.")
+                received += chunk
+                buffer.feed(chunk)
+                for message in buffer.messages():
+                    data = self.encoder.decode(message)
+                    if data is not None and data["protocol"] == "_join_room":
+                        room = data["data"]["room"]
+                        break
+        except OSError as e:
+            print(f"""
+Connection from {c_address[0]}:{c_address[1]} closed before joining a room:
+    {e}
+
+""")
+            c_socket.close()
+            return
+
+        try:
+            self._shard(room).hand_off(c_socket, c_address, bytes(received))
+        except OSError as e:
+            print(f"Failed to hand {c_address[0]}:{c_address[1]} to room {room}: {e}")
+        # The room's process has its own copy of the socket now.
+        c_socket.close()
+
+    def _shard(self, room: str) -> _Shard:
+        with self._lock:
+            shard = self.rooms.get(room)
+            if shard is None or not shard.process.is_alive():
+                conn, child_conn = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=run_shard,
+                    args=(self.factory, room, child_conn, self._address, self.udp_enabled),
+                    daemon=True
+                )
+                process.start()
+                child_conn.close()
+                shard = self.rooms[room] = _Shard(process, conn)
+            return shard
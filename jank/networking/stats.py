@@ -0,0 +1,292 @@
+import bisect
+import threading
+import time
+import typing as t
+
+import jank
+
+
+class Histogram:
+    """ Counts values into buckets with the given upper bounds. """
+
+    def __init__(self, bounds: t.Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "max": self.max,
+            "bounds": list(self.bounds),
+            "buckets": list(self.counts)
+        }
+
+
+class _Counters:
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.messages_dropped = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "messages_in": self.messages_in,
+            "messages_out": self.messages_out,
+            "messages_dropped": self.messages_dropped
+        }
+
+
+class _Protocol(_Counters):
+    def __init__(self, size_bounds: t.Sequence[float], time_bounds: t.Sequence[float]):
+        super().__init__()
+        self.sizes_in = Histogram(size_bounds)
+        self.sizes_out = Histogram(size_bounds)
+        self.encode_time = Histogram(time_bounds)
+        self.decode_time = Histogram(time_bounds)
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot.update({
+            "sizes_in": self.sizes_in.snapshot(),
+            "sizes_out": self.sizes_out.snapshot(),
+            "encode_time": self.encode_time.snapshot(),
+            "decode_time": self.decode_time.snapshot()
+        })
+        return snapshot
+
+
+class _Peer(_Counters):
+    def __init__(self, rtt_bounds: t.Sequence[float]):
+        super().__init__()
+        self.rtt: t.Optional[float] = None
+        self.rtt_histogram = Histogram(rtt_bounds)
+        self.pings: t.Dict[int, t.Tuple[float, bool]] = {}
+        self.udp_received = 0
+        self.udp_lost = 0
+
+    @property
+    def loss(self) -> float:
+        total = self.udp_received + self.udp_lost
+        return self.udp_lost / total if total else 0.0
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot.update({
+            "rtt": self.rtt,
+            "rtt_histogram": self.rtt_histogram.snapshot(),
+            "loss": self.loss
+        })
+        return snapshot
+
+
+class NetworkStats:
+    """ Traffic counters for a Server or Client.
+
+    Bytes and messages are counted per protocol and per peer (address),
+    with histograms of message sizes and encode/decode times overall and
+    per protocol. RTT is
+    measured from pings, and UDP loss from pings sent over UDP that were
+    not answered within `ping_timeout`.
+    """
+    size_bounds: t.Sequence[float] = (64, 256, 1024, 4096, 16384, 65536)
+    time_bounds: t.Sequence[float] = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1)
+    rtt_bounds: t.Sequence[float] = (0.01, 0.025, 0.05, 0.1, 0.2, 0.5, 1)
+    ping_timeout: float = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.totals = _Counters()
+            self.protocols: t.Dict[str, _Protocol] = {}
+            self.peers: t.Dict[t.Hashable, _Peer] = {}
+            self.sizes_in = Histogram(self.size_bounds)
+            self.sizes_out = Histogram(self.size_bounds)
+            self.encode_time = Histogram(self.time_bounds)
+            self.decode_time = Histogram(self.time_bounds)
+            self._ping_id = 0
+
+    def sent(self, protocol: str, size: int, peer: t.Optional[t.Hashable] = None):
+        with self._lock:
+            for counters in self._counters(protocol, peer):
+                counters.bytes_out += size
+                counters.messages_out += 1
+            self.sizes_out.record(size)
+            self._protocol(protocol).sizes_out.record(size)
+
+    def received(self, protocol: str, size: int, peer: t.Optional[t.Hashable] = None):
+        with self._lock:
+            for counters in self._counters(protocol, peer):
+                counters.bytes_in += size
+                counters.messages_in += 1
+            self.sizes_in.record(size)
+            self._protocol(protocol).sizes_in.record(size)
+
+    def dropped(self, protocol: str, peer: t.Optional[t.Hashable] = None):
+        """ Count a received message discarded because the dispatch queue
+        was full.
+        """
+        with self._lock:
+            for counters in self._counters(protocol, peer):
+                counters.messages_dropped += 1
+
+    def encoded(self, seconds: float, protocol: t.Optional[str] = None):
+        with self._lock:
+            self.encode_time.record(seconds)
+            if protocol is not None:
+                self._protocol(protocol).encode_time.record(seconds)
+
+    def decoded(self, seconds: float, protocol: t.Optional[str] = None):
+        """ Record a decode, under `protocol` too if it could be read. """
+        with self._lock:
+            self.decode_time.record(seconds)
+            if protocol is not None:
+                self._protocol(protocol).decode_time.record(seconds)
+
+    def ping(self, peer: t.Hashable, udp: bool = False) -> dict:
+        """ Record a ping to `peer`, returning the `_ping` data to send. """
+        now = time.monotonic()
+        with self._lock:
+            stats = self._peer(peer)
+            for ping_id, (sent, over_udp) in list(stats.pings.items()):
+                if now - sent >= self.ping_timeout:
+                    del stats.pings[ping_id]
+                    if over_udp:
+                        stats.udp_lost += 1
+
+            ping_id = self._ping_id
+            self._ping_id += 1
+            stats.pings[ping_id] = (now, udp)
+        return {"ping_id": ping_id}
+
+    def pong(self, peer: t.Hashable, ping_id: int):
+        now = time.monotonic()
+        with self._lock:
+            stats = self.peers.get(peer)
+            if stats is None or ping_id not in stats.pings.keys():
+                return
+            sent, over_udp = stats.pings.pop(ping_id)
+            stats.rtt = now - sent
+            stats.rtt_histogram.record(stats.rtt)
+            if over_udp:
+                stats.udp_received += 1
+
+    def rtt(self, peer: t.Hashable) -> t.Optional[float]:
+        stats = self.peers.get(peer)
+        return None if stats is None else stats.rtt
+
+    def remove(self, peer: t.Hashable):
+        with self._lock:
+            self.peers.pop(peer, None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            totals = self.totals.snapshot()
+            totals["bytes_in_per_second"] = totals["bytes_in"] / elapsed if elapsed else 0.0
+            totals["bytes_out_per_second"] = totals["bytes_out"] / elapsed if elapsed else 0.0
+            return {
+                "elapsed": elapsed,
+                "totals": totals,
+                "protocols": {
+                    protocol: counters.snapshot()
+                    for protocol, counters in self.protocols.items()
+                },
+                "peers": {
+                    self._name(peer): stats.snapshot()
+                    for peer, stats in self.peers.items()
+                },
+                "sizes_in": self.sizes_in.snapshot(),
+                "sizes_out": self.sizes_out.snapshot(),
+                "encode_time": self.encode_time.snapshot(),
+                "decode_time": self.decode_time.snapshot()
+            }
+
+    def _counters(self, protocol: str, peer: t.Optional[t.Hashable]) -> t.List[_Counters]:
+        counters = self._protocol(protocol)
+        if peer is None:
+            return [self.totals, counters]
+        return [self.totals, counters, self._peer(peer)]
+
+    def _protocol(self, protocol: str) -> _Protocol:
+        stats = self.protocols.get(protocol)
+        if stats is None:
+            stats = self.protocols[protocol] = _Protocol(self.size_bounds, self.time_bounds)
+        return stats
+
+    def _peer(self, peer: t.Hashable) -> _Peer:
+        stats = self.peers.get(peer)
+        if stats is None:
+            stats = self.peers[peer] = _Peer(self.rtt_bounds)
+        return stats
+
+    @staticmethod
+    def _name(peer: t.Hashable) -> str:
+        if isinstance(peer, tuple) and len(peer) == 2:
+            return f"{peer[0]}:{peer[1]}"
+        return str(peer)
+
+
+class StatsDisplay:
+    """ Draws a summary of NetworkStats in the corner of a window.
+
+    Like pyglet's FPSDisplay, the text is refreshed every
+    `update_period` seconds, and `label` can be replaced to restyle it.
+    """
+    update_period: float = 0.5
+
+    def __init__(self, stats: NetworkStats, window: jank.pyglet.window.Window):
+        self.stats = stats
+        self.window = window
+        self.label = jank.pyglet.text.Label(
+            "", x=10, y=window.height - 10,
+            anchor_y="top", multiline=True, width=400,
+            font_size=10, color=(127, 127, 127, 200)
+        )
+        self._last_update = 0.0
+
+    def text(self) -> str:
+        snapshot = self.stats.snapshot()
+        totals = snapshot["totals"]
+        lines = [
+            f"in: {totals['bytes_in_per_second'] / 1024:.1f} KiB/s"
+            f" ({totals['messages_in']} msgs)",
+            f"out: {totals['bytes_out_per_second'] / 1024:.1f} KiB/s"
+            f" ({totals['messages_out']} msgs)",
+            f"encode: {snapshot['encode_time']['mean'] * 1e6:.0f}us"
+            f" decode: {snapshot['decode_time']['mean'] * 1e6:.0f}us"
+        ]
+        for name, peer in snapshot["peers"].items():
+            rtt = "-" if peer["rtt"] is None else f"{peer['rtt'] * 1000:.0f}ms"
+            lines.append(f"{name}: rtt {rtt} loss {peer['loss']:.0%}")
+        return "\n".join(lines)
+
+    def draw(self):
+        now = time.monotonic()
+        if now - self._last_update >= self.update_period:
+            self.label.text = self.text()
+            self.label.y = self.window.height - 10
+            self._last_update = now
+        self.label.draw()
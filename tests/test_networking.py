@@ -1,7 +1,12 @@
+import asyncio
+import os
+import socket
+import threading
 import time
 import unittest
 
 import jank
+from jank.networking import loadtest
 
 
 class TestNetworkingTCP(unittest.TestCase):
@@ -188,5 +193,1569 @@ class TestNetworkingUDP(unittest.TestCase):
         server.broadcast("say", {"message": "Received."}, network_protocol=server.UDP)
 
 
+class TestNetworkingSelector(unittest.TestCase):
+    def test_ping_pong(self):
+        self.message = None
+        message = "Hello World!"
+        server = jank.networking.Server()
+        server.selector_mode = True
+
+        @server.register_protocol
+        def ping(socket, message):
+            server.send(socket, "pong", {"message": message}, server.TCP)
+        server.connect("localhost", 5570, True)
+
+        client = jank.networking.Client()
+
+        @client.register_protocol
+        def pong(message):
+            self.message = message
+        client.connect("localhost", 5570, True)
+
+        client.send("ping", {"message": message}, client.TCP)
+
+        time.sleep(1)
+        self.assertEqual(self.message, message)
+        del self.message
+        server.disconnect()
+
+    def test_connections(self):
+        self.connections = 0
+        self.disconnections = 0
+        server = jank.networking.Server()
+        server.selector_mode = True
+
+        def on_connection(socket):
+            self.connections += 1
+
+        def on_disconnection(socket):
+            self.disconnections += 1
+        server.push_handlers(on_connection=on_connection, on_disconnection=on_disconnection)
+        server.connect("localhost", 5571, False)
+
+        clients = [jank.networking.Client() for _ in range(5)]
+        for client in clients:
+            client.connect("localhost", 5571, False)
+        time.sleep(0.5)
+        self.assertEqual(self.connections, 5)
+        self.assertEqual(len(server.clients), 5)
+
+        clients[0].disconnect()
+        time.sleep(0.5)
+        self.assertEqual(self.disconnections, 1)
+        self.assertEqual(len(server.clients), 4)
+        server.disconnect()
+
+    def test_handler_error(self):
+        server = jank.networking.Server()
+        server.selector_mode = True
+
+        @server.register_protocol
+        def ping(socket, message):
+            if message == "bad":
+                raise KeyError(message)
+            server.send(socket, "pong", {"message": message})
+        server.connect("localhost", 5680, True)
+
+        received = []
+        bad, good = jank.networking.Client(), jank.networking.Client()
+        for client in (bad, good):
+            client.register_protocol(lambda message: received.append(message), "pong")
+        bad.connect("localhost", 5680, False)
+        bad.send("ping", {"message": "bad"})
+        time.sleep(0.3)
+        # Only the offending client is dropped.
+        self.assertEqual(len(server.clients), 0)
+
+        good.connect("localhost", 5680, True)
+        good.send("ping", {"message": "good"})
+        time.sleep(0.3)
+        self.assertEqual(received, ["good"])
+        good.send("ping", {"message": "bad"}, network_protocol=good.UDP)
+        time.sleep(0.3)
+        self.assertEqual(received, ["good"])
+        self.assertEqual(len(server.clients), 0)
+        server.disconnect()
+
+    def test_udp_shutdown(self):
+        errors = []
+        excepthook = threading.excepthook
+        threading.excepthook = errors.append
+        try:
+            server = jank.networking.Server()
+            server.connect("localhost", 5681, True)
+            time.sleep(0.1)
+            server.disconnect()
+            time.sleep(0.3)
+        finally:
+            threading.excepthook = excepthook
+        self.assertEqual(errors, [])
+
+
+class TestNetworkingAsync(unittest.TestCase):
+    def test_ping_pong(self):
+        self.messages = []
+        message = "Hello World!"
+
+        async def main():
+            server = jank.networking.AsyncServer()
+
+            @server.register_protocol
+            def ping(socket, message, network_protocol):
+                server.send(socket, "pong", {"message": message}, network_protocol)
+            await server.start("localhost", 5575, True)
+
+            client = jank.networking.AsyncClient()
+
+            @client.register_protocol
+            def pong(message):
+                self.messages.append(message)
+            await client.start("localhost", 5575, True)
+            await asyncio.sleep(0.1)
+
+            client.send("ping", {"message": message, "network_protocol": client.TCP}, client.TCP)
+            client.send("ping", {"message": message, "network_protocol": client.UDP}, client.UDP)
+            await asyncio.sleep(0.5)
+
+            await client.stop()
+            await server.stop()
+
+        asyncio.run(main())
+        self.assertEqual(self.messages, [message, message])
+        del self.messages
+
+    def test_poll(self):
+        self.message = None
+        server = jank.networking.AsyncServer()
+
+        @server.register_protocol
+        def ping(socket, message):
+            server.send(socket, "pong", {"message": message})
+        server.connect("localhost", 5576, False)
+
+        client = jank.networking.AsyncClient()
+
+        @client.register_protocol
+        def pong(message):
+            self.message = message
+        client.loop = server.loop
+        client.connect("localhost", 5576, False)
+
+        client.send("ping", {"message": "Polled."})
+        for _ in range(10):
+            server.poll()
+            time.sleep(0.01)
+
+        self.assertEqual(self.message, "Polled.")
+        del self.message
+        client.disconnect()
+        server.disconnect()
+        server.poll()
+
+
+class TestNetworkingFraming(unittest.TestCase):
+    def test_pack_unpack(self):
+        framings = jank.networking.framings
+        for framing in (framings.AsciiFraming, framings.BinaryFraming):
+            header = framing.pack(1234)
+            self.assertEqual(len(header), framing.header_size)
+            self.assertEqual(framing.unpack(header), 1234)
+            self.assertEqual(framing.unpack(memoryview(b"xx" + header), 2), 1234)
+
+    def test_binary_ping_pong(self):
+        self.message = None
+        message = "Hello World!"
+        server = jank.networking.Server()
+        server.framing = jank.networking.framings.BinaryFraming
+
+        @server.register_protocol
+        def ping(socket, message):
+            server.send(socket, "pong", {"message": message}, server.TCP)
+        server.connect("localhost", 5580, False)
+
+        client = jank.networking.Client()
+        client.framing = jank.networking.framings.BinaryFraming
+
+        @client.register_protocol
+        def pong(message):
+            self.message = message
+        client.connect("localhost", 5580, False)
+
+        client.send("ping", {"message": message}, client.TCP)
+
+        time.sleep(1)
+        self.assertEqual(self.message, message)
+        del self.message
+        server.disconnect()
+
+
+class TestNetworkingReceiveBuffer(unittest.TestCase):
+    def test_messages(self):
+        framing = jank.networking.framings.BinaryFraming
+        buffer = jank.networking.buffers.ReceiveBuffer(framing, size=16)
+
+        messages = [b"a", b"bc" * 20, b"", b"def"]
+        stream = b"".join(framing.pack(len(m)) + m for m in messages)
+
+        received = []
+        buffer.feed(stream[:3])
+        received += [bytes(m) for m in buffer.messages()]
+        for i in range(3, len(stream), 7):
+            buffer.feed(stream[i:i+7])
+            received += [bytes(m) for m in buffer.messages()]
+
+        self.assertEqual(received, messages)
+        self.assertEqual(len(buffer), 0)
+
+    def test_limits(self):
+        framing = jank.networking.framings.AsciiFraming
+        buffer = jank.networking.buffers.ReceiveBuffer(framing, size=16, max_message_size=1000)
+        # The buffer grows with the data received, not the claimed length.
+        buffer.feed(framing.pack(1000) + b"x" * 10)
+        self.assertEqual(list(buffer.messages()), [])
+        self.assertLess(len(buffer._buffer), 1000)
+
+        buffer = jank.networking.buffers.ReceiveBuffer(framing, max_message_size=1000)
+        buffer.feed(bytes(f"{99999999999999:<32}", "utf-8"))
+        with self.assertRaises(ConnectionResetError):
+            list(buffer.messages())
+
+        buffer = jank.networking.buffers.ReceiveBuffer(framing)
+        buffer.feed(bytes(f"{'nonsense':<32}", "utf-8"))
+        with self.assertRaises(ConnectionResetError):
+            list(buffer.messages())
+
+    def test_oversized_header(self):
+        for port, selector_mode in ((5685, False), (5686, True)):
+            server = jank.networking.Server()
+            server.selector_mode = selector_mode
+            server.register_protocol(
+                lambda socket: server.send(socket, "pong"), "ping"
+            )
+            server.connect("localhost", port, False)
+
+            attacker = socket.create_connection(("localhost", port))
+            attacker.sendall(bytes(f"{99999999999999:<32}", "utf-8"))
+            time.sleep(0.3)
+            self.assertEqual(len(server.clients), 0)
+            attacker.close()
+
+            received = []
+            client = jank.networking.Client()
+            client.register_protocol(lambda: received.append("pong"), "pong")
+            client.connect("localhost", port, False)
+            client.send("ping")
+            time.sleep(0.3)
+            self.assertEqual(received, ["pong"])
+            client.disconnect()
+            server.disconnect()
+
+
+class TestNetworkingStructEncoder(unittest.TestCase):
+    def create_encoder(self):
+        encoder = jank.networking.encoders.StructEncoder()
+        encoder.register_schema("controls", [("up", "?"), ("down", "?")])
+        encoder.register_schema(
+            "positions",
+            [("position", "2f"), ("velocity", "2f")],
+            keyed=True
+        )
+        return encoder
+
+    def test_encode_decode(self):
+        encoder = self.create_encoder()
+        encoder.handshake()
+
+        message = {"protocol": "controls", "data": {"up": True, "down": False}}
+        self.assertEqual(encoder.decode(encoder.encode(message)), message)
+
+        message = {
+            "protocol": "positions",
+            "data": {
+                "a": {"position": (1.5, -2.0), "velocity": (0.0, 4.25)},
+                "b": {"position": (3.0, 8.0), "velocity": (-1.0, 0.5)},
+            }
+        }
+        encoded = encoder.encode(message)
+        self.assertEqual(encoder.decode(encoded), message)
+        plain = jank.networking.encoders.JsonEncoder.encode(message)
+        self.assertLess(len(encoded), len(plain) / 2)
+
+        message = {"protocol": "unknown", "data": {"text": "Fallback"}}
+        self.assertEqual(encoder.decode(encoder.encode(message)), message)
+
+    def test_handshake(self):
+        self.positions = None
+        server = jank.networking.Server()
+        server.encoder = self.create_encoder()
+        server.connect("localhost", 5585, True)
+
+        client = jank.networking.Client()
+        client.encoder = jank.networking.encoders.StructEncoder()
+        client.encoder.register_schema(
+            "positions",
+            [("position", "2f"), ("velocity", "2f")],
+            keyed=True
+        )
+
+        @client.register_protocol
+        def positions(**players):
+            self.positions = players
+        client.connect("localhost", 5585, True)
+
+        time.sleep(0.5)
+        self.assertTrue(client.encoder.negotiated)
+        server.broadcast(
+            "positions",
+            {"a": {"position": (1.0, 2.0), "velocity": (3.0, 4.0)}},
+            network_protocol=server.UDP
+        )
+
+        time.sleep(0.5)
+        self.assertEqual(self.positions, {"a": {"position": (1.0, 2.0), "velocity": (3.0, 4.0)}})
+        del self.positions
+        server.disconnect()
+
+    def test_mismatched_schema(self):
+        server = jank.networking.Server()
+        server.encoder = jank.networking.encoders.StructEncoder()
+        server.encoder.register_schema("value", [("value", "f")])
+        server.connect("localhost", 5690, False)
+
+        received = {}
+        clients = {}
+        for name, fmt in (("matching", "f"), ("mismatched", "d")):
+            client = jank.networking.Client()
+            client.encoder = jank.networking.encoders.StructEncoder()
+            client.encoder.register_schema("value", [("value", fmt)])
+            received[name] = []
+            client.register_protocol(
+                lambda value, name=name: received[name].append(value), "value"
+            )
+            client.register_protocol(
+                lambda message, name=name: received[name].append(message), "say"
+            )
+            client.connect("localhost", 5690, False)
+            clients[name] = client
+        time.sleep(0.3)
+        self.assertEqual(sorted(len(packed) for packed in server._packed.values()), [0, 1])
+
+        server.broadcast("value", {"value": 1.5})
+        server.broadcast("say", {"message": "after"})
+        time.sleep(0.3)
+        self.assertEqual(received["matching"], [1.5, "after"])
+        self.assertEqual(received["mismatched"], [1.5, "after"])
+
+        for client in clients.values():
+            client.disconnect()
+        server.disconnect()
+
+    def test_unknown_id(self):
+        encoder = self.create_encoder()
+        encoder.handshake()
+        self.assertIsNone(encoder.decode(bytes([200, 1, 2])))
+        # Truncated records are dropped too.
+        self.assertIsNone(encoder.decode(bytes([1])))
+
+
+class TestNetworkingBatching(unittest.TestCase):
+    def test_flush(self):
+        server = jank.networking.Server()
+        server.batching = True
+        server.connect("localhost", 5590, True)
+
+        received = {}
+        clients = []
+        for name in ("a", "b"):
+            client = jank.networking.Client()
+            received[name] = []
+
+            @client.register_protocol
+            def say(message, received=received[name]):
+                received.append(message)
+            client.connect("localhost", 5590, True)
+            clients.append(client)
+        time.sleep(0.5)
+
+        excluded = server.clients[clients[1]._socket_tcp.getsockname()]
+        server.broadcast("say", {"message": "1"})
+        server.broadcast("say", {"message": "2"}, exclude=[excluded])
+        server.broadcast("say", {"message": "3"})
+        server.broadcast("say", {"message": "old"}, network_protocol=server.UDP)
+        server.broadcast("say", {"message": "new"}, network_protocol=server.UDP, coalesce=True)
+
+        time.sleep(0.2)
+        self.assertEqual(received, {"a": [], "b": []})
+
+        server.on_fixed_update(1/120)
+        time.sleep(0.5)
+        self.assertEqual(sorted(received["a"]), ["1", "2", "3", "new"])
+        self.assertEqual(sorted(received["b"]), ["1", "3", "new"])
+        server.disconnect()
+
+    def test_coalesce_exclude(self):
+        server = jank.networking.Server()
+        server.batching = True
+        a, b = object(), object()
+        server.broadcast("pos", {"x": 1}, exclude=[a])
+        server.broadcast("pos", {"x": 2}, exclude=[b], coalesce=True)
+        server.broadcast("pos", {"x": 3}, exclude=[b], coalesce=True)
+        self.assertEqual(
+            [(data["x"], exclude) for _, data, exclude, _ in server._batch_queue],
+            [(1, [a]), (3, [b])]
+        )
+
+
+class TestNetworkingPreparedMessages(unittest.TestCase):
+    def test_encode_once(self):
+        self.encodes = 0
+        test = self
+
+        class CountingEncoder(jank.networking.encoders.JsonEncoder):
+            @staticmethod
+            def encode(data):
+                test.encodes += 1
+                return jank.networking.encoders.JsonEncoder.encode(data)
+
+        server = jank.networking.Server()
+        server.encoder = CountingEncoder
+        server.connect("localhost", 5595, False)
+
+        received = []
+        clients = []
+        for _ in range(3):
+            client = jank.networking.Client()
+            client.register_protocol(lambda message: received.append(message), "say")
+            client.connect("localhost", 5595, False)
+            clients.append(client)
+        time.sleep(0.5)
+
+        server.broadcast("say", {"message": "All"})
+        self.assertEqual(self.encodes, 1)
+
+        message = server.prepare("say", {"message": "Some"})
+        sockets = [server.clients[clients[0]._socket_tcp.getsockname()]]
+        server.send_message(message, sockets)
+        self.assertEqual(self.encodes, 2)
+
+        time.sleep(0.5)
+        self.assertEqual(sorted(received), ["All"] * 3 + ["Some"])
+        server.disconnect()
+
+
+class TestNetworkingReplication(unittest.TestCase):
+    def test_delta(self):
+        baseline = {"a": {"position": (0, 0), "angle": (0,)}}
+        state = {
+            "a": {"position": (0, 0), "angle": (5,)},
+            "b": {"position": (1, 1), "angle": (0,)}
+        }
+        self.assertEqual(
+            jank.networking.Replicator.delta(baseline, state),
+            {"a": {"angle": (5,)}, "b": {"position": (1, 1), "angle": (0,)}}
+        )
+
+    def test_replicate(self):
+        server = jank.networking.Server()
+        replicator = jank.networking.Replicator(server, network_protocol=server.TCP)
+        server.connect("localhost", 5600, False)
+
+        client = jank.networking.Client()
+        deltas = []
+        receiver = jank.networking.ReplicationReceiver(
+            client,
+            spawn=lambda entity_id: jank.Entity(),
+            despawn=lambda entity_id, entity: None,
+            network_protocol=client.TCP
+        )
+        replicate = client._protocols["_replicate"]
+
+        def spy(**data):
+            deltas.append(data)
+            replicate(**data)
+        client.register_protocol(spy, "_replicate")
+        client.connect("localhost", 5600, False)
+        time.sleep(0.5)
+
+        a = jank.Entity(position=(1, 2))
+        b = jank.Entity(position=(3, 4))
+        replicator.add("a", a)
+        replicator.add("b", b)
+        replicator.update()
+        time.sleep(0.5)
+
+        self.assertEqual(tuple(receiver.entities["a"].position), (1, 2))
+        self.assertEqual(tuple(receiver.entities["b"].position), (3, 4))
+
+        a.position = (5.5, 2)
+        replicator.remove("b")
+        replicator.update()
+        time.sleep(0.5)
+
+        self.assertEqual(deltas[-1]["baseline"], 1)
+        self.assertEqual(list(deltas[-1]["entities"].keys()), ["a"])
+        self.assertEqual(list(deltas[-1]["entities"]["a"].keys()), ["position"])
+        self.assertEqual(deltas[-1]["removed"], ["b"])
+        self.assertEqual(tuple(receiver.entities["a"].position), (5.5, 2))
+        self.assertNotIn("b", receiver.entities)
+
+        replicator.update()
+        time.sleep(0.5)
+        self.assertEqual(deltas[-1]["entities"], {})
+
+        # Reconnecting starts over from the empty baseline.
+        client.disconnect()
+        client.connect("localhost", 5600, False)
+        time.sleep(0.5)
+        a.position = (2, 2)
+        replicator.update()
+        time.sleep(0.5)
+        self.assertEqual(deltas[-1]["baseline"], -1)
+        self.assertEqual(tuple(receiver.entities["a"].position), (2, 2))
+        a.position = (4, 2)
+        replicator.update()
+        time.sleep(0.5)
+        self.assertNotEqual(deltas[-1]["baseline"], -1)
+        self.assertEqual(tuple(receiver.entities["a"].position), (4, 2))
+        client.disconnect()
+        server.disconnect()
+
+
+class TestNetworkingInterest(unittest.TestCase):
+    def test_interested(self):
+        server = jank.networking.Server()
+        near, far, spectator = object(), object(), object()
+        server.clients = {("a", 1): near, ("b", 2): far, ("c", 3): spectator}
+
+        interest = jank.networking.InterestManager(server, radius=100)
+        interest.set_focus(near, (0, 0))
+        interest.set_focus(far, jank.Entity(position=(1000, 1000)))
+        interest.update()
+
+        self.assertEqual(interest.interested((50, -50)), [near, spectator])
+        self.assertEqual(interest.interested((950, 1050)), [far, spectator])
+        self.assertEqual(interest.interested((500, 500)), [spectator])
+
+        del server.clients[("b", 2)]
+        server.dispatch_event("on_disconnection", far)
+        self.assertEqual(interest.interested((950, 1050)), [spectator])
+        interest.update()
+        self.assertEqual(interest.interested((950, 1050)), [spectator])
+
+    def test_visible(self):
+        space = jank.physics.Space()
+        entities = {
+            "inside": jank.Entity(position=(10, 10), collider=jank.colliders.Rect()),
+            "outside": jank.Entity(position=(300, 0), collider=jank.colliders.Rect()),
+        }
+        for entity in entities.values():
+            entity.space = space
+        space.reindex_static()
+
+        viewer = object()
+        for interest_space in (None, space):
+            interest = jank.networking.InterestManager(
+                jank.networking.Server(), radius=100, space=interest_space
+            )
+            interest.set_focus(viewer, (0, 0))
+            interest.update()
+            self.assertEqual(list(interest.visible(viewer, entities).keys()), ["inside"])
+            self.assertEqual(interest.visible(object(), entities), entities)
+
+
+class TestNetworkingUDPLookup(unittest.TestCase):
+    def test_address_maps(self):
+        server = jank.networking.Server()
+        server.connect("localhost", 5605, True)
+
+        client = jank.networking.Client()
+        client.connect("localhost", 5605, True)
+        time.sleep(0.5)
+
+        c_socket = server.clients[client._socket_tcp.getsockname()]
+        udp_address = server._udp_addresses[c_socket]
+        self.assertEqual(udp_address[1], client._socket_udp.getsockname()[1])
+        self.assertIs(server._udp_sockets[udp_address], c_socket)
+
+        client.disconnect()
+        time.sleep(0.5)
+        self.assertEqual(server._udp_sockets, {})
+        self.assertEqual(server._client_addresses, {})
+        server.disconnect()
+
+
+class TestNetworkingDispatchQueue(unittest.TestCase):
+    def test_fixed_update(self):
+        received = []
+        server = jank.networking.Server()
+        server.dispatch_mode = server.FIXED_UPDATE
+        server.message_budget = 2
+
+        @server.register_protocol
+        def say(socket, message):
+            received.append(message)
+        server.connect("localhost", 5610, False)
+
+        client = jank.networking.Client()
+        client.connect("localhost", 5610, False)
+        for i in range(3):
+            client.send("say", {"message": i})
+        time.sleep(0.5)
+        self.assertEqual(received, [])
+
+        server.on_update(1/60)
+        self.assertEqual(received, [])
+        server.on_fixed_update(1/120)
+        self.assertEqual(received, [0, 1])
+        self.assertEqual(server.process_messages(), 1)
+        self.assertEqual(received, [0, 1, 2])
+        server.disconnect()
+
+    def test_overflow(self):
+        received = []
+        server = jank.networking.Server()
+        server.dispatch_mode = server.UPDATE
+        server.message_queue_size = 2
+
+        @server.register_protocol
+        def say(socket, message):
+            received.append(message)
+        server.connect("localhost", 5701, False)
+
+        client = jank.networking.Client()
+        client.connect("localhost", 5701, False)
+        for i in range(5):
+            client.send("say", {"message": i})
+        time.sleep(0.5)
+
+        # The socket thread carried on instead of blocking on the queue.
+        self.assertEqual(server.stats.totals.messages_dropped, 3)
+        self.assertEqual(server.stats.protocols["say"].messages_dropped, 3)
+        server.on_update(1/60)
+        self.assertEqual(received, [0, 1])
+
+        server.queue_overflow = server.DISCONNECT
+        for i in range(3):
+            client.send("say", {"message": i})
+        time.sleep(0.5)
+        self.assertFalse(client.connected)
+        self.assertEqual(server.clients, {})
+        server.disconnect()
+
+
+class TestNetworkingReliability(unittest.TestCase):
+    def test_loss_and_reordering(self):
+        sender = jank.networking.reliability.ReliableEndpoint(resend_timeout=0)
+        receiver = jank.networking.reliability.ReliableEndpoint(resend_timeout=0)
+
+        packets = [sender.send({"n": n}, channel=n % 2) for n in range(6)]
+        received = []
+        # Lose packets 1 and 4, deliver the rest backwards.
+        for packet in reversed([p for i, p in enumerate(packets) if i not in (1, 4)]):
+            received += receiver.receive(**packet)
+        self.assertEqual(received, [{"n": 0}, {"n": 2}])
+
+        sender.receive(**receiver.ack())
+        self.assertEqual(sender.pending, 2)
+
+        for packet in sender.resend():
+            received += receiver.receive(**packet)
+        self.assertEqual([m["n"] for m in received if m["n"] % 2 == 0], [0, 2, 4])
+        self.assertEqual([m["n"] for m in received if m["n"] % 2 == 1], [1, 3, 5])
+
+        sender.receive(**receiver.ack())
+        self.assertEqual(sender.pending, 0)
+
+        # Duplicates are never delivered twice.
+        self.assertEqual(receiver.receive(**packets[0]), [])
+
+    def test_ping_pong(self):
+        received = []
+        server = jank.networking.Server()
+
+        @server.register_protocol
+        def ping(socket, n):
+            server.send(socket, "pong", {"n": n}, server.RELIABLE)
+        server.connect("localhost", 5615, True)
+
+        client = jank.networking.Client()
+
+        @client.register_protocol
+        def pong(n):
+            received.append(n)
+        client.connect("localhost", 5615, True)
+        time.sleep(0.5)
+
+        for n in range(10):
+            client.send("ping", {"n": n}, client.RELIABLE)
+        time.sleep(0.5)
+
+        self.assertEqual(received, list(range(10)))
+        self.assertEqual(client._reliable_endpoint.pending, 0)
+        server.disconnect()
+
+
+class TestNetworkingPrediction(unittest.TestCase):
+    def test_reconcile(self):
+        def apply(entity, controls, dt):
+            entity.velocity = (controls["x"], 0)
+
+        client_entity = jank.Entity(position=(0, 0))
+        server_entity = jank.Entity(position=(0, 0))
+        predictor = jank.networking.Predictor(client_entity, apply)
+        tracker = jank.networking.InputTracker(jank.networking.Server())
+        server_socket = object()
+
+        messages = [predictor.record({"x": 10}, 0.5) for _ in range(3)]
+        jank.networking.prediction.integrate(client_entity, 1.5)
+        self.assertEqual(tuple(client_entity.position), (15, 0))
+
+        # The server has only processed the first input, and sees it twice.
+        for message in (messages[0], messages[0]):
+            if tracker.receive(server_socket, message["sequence"]):
+                apply(server_entity, message["controls"], 0.5)
+                jank.networking.prediction.integrate(server_entity, 0.5)
+        self.assertEqual(tuple(server_entity.position), (5, 0))
+
+        predictor.reconcile(
+            {"position": tuple(server_entity.position), "velocity": (0, 0)},
+            tracker.last_sequence(server_socket)
+        )
+        self.assertEqual(tuple(client_entity.position), (15, 0))
+        self.assertEqual(predictor.pending, 2)
+
+        # Old state arriving late is ignored.
+        predictor.reconcile({"position": (0, 0)}, -1)
+        self.assertEqual(tuple(client_entity.position), (15, 0))
+
+
+class TestNetworkingInterpolation(unittest.TestCase):
+    def test_sample(self):
+        buffer = jank.networking.interpolation.InterpolationBuffer()
+        self.assertIsNone(buffer.sample(0))
+
+        buffer.push(1.0, {"position": (10, 0), "angle": 1.0})
+        buffer.push(0.0, {"position": (0, 0), "angle": 0.0})
+        buffer.push(2.0, {"position": (10, 20), "angle": 1.0})
+
+        self.assertEqual(buffer.sample(-1), {"position": (0, 0), "angle": 0.0})
+        self.assertEqual(buffer.sample(0.25), {"position": (2.5, 0), "angle": 0.25})
+        self.assertEqual(buffer.sample(1.5), {"position": (10, 10), "angle": 1.0})
+        self.assertEqual(len(buffer), 2)
+        self.assertEqual(buffer.sample(3), {"position": (10, 20), "angle": 1.0})
+
+    def test_interpolator(self):
+        self.now = 0.0
+        interpolator = jank.networking.Interpolator(delay=0.1, clock=lambda: self.now)
+        entity = jank.Entity()
+        interpolator.add("a", entity)
+
+        interpolator.push("a", {"position": (0, 0)})
+        self.now = 0.05
+        interpolator.push("a", {"position": (5, 0)})
+
+        self.now = 0.125
+        interpolator.update()
+        self.assertAlmostEqual(entity.position.x, 2.5)
+        del self.now
+
+    def test_replication(self):
+        interpolator = jank.networking.Interpolator(delay=0)
+        receiver = jank.networking.ReplicationReceiver(
+            jank.networking.Client(),
+            spawn=lambda entity_id: jank.Entity(),
+            despawn=lambda entity_id, entity: None,
+            interpolator=interpolator
+        )
+        receiver.client.send = lambda *args, **kwargs: None
+
+        receiver._replicate(0, -1, {"a": {"position": (100, 200)}}, [])
+        self.assertIn("a", interpolator.entities)
+        self.assertEqual(tuple(receiver.entities["a"].position), (0, 0))
+
+        interpolator.update()
+        self.assertEqual(tuple(receiver.entities["a"].position), (1, 2))
+
+        receiver._replicate(1, 0, {}, ["a"])
+        self.assertNotIn("a", interpolator.entities)
+
+
+class TestNetworkingStats(unittest.TestCase):
+    def test_histogram(self):
+        histogram = jank.networking.stats.Histogram([1, 10])
+        for value in (0.5, 1, 5, 50):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["buckets"], [2, 1, 1])
+        self.assertEqual(snapshot["max"], 50)
+        self.assertAlmostEqual(snapshot["mean"], 56.5 / 4)
+
+    def test_udp_loss(self):
+        stats = jank.networking.NetworkStats()
+        stats.ping_timeout = 0
+        lost = stats.ping(("a", 1), udp=True)
+        answered = stats.ping(("a", 1), udp=True)
+        stats.pong(("a", 1), answered["ping_id"])
+        stats.pong(("a", 1), lost["ping_id"])
+
+        peer = stats.snapshot()["peers"]["a:1"]
+        self.assertEqual(peer["loss"], 0.5)
+        self.assertIsNotNone(peer["rtt"])
+
+    def test_counters(self):
+        server = jank.networking.Server()
+        server.statistics = True
+        server.ping_interval = 0.1
+        server.register_protocol(lambda socket, value: None, "test")
+        server.connect("localhost", 5620, True)
+
+        client = jank.networking.Client()
+        client.statistics = True
+        client.ping_interval = 0.1
+        client.register_protocol(lambda value: None, "test")
+        client.connect("localhost", 5620, True)
+        time.sleep(0.5)
+
+        client.send("test", {"value": 1})
+        server.broadcast("test", {"value": 2}, network_protocol=server.UDP)
+        time.sleep(0.5)
+
+        server_stats = server.stats.snapshot()
+        client_stats = client.stats.snapshot()
+        self.assertEqual(server_stats["protocols"]["test"]["messages_in"], 1)
+        self.assertEqual(server_stats["protocols"]["test"]["messages_out"], 1)
+        self.assertEqual(
+            server_stats["protocols"]["test"]["bytes_in"],
+            client_stats["protocols"]["test"]["bytes_out"]
+        )
+        self.assertEqual(client_stats["protocols"]["test"]["messages_in"], 1)
+        self.assertGreater(server_stats["encode_time"]["count"], 0)
+        self.assertGreater(client_stats["decode_time"]["count"], 0)
+        self.assertEqual(server_stats["protocols"]["test"]["sizes_in"]["count"], 1)
+        self.assertEqual(server_stats["protocols"]["test"]["decode_time"]["count"], 1)
+        self.assertEqual(server_stats["protocols"]["test"]["encode_time"]["count"], 1)
+        self.assertEqual(client_stats["protocols"]["test"]["sizes_out"]["count"], 1)
+        self.assertEqual(client_stats["protocols"]["test"]["encode_time"]["count"], 1)
+
+        peers = list(server_stats["peers"].values())
+        self.assertEqual(len(peers), 1)
+        self.assertIsNotNone(peers[0]["rtt"])
+        self.assertEqual(peers[0]["loss"], 0)
+        self.assertIsNotNone(list(client_stats["peers"].values())[0]["rtt"])
+
+        client.disconnect()
+        time.sleep(0.2)
+        self.assertEqual(server.stats.snapshot()["peers"], {})
+        server.disconnect()
+
+
+class TestNetworkingLoadTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([], 50), 0)
+
+    def test_run(self):
+        report = loadtest.run(clients=3, duration=0.5, rate=10, port=5625)
+        self.assertEqual(report["clients"], 3)
+        self.assertGreater(report["sent"], 0)
+        self.assertGreater(report["received"], 0)
+        self.assertLessEqual(report["latency"]["p50"], report["latency"]["p99"])
+        self.assertGreater(report["bytes_in_per_second"], 0)
+
+
+class TestNetworkingConditions(unittest.TestCase):
+    def test_loss(self):
+        conditions = jank.networking.NetworkConditions(loss=1)
+        received = []
+        for i in range(10):
+            conditions.submit(received.append, (i,), 1)
+        conditions.submit(received.append, ("stream",), 1, stream="tcp")
+        time.sleep(0.1)
+        self.assertEqual(received, ["stream"])
+        self.assertEqual(conditions.dropped, 10)
+
+    def test_stream_order(self):
+        conditions = jank.networking.NetworkConditions(latency=0.05, jitter=0.05, seed=1)
+        received = []
+        for i in range(50):
+            conditions.submit(received.append, (i,), 1, stream="tcp")
+        time.sleep(0.3)
+        self.assertEqual(received, list(range(50)))
+
+    def test_reorder(self):
+        conditions = jank.networking.NetworkConditions(reorder=0.5, reorder_delay=0.05, seed=1)
+        received = []
+        for i in range(50):
+            conditions.submit(received.append, (i,), 1)
+        time.sleep(0.2)
+        self.assertEqual(sorted(received), list(range(50)))
+        self.assertNotEqual(received, list(range(50)))
+
+    def test_bandwidth(self):
+        conditions = jank.networking.NetworkConditions(bandwidth=1000)
+        received = []
+        start = time.monotonic()
+        for i in range(3):
+            conditions.submit(lambda i: received.append((i, time.monotonic() - start)), (i,), 100)
+        time.sleep(0.5)
+        self.assertEqual([i for i, _ in received], [0, 1, 2])
+        self.assertGreaterEqual(received[-1][1], 0.3)
+
+    def test_latency(self):
+        server = jank.networking.Server()
+        received = []
+        server.register_protocol(lambda socket, value: received.append(value), "test")
+        server.connect("localhost", 5630, False)
+
+        client = jank.networking.Client()
+        client.conditions = jank.networking.NetworkConditions(latency=0.3)
+        client.connect("localhost", 5630, False)
+        time.sleep(0.5)
+
+        client.send("test", {"value": 1})
+        time.sleep(0.1)
+        self.assertEqual(received, [])
+        time.sleep(0.4)
+        self.assertEqual(received, [1])
+
+        client.disconnect()
+        server.disconnect()
+
+
+class TestNetworkingCompression(unittest.TestCase):
+    def test_header_flags(self):
+        framings = jank.networking.framings
+        for framing in (framings.AsciiFraming, framings.BinaryFraming):
+            header = framing.pack(1234, framing.COMPRESSED)
+            self.assertEqual(len(header), framing.header_size)
+            self.assertEqual(framing.unpack_header(header), (1234, framing.COMPRESSED))
+            self.assertEqual(framing.unpack_header(framing.pack(1234)), (1234, 0))
+
+    def test_compressors(self):
+        data = b'{"protocol": "player_list", "data": {"players": []}}' * 10
+        for compressor in (
+            jank.networking.compressors.ZlibCompressor(),
+            jank.networking.compressors.ZlibCompressor(dictionary=b'"protocol": "player_list"'),
+            jank.networking.compressors.LzmaCompressor()
+        ):
+            compressed = compressor.compress(data)
+            self.assertLess(len(compressed), len(data))
+            self.assertEqual(compressor.decompress(memoryview(compressed)), data)
+
+    def test_threshold(self):
+        framing = jank.networking.framings.BinaryFraming
+        compressor = jank.networking.compressors.ZlibCompressor(threshold=100)
+        small = jank.networking.Message("test", b"x" * 50, framing, compressor=compressor)
+        large = jank.networking.Message("test", b"x" * 500, framing, compressor=compressor)
+
+        self.assertEqual(framing.unpack_header(small.frame), (50, 0))
+        length, flags = framing.unpack_header(large.frame)
+        self.assertEqual(flags, framing.COMPRESSED)
+        self.assertLess(length, 500)
+
+        buffer = jank.networking.buffers.ReceiveBuffer(framing, compressor=compressor)
+        buffer.feed(small.frame + large.frame)
+        self.assertEqual(
+            [bytes(message) for message in buffer.messages()], [b"x" * 50, b"x" * 500]
+        )
+
+    def test_decompression_limit(self):
+        framing = jank.networking.framings.BinaryFraming
+        data = b"x" * 1000
+        for compressor in (
+            jank.networking.compressors.ZlibCompressor(),
+            jank.networking.compressors.ZlibCompressor(dictionary=b"xxxx"),
+            jank.networking.compressors.LzmaCompressor()
+        ):
+            compressed = compressor.compress(data)
+            self.assertEqual(compressor.decompress(compressed, 1000), data)
+            for bad in (compressed[:-4], compressed + b"trailing"):
+                with self.assertRaises(ValueError):
+                    compressor.decompress(bad)
+
+            # A small frame can't expand past the buffer's message limit.
+            buffer = jank.networking.buffers.ReceiveBuffer(
+                framing, compressor=compressor, max_message_size=999
+            )
+            buffer.feed(framing.pack(len(compressed), framing.COMPRESSED) + compressed)
+            with self.assertRaises(ConnectionResetError):
+                list(buffer.messages())
+
+    def test_compressed_messages(self):
+        server = jank.networking.Server()
+        server.compressor = jank.networking.compressors.ZlibCompressor(threshold=256)
+        received = []
+        server.register_protocol(lambda socket, players: received.append(players), "player_list")
+        server.connect("localhost", 5635, False)
+
+        client = jank.networking.Client()
+        client.compressor = jank.networking.compressors.ZlibCompressor(threshold=256)
+        client.register_protocol(lambda players: received.append(players), "player_list")
+        client.connect("localhost", 5635, False)
+        time.sleep(0.5)
+
+        players = [{"name": f"player{i}", "position": [i, i]} for i in range(100)]
+        client.send("player_list", {"players": players})
+        server.broadcast("player_list", {"players": players[:2]})
+        time.sleep(0.5)
+        self.assertCountEqual(received, [players, players[:2]])
+
+        client.disconnect()
+        server.disconnect()
+
+
+class TestNetworkingSendRate(unittest.TestCase):
+    def test_send_rate(self):
+        server = jank.networking.Server()
+        server.max_send_rate = 30
+        server.min_send_rate = 5
+        socket = object()
+        server._client_addresses[socket] = ("a", 1)
+        self.assertEqual(server.send_rate(socket), 30)
+
+        server.stats.peers[("a", 1)] = jank.networking.stats._Peer([])
+        server.stats.peers[("a", 1)].rtt = 0.2
+        self.assertEqual(server.send_rate(socket), 15)
+        server.stats.peers[("a", 1)].rtt = 10
+        self.assertEqual(server.send_rate(socket), 5)
+
+    def test_ready_clients(self):
+        server = jank.networking.Server()
+        fast, slow = object(), object()
+        server.clients = {("a", 1): fast, ("b", 2): slow}
+        server._client_addresses = {fast: ("a", 1), slow: ("b", 2)}
+        server.send_rate = lambda socket: 20 if socket is fast else 5
+
+        sent = {fast: 0, slow: 0}
+        end = time.monotonic() + 1
+        while time.monotonic() < end:
+            for socket in server.ready_clients():
+                sent[socket] += 1
+            time.sleep(0.01)
+        self.assertAlmostEqual(sent[fast], 20, delta=3)
+        self.assertAlmostEqual(sent[slow], 5, delta=1)
+
+    def test_network_update_flush(self):
+        server = jank.networking.Server()
+        server.batching = True
+        server.flush_mode = server.NETWORK_UPDATE
+        server.broadcast("test")
+        server.on_fixed_update(1/120)
+        self.assertEqual(len(server._batch_queue), 1)
+        server.on_network_update(1/20)
+        self.assertEqual(server._batch_queue, [])
+
+
+class TestNetworkingBackpressure(unittest.TestCase):
+    def test_coalesce(self):
+        a, b = socket.socketpair()
+        a.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        queue = jank.networking.buffers.SendQueue(a)
+        while not queue.size:
+            queue.append("fill", b"x" * 65536)
+            queue.write()
+
+        queue.append("state", b"1" * 10)
+        queue.append("other", b"2")
+        queue.append("state", b"3" * 10)
+        queued = queue.size
+        self.assertEqual(queue.coalesce("state"), 20)
+        self.assertEqual(queue.size, queued - 20)
+        # The partly written frame is never dropped.
+        self.assertEqual(queue.coalesce("fill"), 0)
+
+        b.setblocking(False)
+        received = b""
+        while queue.size:
+            try:
+                received += b.recv(65536)
+            except BlockingIOError:
+                pass
+            queue.write()
+        a.close()
+        b.settimeout(1)
+        while True:
+            chunk = b.recv(65536)
+            if not chunk:
+                break
+            received += chunk
+        b.close()
+        self.assertTrue(received.endswith(b"x2"))
+
+    def test_slow_client(self):
+        server = jank.networking.Server()
+        server.send_queue = True
+        server.send_queue_limit = 1 << 18
+        server.overflow_policy = server.DISCONNECT
+        events = []
+        server.push_handlers(
+            on_backpressure=lambda socket, queued: events.append("backpressure"),
+            on_disconnection=lambda socket: events.append("disconnection")
+        )
+        server.connect("localhost", 5640, False)
+
+        slow = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        slow.connect(("localhost", 5640))
+        time.sleep(0.5)
+
+        start = time.monotonic()
+        for _ in range(1000):
+            server.broadcast("data", {"padding": "x" * 10000})
+        self.assertLess(time.monotonic() - start, 2)
+        time.sleep(0.5)
+
+        self.assertEqual(events, ["backpressure", "disconnection"])
+        self.assertEqual(server.clients, {})
+        slow.close()
+        server.disconnect()
+
+
+class RoomApplication(jank.Application):
+    def __init__(self, room):
+        super().__init__(windowless=True)
+        self.room = room
+        self.server = jank.networking.Server()
+        self.server.register_protocol(self.where)
+
+    def where(self, socket, network_protocol):
+        self.server.send(socket, "here", {"room": self.room, "pid": os.getpid()}, network_protocol)
+
+
+class TestNetworkingSharding(unittest.TestCase):
+    def test_rooms(self):
+        router = jank.networking.ShardRouter(RoomApplication)
+        router.connect("localhost", 5645, True)
+
+        clients = []
+        for room in ("a", "b", "a"):
+            client = jank.networking.Client()
+            client.replies = []
+            client.register_protocol(
+                lambda room, pid, client=client: client.replies.append((room, pid)),
+                "here"
+            )
+            client.connect("localhost", 5645, True, room=room)
+            clients.append(client)
+        time.sleep(2)
+
+        for client in clients:
+            client.send("where", {"network_protocol": client.TCP})
+            client.send("where", {"network_protocol": client.UDP}, network_protocol=client.UDP)
+        time.sleep(0.5)
+
+        for client, room in zip(clients, ("a", "b", "a")):
+            self.assertEqual(len(client.replies), 2)
+            self.assertEqual({reply[0] for reply in client.replies}, {room})
+        pids = [client.replies[0][1] for client in clients]
+        self.assertEqual(pids[0], pids[2])
+        self.assertNotEqual(pids[0], pids[1])
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(sorted(router.rooms.keys()), ["a", "b"])
+
+        for client in clients:
+            client.disconnect()
+        router.disconnect()
+
+
+class TestNetworkingSessions(unittest.TestCase):
+    def create(self, port):
+        server = jank.networking.Server()
+        server.sessions = True
+        events = []
+        server.push_handlers(
+            on_connection=lambda socket: events.append("connection"),
+            on_disconnection=lambda socket: events.append("disconnection"),
+            on_resume=lambda socket, old_socket: events.append("resume")
+        )
+        server.connect("localhost", port, False)
+
+        client = jank.networking.Client()
+        client.sessions = True
+        client.push_handlers(on_resume=lambda: events.append("client_resume"))
+        client.connect("localhost", port, False)
+        time.sleep(0.3)
+        return server, client, events
+
+    def test_resume(self):
+        server, client, events = self.create(5650)
+        replicator = jank.networking.Replicator(server, network_protocol=server.TCP)
+        receiver = jank.networking.ReplicationReceiver(
+            client, spawn=lambda entity_id: jank.Entity(), network_protocol=client.TCP
+        )
+        entity = jank.Entity(position=(1, 2))
+        replicator.add("a", entity)
+        replicator.update()
+        time.sleep(0.3)
+        token = client._session_token
+        self.assertIsNotNone(token)
+
+        # Drop the connection without ending the session.
+        client.disconnect(end_session=False)
+        time.sleep(0.3)
+        self.assertEqual(events, ["connection"])
+
+        deltas = []
+        replicate = client._protocols["_replicate"]
+
+        def spy(**data):
+            deltas.append(data)
+            replicate(**data)
+        client.register_protocol(spy, "_replicate")
+        client.connect("localhost", 5650, False)
+        time.sleep(0.3)
+        self.assertEqual(events, ["connection", "resume", "client_resume"])
+        self.assertEqual(client._session_token, token)
+
+        entity.position = (3, 2)
+        replicator.update()
+        time.sleep(0.3)
+        self.assertEqual(deltas[-1]["baseline"], 1)
+        self.assertEqual(deltas[-1]["entities"], {"a": {"position": [300, 200]}})
+        self.assertEqual(tuple(receiver.entities["a"].position), (3, 2))
+
+        client.disconnect()
+        time.sleep(0.3)
+        self.assertEqual(events[-1], "disconnection")
+        server.disconnect()
+
+    def test_grace(self):
+        server, client, events = self.create(5655)
+        server.session_grace = 0.3
+        client.disconnect(end_session=False)
+        time.sleep(0.1)
+        self.assertEqual(events, ["connection"])
+        time.sleep(0.5)
+        self.assertEqual(events, ["connection", "disconnection"])
+
+        client.connect("localhost", 5655, False)
+        time.sleep(0.3)
+        self.assertEqual(events, ["connection", "disconnection", "connection"])
+        client.disconnect()
+        server.disconnect()
+
+    def test_resume_live(self):
+        server, client, events = self.create(5695)
+        old_socket = list(server.clients.values())[0]
+
+        # Reconnect before the server has noticed the old connection drop.
+        reconnected = jank.networking.Client()
+        reconnected.sessions = True
+        reconnected._session_token = client._session_token
+        reconnected.connect("localhost", 5695, False)
+        time.sleep(0.3)
+        self.assertEqual(events, ["connection", "resume"])
+        self.assertEqual(reconnected._session_token, client._session_token)
+        self.assertNotIn(old_socket, server.clients.values())
+        self.assertEqual(len(server.clients), 1)
+
+        reconnected.disconnect()
+        time.sleep(0.3)
+        self.assertEqual(events, ["connection", "resume", "disconnection"])
+        server.disconnect()
+
+    def test_async_resume(self):
+        events = []
+
+        async def main():
+            server = jank.networking.AsyncServer()
+            server.sessions = True
+            server.session_grace = 0.2
+            server.push_handlers(
+                on_connection=lambda socket: events.append("connection"),
+                on_disconnection=lambda socket: events.append(
+                    ("disconnection", threading.current_thread())
+                ),
+                on_resume=lambda socket, old_socket: events.append("resume")
+            )
+            await server.start("localhost", 5702, False)
+
+            client = jank.networking.AsyncClient()
+            client.sessions = True
+            await client.start("localhost", 5702, False)
+            await asyncio.sleep(0.2)
+
+            # Resume while the old transport is still open.
+            reconnected = jank.networking.AsyncClient()
+            reconnected.sessions = True
+            reconnected._session_token = client._session_token
+            await reconnected.start("localhost", 5702, False)
+            await asyncio.sleep(0.2)
+            self.assertEqual(events, ["connection", "resume"])
+            self.assertEqual(len(server.clients), 1)
+            self.assertFalse(client.connected)
+
+            # The grace period runs out on the loop's thread.
+            reconnected.disconnect(end_session=False)
+            await asyncio.sleep(0.4)
+            self.assertEqual(events[2:], [("disconnection", threading.current_thread())])
+            await server.stop()
+
+        asyncio.run(main())
+
+
+class TestNetworkingProtocolTable(unittest.TestCase):
+    def test_table(self):
+        table = jank.networking.protocols.ProtocolTable()
+        self.assertEqual(table.register("move", lambda socket, x, y: None, skip=1), 0)
+        self.assertEqual(table.register("chat", lambda **data: None), 1)
+        # Replacing a handler keeps its ID.
+        self.assertEqual(table.register("move", lambda socket, y, x: None, skip=1), 0)
+        self.assertEqual(table.entries(), [["move", ["y", "x"]], ["chat", None]])
+
+        remote = jank.networking.protocols.ProtocolTable(table.entries())
+        self.assertEqual(remote.intern("move", {"x": 1, "y": 2}), {"protocol": 0, "data": [2, 1]})
+        self.assertIsNone(remote.intern("move", {"x": 1}))
+        self.assertIsNone(remote.intern("move", {"x": 1, "z": 2}))
+        self.assertIsNone(remote.intern("chat", {"text": "hi"}))
+        self.assertIsNone(remote.intern("unknown", {}))
+        self.assertEqual(remote.name(1), "chat")
+
+    def test_interned(self):
+        server = jank.networking.Server()
+        server.interned_protocols = True
+        received = []
+        server.register_protocol(
+            lambda socket, x, y: received.append(("move", x, y)), "move"
+        )
+        server.register_protocol(
+            lambda socket, **data: received.append(("chat", data)), "chat"
+        )
+        server.connect("localhost", 5660, True)
+
+        client = jank.networking.Client()
+        client.interned_protocols = True
+        client.register_protocol(lambda text: received.append(("reply", text)), "reply")
+        client.connect("localhost", 5660, True)
+        time.sleep(0.3)
+        self.assertIsNotNone(client._server_protocols)
+        c_socket = list(server.clients.values())[0]
+        self.assertIn(c_socket, server._client_protocols.keys())
+
+        message = server._intern(c_socket, server.prepare("reply", {"text": "hi"}))
+        self.assertEqual(
+            server.encoder.decode(message.payload),
+            {"protocol": client._protocol_ids.ids["reply"], "data": ["hi"]}
+        )
+
+        client.send("move", {"x": 1, "y": 2})
+        client.send("move", {"y": 4, "x": 3}, network_protocol=client.UDP)
+        client.send("chat", {"text": "hello"})
+        server.broadcast("reply", {"text": "hi"})
+        time.sleep(0.3)
+        self.assertIn(("move", 1, 2), received)
+        self.assertIn(("move", 3, 4), received)
+        self.assertIn(("chat", {"text": "hello"}), received)
+        self.assertIn(("reply", "hi"), received)
+
+        # Protocols registered later are announced to connected clients.
+        server.register_protocol(lambda socket, n: received.append(("late", n)), "late")
+        time.sleep(0.2)
+        self.assertIn("late", client._server_protocols.ids.keys())
+        client.send("late", {"n": 5})
+        time.sleep(0.2)
+        self.assertIn(("late", 5), received)
+
+        client.disconnect()
+        server.disconnect()
+
+    def test_async_reset(self):
+        async def main():
+            server = jank.networking.AsyncServer()
+            server.interned_protocols = True
+            await server.start("localhost", 5697, False)
+
+            client = jank.networking.AsyncClient()
+            client.interned_protocols = True
+            await client.start("localhost", 5697, False)
+            await asyncio.sleep(0.2)
+            self.assertEqual(len(server._client_protocols), 1)
+
+            await server.stop()
+            self.assertEqual(server._client_protocols, {})
+            self.assertEqual(server._protocol_tables, {})
+            await client.stop()
+
+        asyncio.run(main())
+
+
+class TestNetworkingFragments(unittest.TestCase):
+    def test_reassembly(self):
+        payload = bytes(range(256)) * 20
+        datagrams = jank.networking.fragments.split(payload, 1000, 7)
+        self.assertEqual(len(datagrams), 6)
+        self.assertTrue(all(len(datagram) <= 1000 for datagram in datagrams))
+        self.assertTrue(all(jank.networking.fragments.is_fragment(d) for d in datagrams))
+        self.assertFalse(jank.networking.fragments.is_fragment(b'{"protocol": "a"}'))
+
+        reassembler = jank.networking.fragments.Reassembler()
+        # Out of order and duplicated.
+        for datagram in reversed(datagrams[1:]):
+            self.assertIsNone(reassembler.feed("peer", datagram))
+        self.assertIsNone(reassembler.feed("peer", datagrams[1]))
+        self.assertEqual(reassembler.feed("peer", datagrams[0]), payload)
+        self.assertEqual(reassembler.pending, 0)
+
+        # The same ID from another peer is another message.
+        reassembler.feed("a", datagrams[0])
+        reassembler.feed("b", datagrams[1])
+        self.assertEqual(reassembler.pending, 2)
+        reassembler.forget("a")
+        self.assertEqual(reassembler.pending, 1)
+
+    def test_timeout(self):
+        reassembler = jank.networking.fragments.Reassembler(timeout=0.1)
+        first = jank.networking.fragments.split(b"x" * 100, 50, 1)
+        second = jank.networking.fragments.split(b"y" * 100, 50, 2)
+        reassembler.feed("peer", first[0])
+        time.sleep(0.2)
+        # Incomplete messages are dropped once a new one starts.
+        reassembler.feed("peer", second[0])
+        self.assertEqual(reassembler.pending, 1)
+        for datagram in first[1:]:
+            self.assertIsNone(reassembler.feed("peer", datagram))
+
+    def test_large_udp(self):
+        server = jank.networking.Server()
+        client = jank.networking.Client()
+        received = []
+        server.register_protocol(
+            lambda socket, positions: received.append(("server", positions)), "positions"
+        )
+        client.register_protocol(
+            lambda positions: received.append(("client", positions)), "positions"
+        )
+        server.connect("localhost", 5665, True)
+        client.connect("localhost", 5665, True)
+        time.sleep(0.3)
+
+        positions = {str(i): [i, i * 2] for i in range(1000)}
+        message = server.prepare("positions", {"positions": positions})
+        self.assertGreater(len(message), server.udp_buffer)
+        server.broadcast("positions", {"positions": positions}, network_protocol=server.UDP)
+        client.send("positions", {"positions": positions}, network_protocol=client.UDP)
+        time.sleep(0.3)
+        self.assertIn(("client", positions), received)
+        self.assertIn(("server", positions), received)
+
+        client.disconnect()
+        server.disconnect()
+
+
+class LockstepApplication(jank.Application):
+    def __init__(self, push):
+        super().__init__(windowless=True)
+        self.push = push
+        self.body = jank.physics.Body(1, 10)
+        self.physics_space.add(self.body)
+        self.client = jank.networking.Client()
+        self.desyncs = []
+        self.lockstep = jank.networking.Lockstep(
+            self.client, lambda: {"push": self.push}, desync=self.desyncs.append
+        )
+
+    def on_fixed_update(self, dt):
+        for player, controls in sorted(self.lockstep.inputs.items()):
+            self.body.velocity += (controls["push"] * (player + 1), 0)
+        self.physics_space.step(dt)
+
+
+class TestNetworkingLockstep(unittest.TestCase):
+    def run_until(self, condition, *applications):
+        end = time.monotonic() + 5
+        while not condition() and time.monotonic() < end:
+            for application in applications:
+                application._fixed_update(0)
+            time.sleep(0.005)
+
+    def test_lockstep(self):
+        server = jank.networking.Server()
+        desyncs = []
+        relay = jank.networking.LockstepRelay(
+            server, input_delay=4, hash_interval=10,
+            desync=lambda tick, digests: desyncs.append(tick)
+        )
+        server.connect("localhost", 5670, False)
+
+        a, b = LockstepApplication(1), LockstepApplication(2)
+        a.client.connect("localhost", 5670, False)
+        b.client.connect("localhost", 5670, False)
+        time.sleep(0.3)
+
+        # Nothing runs before the game starts.
+        a._fixed_update(0)
+        self.assertEqual(a.lockstep.tick, 0)
+
+        relay.start()
+        time.sleep(0.2)
+        self.assertEqual({a.lockstep.player, b.lockstep.player}, {0, 1})
+        self.run_until(lambda: min(a.lockstep.tick, b.lockstep.tick) >= 30, a, b)
+        self.assertGreaterEqual(min(a.lockstep.tick, b.lockstep.tick), 30)
+
+        # A player can't get more than the input delay ahead of another.
+        b.lockstep.stalls = 0
+        self.run_until(lambda: b.lockstep.stalls >= 5, b)
+        self.assertEqual(b.lockstep.tick, a.lockstep.tick + 4)
+
+        # Catching up runs several ticks at once and could skip past b.
+        a.lockstep.catch_up = 0
+        self.run_until(lambda: a.lockstep.tick == b.lockstep.tick, a)
+        self.assertEqual(a.lockstep.tick, b.lockstep.tick)
+        state_hash = jank.networking.lockstep.state_hash
+        self.assertEqual(state_hash(a.physics_space), state_hash(b.physics_space))
+        self.assertNotEqual(a.body.velocity.x, 0)
+
+        time.sleep(0.2)
+        self.assertEqual(desyncs, [])
+        b.body.position = (5, 5)
+        self.run_until(lambda: bool(desyncs) and bool(a.desyncs), a, b)
+        self.assertEqual(len(desyncs), 1)
+        self.assertEqual(a.desyncs, desyncs)
+
+        relay.stop()
+        a.client.disconnect()
+        b.client.disconnect()
+        server.disconnect()
+
+    def test_restart(self):
+        lockstep = jank.networking.Lockstep(jank.networking.Client(), sample=dict)
+        lockstep._lockstep_start(1, 0, 2, 0)
+        lockstep._lockstep_tick(1, 2, [(0, {"old": True})])
+        lockstep._lockstep_start(2, 0, 2, 0)
+        # A late tick from the first game.
+        lockstep._lockstep_tick(1, 3, [(0, {"old": True})])
+        self.assertEqual(lockstep._ticks, {0: {}, 1: {}})
+
+    def test_network_protocol(self):
+        server, client = jank.networking.Server(), jank.networking.Client()
+        with self.assertRaises(TypeError):
+            jank.networking.LockstepRelay(server, network_protocol=server.UDP)
+        with self.assertRaises(TypeError):
+            jank.networking.Lockstep(client, dict, network_protocol=client.UDP)
+
+    def test_state_hash_order(self):
+        positions = [(i, i * 2) for i in range(20)]
+
+        def space(order):
+            space = jank.physics.Space()
+            bodies = [jank.physics.Body(1, 10) for _ in positions]
+            for body, position in zip(bodies, positions):
+                body.position = position
+            for i in order:
+                space.add(bodies[i])
+            return space
+
+        state_hash = jank.networking.lockstep.state_hash
+        forward = state_hash(space(range(20)))
+        self.assertEqual(forward, state_hash(space(reversed(range(20)))))
+        self.assertEqual(forward, state_hash(space([i * 7 % 20 for i in range(20)])))
+
+        moved = space(range(20))
+        list(moved.bodies)[0].position += (1, 0)
+        self.assertNotEqual(forward, state_hash(moved))
+
+
 if __name__ == '__main__':
     unittest.main()